@@ -0,0 +1,67 @@
+"""
+Compare the cost of sorting claims by time using the dateutil parser on
+every access, as ClaimMeta.time used to, against the memoized fast
+RFC3339 parser.
+
+Run with: python benchmarks/claim_time.py [claim_count]
+"""
+
+import sys
+import timeit
+
+
+def make_raw_claims(count):
+    import random
+    rand = random.Random(1)
+    return [
+        {
+            "blobref": "sha1-%040x" % i,
+            "date": "2013-%02i-%02iT%02i:%02i:%02i.%09iZ" % (
+                rand.randint(1, 12),
+                rand.randint(1, 28),
+                rand.randint(0, 23),
+                rand.randint(0, 59),
+                rand.randint(0, 59),
+                rand.randint(0, 999999999),
+            ),
+            "type": "set-attribute",
+        }
+        for i in xrange(count)
+    ]
+
+
+def sort_with_dateutil(raw_claims):
+    from dateutil.parser import parse
+    return sorted(raw_claims, key=lambda raw: parse(raw["date"]))
+
+
+def sort_with_claim_meta(raw_claims):
+    from camlistore.searchclient import ClaimMeta
+    claims = [ClaimMeta(raw) for raw in raw_claims]
+    return sorted(claims, key=lambda claim: claim.time)
+
+
+def sort_with_parse_claims(raw_claims):
+    from camlistore.searchclient import parse_claims
+    return parse_claims(raw_claims)
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 10000
+    raw_claims = make_raw_claims(count)
+
+    for func in (
+        sort_with_dateutil,
+        sort_with_claim_meta,
+        sort_with_parse_claims,
+    ):
+        elapsed = min(timeit.repeat(
+            lambda: func(raw_claims),
+            number=1,
+            repeat=3,
+        ))
+        print "%-24s %8i claims %8.3fs" % (func.__name__, count, elapsed)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
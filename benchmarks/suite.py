@@ -0,0 +1,327 @@
+"""
+Benchmarks for the hot paths of the blob and search clients.
+
+Each benchmark runs against a local FakeServer with controlled latency, so
+results are comparable between runs on the same machine. Results are
+written as JSON so that two runs -- for example, before and after some
+change -- can be compared:
+
+    python benchmarks/suite.py --output before.json
+    (make some changes)
+    python benchmarks/suite.py --output after.json --compare before.json
+
+The suite can also be run via "python setup.py benchmark".
+"""
+
+import json
+import optparse
+import os
+import sys
+import time
+
+
+BENCHMARKS = []
+
+
+def benchmark(unit, higher_is_better=True):
+    """
+    Register the decorated function as a benchmark. The function is called
+    with the parsed options and must return a dict mapping result names to
+    values in the given unit.
+    """
+    def register(func):
+        BENCHMARKS.append((func.__name__, func, unit, higher_is_better))
+        return func
+    return register
+
+
+def timed(func, repeat=3):
+    # Returns the best wall-clock time of several runs of func.
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def make_blobs(count, size, seed):
+    from camlistore.blobclient import Blob
+    prefix = "%i-%i-" % (seed, size)
+    return [
+        Blob((prefix + str(i)).ljust(size, "x")[:size])
+        for i in xrange(count)
+    ]
+
+
+def fake_connection(options, **kwargs):
+    import camlistore
+    from camlistore.fakeserver import FakeServer
+
+    server = FakeServer(latency=options.latency, **kwargs)
+    server.start()
+    return (server, camlistore.connect(server.url))
+
+
+@benchmark("MB/s")
+def ingest_throughput(options):
+    """put_multi throughput for batches of blobs of various sizes"""
+    results = {}
+    total_bytes = 4 * 1024 * 1024 if options.quick else 32 * 1024 * 1024
+    for size in (1024, 64 * 1024, 1024 * 1024):
+        count = max(1, total_bytes // size)
+        batch_size = max(1, min(count, (8 * 1024 * 1024) // size))
+        (server, conn) = fake_connection(options)
+        try:
+            runs = [0]
+
+            def ingest():
+                # Use fresh blobs each run so the server doesn't already
+                # have them.
+                runs[0] += 1
+                blobs = make_blobs(count, size, runs[0])
+                for start in xrange(0, count, batch_size):
+                    conn.blobs.put_multi(*blobs[start:start + batch_size])
+
+            elapsed = timed(ingest)
+        finally:
+            server.stop()
+        results["size_%i" % size] = (count * size / 1048576.0) / elapsed
+    return results
+
+
+@benchmark("blobs/s")
+def stat_batch(options):
+    """get_size_multi rate for various batch sizes"""
+    results = {}
+    (server, conn) = fake_connection(options)
+    try:
+        blobs = make_blobs(1000, 16, 0)
+        blobrefs = [blob.blobref for blob in blobs]
+        # Half of the blobs exist, so both hits and misses are measured.
+        for blob in blobs[::2]:
+            server.add_blob(blob.data)
+        sizes = conn.blobs.get_size_multi(*blobrefs)
+        hits = sum(1 for size in sizes.values() if size is not None)
+        assert hits == len(blobs) // 2, "expected %i hits, got %i" % (
+            len(blobs) // 2,
+            hits,
+        )
+        for batch_size in (1, 10, 100, 1000):
+            count = 200 if batch_size < 100 else 1000
+
+            def stat():
+                for start in xrange(0, count, batch_size):
+                    conn.blobs.get_size_multi(
+                        *blobrefs[start:start + batch_size]
+                    )
+
+            results["batch_%i" % batch_size] = count / timed(stat)
+    finally:
+        server.stop()
+    return results
+
+
+@benchmark("blobs/s")
+def enumerate_rate(options):
+    """enumerate() rate over a populated store"""
+    count = 2000 if options.quick else 20000
+    (server, conn) = fake_connection(options)
+    try:
+        for i in xrange(count):
+            server.storage.put("sha1-%040x" % i, "x" * 10)
+        elapsed = timed(lambda: list(conn.blobs.enumerate()))
+    finally:
+        server.stop()
+    return {"enumerate": count / elapsed}
+
+
+@benchmark("bytes", higher_is_better=False)
+def enumerate_memory(options):
+    """approximate retained memory per enumerated BlobMeta"""
+    from camlistore.blobclient import BlobMeta
+    count = 10000
+    metas = [
+        BlobMeta("sha1-%040x" % i, size=i, blob_client=None)
+        for i in xrange(count)
+    ]
+    total = sum(deep_sizeof(meta) for meta in metas)
+    return {"per_item": float(total) / count}
+
+
+def deep_sizeof(obj):
+    # Approximate retained size of a simple object with a __dict__ or
+    # __slots__ holding strings and numbers. Shared objects such as small
+    # integers and None are not counted.
+    size = sys.getsizeof(obj)
+    values = []
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+        values.extend(obj.__dict__.values())
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, "__slots__", ()):
+            if hasattr(obj, name):
+                values.append(getattr(obj, name))
+    for value in values:
+        if isinstance(value, (str, unicode, long, float)):
+            size += sys.getsizeof(value)
+        elif isinstance(value, int) and not -5 <= value <= 256:
+            size += sys.getsizeof(value)
+        elif hasattr(value, "__slots__") or hasattr(value, "__dict__"):
+            size += deep_sizeof(value)
+    return size
+
+
+@benchmark("ms", higher_is_better=False)
+def describe_latency(options):
+    """mean describe_blob latency, uncached and with a DescribeCache"""
+    from camlistore.searchclient import DescribeCache
+
+    (server, conn) = fake_connection(options)
+    try:
+        blobref = server.add_blob(json.dumps({
+            "camliVersion": 1,
+            "camliType": "permanode",
+            "random": "benchmark",
+        }))
+        count = 50
+        searcher = conn.searcher
+
+        def describe():
+            for i in xrange(count):
+                searcher.describe_blob(blobref)
+
+        uncached = timed(describe)
+        searcher.describe_cache = DescribeCache()
+        cached = timed(describe)
+    finally:
+        server.stop()
+    return {
+        "uncached": uncached * 1000.0 / count,
+        "cached": cached * 1000.0 / count,
+    }
+
+
+@benchmark("MB/s")
+def hashing_throughput(options):
+    """Blob.blobref hashing throughput for various blob sizes"""
+    from camlistore.blobclient import Blob
+    results = {}
+    total_bytes = 16 * 1024 * 1024
+    for size in (1024, 64 * 1024, 1024 * 1024):
+        count = total_bytes // size
+        datas = [("%i-" % i).ljust(size, "y") for i in xrange(count)]
+
+        def hash_all():
+            for data in datas:
+                Blob(data).blobref
+
+        results["size_%i" % size] = (total_bytes / 1048576.0) / timed(
+            hash_all,
+        )
+    return results
+
+
+@benchmark("claims/s")
+def claim_sorting(options):
+    """sorting claims by time via parse_claims"""
+    from claim_time import make_raw_claims, sort_with_parse_claims
+    count = 20000
+    raw_claims = make_raw_claims(count)
+    return {
+        "parse_claims": count / timed(
+            lambda: sort_with_parse_claims(raw_claims),
+        ),
+    }
+
+
+def git_revision():
+    import subprocess
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(options):
+    results = {}
+    for (name, func, unit, higher_is_better) in BENCHMARKS:
+        if options.filter and options.filter not in name:
+            continue
+        sys.stderr.write("running %s...\n" % name)
+        for (key, value) in sorted(func(options).items()):
+            results["%s.%s" % (name, key)] = {
+                "value": value,
+                "unit": unit,
+                "higher_is_better": higher_is_better,
+            }
+    return {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "latency": options.latency,
+        "results": results,
+    }
+
+
+def print_report(report, baseline=None):
+    baseline_results = baseline["results"] if baseline else {}
+    for name in sorted(report["results"]):
+        result = report["results"][name]
+        line = "%-36s %12.2f %-9s" % (name, result["value"], result["unit"])
+        old = baseline_results.get(name)
+        if old is not None and old["value"]:
+            ratio = result["value"] / old["value"]
+            if not result["higher_is_better"]:
+                ratio = 1 / ratio if ratio else float("inf")
+            line += " %6.2fx %s" % (
+                ratio,
+                "faster" if ratio >= 1 else "slower",
+            )
+        print line
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option(
+        "--output", "-o",
+        help="write machine-readable results to this JSON file",
+    )
+    parser.add_option(
+        "--compare", "-c",
+        help="compare against results previously written with --output",
+    )
+    parser.add_option(
+        "--latency", type="float", default=0.001,
+        help="simulated server latency in seconds (default %default)",
+    )
+    parser.add_option(
+        "--filter", "-k",
+        help="only run benchmarks whose names contain this string",
+    )
+    parser.add_option(
+        "--quick", action="store_true", default=False,
+        help="use smaller workloads",
+    )
+    (options, args) = parser.parse_args(argv[1:])
+
+    report = run(options)
+
+    baseline = None
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+
+    print_report(report, baseline)
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -15,11 +15,41 @@ class BlobClient(object):
     :py:func:`camlistore.connect` to obtain a
     :py:class:`camlistore.Connection`
     object and access :py:attr:`camlistore.Connection.blobs`.
+
+    If ``compress_uploads`` is set, upload request bodies are compressed
+    with ``gzip`` when doing so makes them significantly smaller. Not all
+    servers accept compressed request bodies, so if the server rejects a
+    compressed upload it is retried uncompressed. If the server rejected
+    its content encoding, or accepted the retry, compression is then
+    disabled for the rest of this client's life.
     """
 
-    def __init__(self, http_session, base_url):
+    #: Whether upload request bodies are compressed, as described above.
+    compress_uploads = False
+
+    def __init__(
+        self,
+        http_session,
+        base_url,
+        observers=None,
+        compress_uploads=False,
+    ):
         self.http_session = http_session
         self.base_url = base_url
+        self.observers = observers if observers is not None else []
+        self.compress_uploads = compress_uploads
+
+    def _request(self, operation, method, url, **kwargs):
+        from camlistore.metrics import observed_request
+        return observed_request(
+            self.http_session,
+            self.observers,
+            operation,
+            "blob",
+            method,
+            url,
+            **kwargs
+        )
 
     def _make_url(self, path):
         if self.base_url is not None:
@@ -43,9 +73,14 @@ class BlobClient(object):
         Returns a :py:class:`camlistore.Blob` instance describing the
         blob, or raises :py:class:`camlistore.exceptions.NotFoundError` if
         the given blobref is not known to the server.
+
+        The blob's data is checked against its blobref after any transfer
+        encoding has been decoded, raising
+        :py:class:`camlistore.exceptions.HashMismatchError` if they do not
+        match.
         """
         blob_url = self._make_blob_url(blobref)
-        resp = self.http_session.get(blob_url)
+        resp = self._request("get", "get", blob_url, blob_count=1)
         if resp.status_code == 200:
             return Blob(resp.content, blobref=blobref)
         elif resp.status_code == 404:
@@ -63,6 +98,187 @@ class BlobClient(object):
                 )
             )
 
+    def get_range(self, blobref, offset, length=None):
+        """
+        Get part of the data for a blob, given its blobref.
+
+        Returns a :py:class:`str` of up to ``length`` bytes of the blob's
+        data starting at byte ``offset``, or all of the data from
+        ``offset`` onwards if ``length`` is not given. The result is
+        shorter than requested if the blob ends sooner, and is empty if
+        ``offset`` is beyond the end of the blob.
+
+        Only the requested bytes are transferred if the server supports
+        HTTP range requests, which makes this suitable for inspecting
+        the start of a large blob. Since the whole blob is not retrieved,
+        the data *cannot* be checked against the blobref.
+
+        Raises :py:class:`camlistore.exceptions.NotFoundError` if
+        the given blobref is not known to the server.
+        """
+        if length is not None and length <= 0:
+            return ""
+
+        if length is not None:
+            byte_range = "bytes=%i-%i" % (offset, offset + length - 1)
+        else:
+            byte_range = "bytes=%i-" % offset
+
+        blob_url = self._make_blob_url(blobref)
+        resp = self._request(
+            "get_range",
+            "get",
+            blob_url,
+            blob_count=1,
+            headers={
+                "Range": byte_range,
+                # Ranges of an encoded body are useless to us.
+                "Accept-Encoding": "identity",
+            },
+        )
+        if resp.status_code == 206:
+            return resp.content
+        elif resp.status_code == 200:
+            # Server ignored the range and sent the whole blob.
+            end = offset + length if length is not None else None
+            return resp.content[offset:end]
+        elif resp.status_code == 416:
+            return ""
+        elif resp.status_code == 404:
+            from camlistore.exceptions import NotFoundError
+            raise NotFoundError(
+                "Blob not found: %s" % blobref,
+            )
+        else:
+            from camlistore.exceptions import ServerError
+            raise ServerError(
+                "Failed to get blob %s: server returned %i %s" % (
+                    blobref,
+                    resp.status_code,
+                    resp.reason,
+                )
+            )
+
+    def download(self, blobref, f, max_retries=3, chunk_size=65536):
+        """
+        Write the data for a blob to the given file-like object, given its
+        blobref.
+
+        Unlike :py:meth:`get`, the data is streamed to the file rather
+        than held in memory. If the connection drops partway through, the
+        download is resumed from the last byte received using a range
+        request, up to ``max_retries`` times before the connection error
+        is raised.
+
+        Once the whole blob has been received its data is checked against
+        the blobref, raising
+        :py:class:`camlistore.exceptions.HashMismatchError` if they do not
+        match. By then the data has already been written to ``f``, so
+        callers should discard it in that case.
+
+        Returns the size of the blob in bytes, or raises
+        :py:class:`camlistore.exceptions.NotFoundError` if the given
+        blobref is not known to the server.
+        """
+        import hashlib
+        from requests.exceptions import ConnectionError, ChunkedEncodingError
+
+        blob_url = self._make_blob_url(blobref)
+        hash_func_name = blobref.split('-', 1)[0]
+        hasher = hashlib.new(hash_func_name)
+        received = 0
+        total = None
+        retries = 0
+
+        while total is None or received < total:
+            headers = {"Accept-Encoding": "identity"}
+            if received:
+                headers["Range"] = "bytes=%i-" % received
+            try:
+                resp = self._request(
+                    "download",
+                    "get",
+                    blob_url,
+                    blob_count=1,
+                    headers=headers,
+                    stream=True,
+                )
+                try:
+                    total = self._download_size(blobref, resp, received)
+                    # If the server ignored our range, skip what we
+                    # already have.
+                    skip = received if resp.status_code == 200 else 0
+                    for chunk in resp.iter_content(chunk_size):
+                        if skip:
+                            dropped = min(skip, len(chunk))
+                            chunk = chunk[dropped:]
+                            skip -= dropped
+                        if chunk:
+                            f.write(chunk)
+                            hasher.update(chunk)
+                            received += len(chunk)
+                finally:
+                    resp.close()
+            except (ConnectionError, ChunkedEncodingError):
+                if retries >= max_retries:
+                    raise
+                retries += 1
+                continue
+
+            if total is None:
+                # Without a known size we can only assume we're done.
+                break
+            if received < total:
+                # Connection closed early without an error.
+                if retries >= max_retries:
+                    from camlistore.exceptions import ServerError
+                    raise ServerError(
+                        "Download of blob %s ended after %i of %i bytes" % (
+                            blobref,
+                            received,
+                            total,
+                        )
+                    )
+                retries += 1
+
+        apparent_blobref = "%s-%s" % (hash_func_name, hasher.hexdigest())
+        if apparent_blobref != blobref:
+            from camlistore.exceptions import HashMismatchError
+            raise HashMismatchError(
+                "Expected blobref %s but downloaded data has blobref %s" % (
+                    blobref,
+                    apparent_blobref,
+                )
+            )
+
+        return received
+
+    def _download_size(self, blobref, resp, received):
+        # Returns the total size of the blob being downloaded, as far as
+        # we can tell from the response, or raises an error if the
+        # response is unsuccessful.
+        if resp.status_code == 206:
+            content_range = resp.headers.get("content-range") or ""
+            total = content_range.rsplit("/", 1)[-1]
+            return int(total) if total.isdigit() else None
+        elif resp.status_code == 200:
+            length = resp.headers.get("content-length")
+            return int(length) if length is not None else None
+        elif resp.status_code == 404:
+            from camlistore.exceptions import NotFoundError
+            raise NotFoundError(
+                "Blob not found: %s" % blobref,
+            )
+        else:
+            from camlistore.exceptions import ServerError
+            raise ServerError(
+                "Failed to get blob %s: server returned %i %s" % (
+                    blobref,
+                    resp.status_code,
+                    resp.reason,
+                )
+            )
+
     def get_size(self, blobref):
         """
         Get the size of a blob, given its blobref.
@@ -72,7 +288,7 @@ class BlobClient(object):
         the given blobref is not known to the server.
         """
         blob_url = self._make_blob_url(blobref)
-        resp = self.http_session.request('HEAD', blob_url)
+        resp = self._request("get_size", "head", blob_url, blob_count=1)
         if resp.status_code == 200:
             return int(resp.headers['content-length'])
         elif resp.status_code == 404:
@@ -109,10 +325,21 @@ class BlobClient(object):
         else:
             return True
 
-    def enumerate(self):
+    def enumerate(self, after=None, validate=False):
         """
         Enumerate all of the blobs on the server, in blobref order.
 
+        If ``after`` is given, enumeration begins with the first blob
+        whose blobref sorts after the given one, which allows an earlier
+        enumeration to be resumed.
+
+        If ``validate`` is true, the blobrefs of the returned
+        :py:class:`BlobMeta` objects are
+        :py:class:`camlistore.blobref.Blobref` objects, validated a page at
+        a time. Callers that will keep many of them in memory should keep
+        each one's :py:attr:`camlistore.blobref.Blobref.key`, which is
+        much smaller.
+
         Returns an iterable over all of the blobs. The underlying server
         interface returns the resultset in chunks, so beginning iteration
         will cause one request but continued iteration may cause followup
@@ -127,11 +354,14 @@ class BlobClient(object):
         from urlparse import urljoin
         import json
         plain_enum_url = self._make_url("camli/enumerate-blobs")
-        next_enum_url = plain_enum_url
+        if after is not None:
+            next_enum_url = urljoin(plain_enum_url, "?after=" + after)
+        else:
+            next_enum_url = plain_enum_url
 
         while next_enum_url is not None:
 
-            resp = self.http_session.get(next_enum_url)
+            resp = self._request("enumerate", "get", next_enum_url)
             if resp.status_code != 200:
                 from camlistore.exceptions import ServerError
                 raise ServerError(
@@ -152,13 +382,37 @@ class BlobClient(object):
             else:
                 next_enum_url = None
 
-            for raw_blob_reference in data["blobs"]:
+            raw_blobs = data["blobs"]
+            if validate:
+                from camlistore.blobref import parse_blobrefs
+                blobrefs = parse_blobrefs(
+                    raw_blob["blobRef"] for raw_blob in raw_blobs
+                )
+            else:
+                blobrefs = [raw_blob["blobRef"] for raw_blob in raw_blobs]
+
+            for (blobref, raw_blob) in zip(blobrefs, raw_blobs):
                 yield BlobMeta(
-                    raw_blob_reference["blobRef"],
-                    size=raw_blob_reference["size"],
+                    blobref,
+                    size=raw_blob["size"],
                     blob_client=self,
                 )
 
+    def tail(self, **kwargs):
+        """
+        Create a :py:class:`camlistore.tail.BlobTail` that yields each
+        blob in the store and then continues to yield new blobs as they
+        are uploaded, for keeping a replica or index up to date.
+
+        Unlike repeatedly calling :py:meth:`enumerate`, the tail uses the
+        server's long polling to wait for new blobs, and its checkpoint
+        allows it to resume without producing the same blobs again.
+        Keyword arguments are passed on to the
+        :py:class:`camlistore.tail.BlobTail` initializer.
+        """
+        from camlistore.tail import BlobTail
+        return BlobTail(self, **kwargs)
+
     def put(self, blob):
         """
         Write a single blob into the store.
@@ -196,7 +450,13 @@ class BlobClient(object):
             form_data["blob%i" % (i + 1)] = blobref
 
         stat_url = self._make_url('camli/stat')
-        resp = self.http_session.post(stat_url, data=form_data)
+        resp = self._request(
+            "stat",
+            "post",
+            stat_url,
+            blob_count=len(blobrefs),
+            data=form_data,
+        )
 
         if resp.status_code != 200:
             from camlistore.exceptions import ServerError
@@ -228,50 +488,160 @@ class BlobClient(object):
         this function will fail if that limit is exceeded. It is intended
         that this will be fixed in a future version.
         """
-        import hashlib
+        from camlistore.tracing import span
 
-        upload_url = self._make_url('camli/upload')
+        with span(
+            "camlistore.put_multi",
+            blob_count=len(blobs),
+            bytes=sum(blob.size for blob in blobs),
+        ) as current_span:
+            upload_url = self._make_url('camli/upload')
 
-        blobrefs = [
-            blob.blobref for blob in blobs
-        ]
+            blobrefs = [
+                blob.blobref for blob in blobs
+            ]
 
-        sizes = self.get_size_multi(*blobrefs)
+            sizes = self.get_size_multi(*blobrefs)
 
-        files_to_post = {}
+            files_to_post = []
+            seen = set()
 
-        for blob in blobs:
-            blobref = blob.blobref
+            for blob in blobs:
+                blobref = blob.blobref
 
-            if sizes[blobref] is not None:
-                # Server already has this blob, so skip
-                continue
+                if sizes[blobref] is not None or blobref in seen:
+                    # Server already has this blob, or it was given more
+                    # than once, so skip
+                    continue
+
+                files_to_post.append((blobref, blob.data))
+                seen.add(blobref)
 
-            files_to_post[blobref] = (
-                blobref,
-                blob.data,
-                'application/octet-stream',
+            current_span.set_attribute(
+                "camlistore.upload_count",
+                len(files_to_post),
             )
 
-        if len(files_to_post) == 0:
-            # Server already has everything, so nothing to do.
-            return blobrefs
+            if len(files_to_post) == 0:
+                # Server already has everything, so nothing to do.
+                return blobrefs
 
-        # FIXME: We should detect if our total upload size is >32MB
-        # and automatically split it into multiple requests, since the
-        # protocol forbids upload payloads greater than 32MB.
-        resp = self.http_session.post(upload_url, files=files_to_post)
+            # FIXME: We should detect if our total upload size is >32MB
+            # and automatically split it into multiple requests, since the
+            # protocol forbids upload payloads greater than 32MB.
+            resp = self._upload(upload_url, files_to_post)
 
-        if resp.status_code != 200:
-            from camlistore.exceptions import ServerError
-            raise ServerError(
-                "Failed to upload blobs: got %i %s" % (
-                    resp.status_code,
-                    resp.reason,
+            if resp.status_code != 200:
+                from camlistore.exceptions import ServerError
+                raise ServerError(
+                    "Failed to upload blobs: got %i %s" % (
+                        resp.status_code,
+                        resp.reason,
+                    )
                 )
-            )
 
-        return blobrefs
+            return blobrefs
+
+    def _upload(self, upload_url, files_to_post):
+        from camlistore.multipart import MultipartBody
+
+        # The body is streamed from the blobs' data as it is sent, rather
+        # than being built in memory.
+        body = MultipartBody(files_to_post)
+        blob_count = len(files_to_post)
+        bytes_up = body.data_size
+
+        if self.compress_uploads:
+            from camlistore.compression import compressed_multipart
+            compressed = compressed_multipart(body)
+            if compressed is not None:
+                (compressed_body, headers) = compressed
+                resp = self._request(
+                    "upload",
+                    "post",
+                    upload_url,
+                    blob_count=blob_count,
+                    bytes_up=bytes_up,
+                    wire_bytes_up=len(compressed_body),
+                    data=compressed_body,
+                    headers=headers,
+                )
+                if resp.status_code not in (400, 415):
+                    return resp
+                retry_resp = self._upload_uncompressed(
+                    upload_url, body, blob_count,
+                )
+                # The server doesn't understand compressed bodies if it
+                # says so, or if it accepts the same body uncompressed
+                # after rejecting it compressed, so don't try again.
+                # Other failures are no reason to stop compressing.
+                if resp.status_code == 415 or retry_resp.status_code == 200:
+                    self.compress_uploads = False
+                return retry_resp
+
+        return self._upload_uncompressed(upload_url, body, blob_count)
+
+    def _upload_uncompressed(self, upload_url, body, blob_count):
+        # The body may have been read already while compressing it.
+        body.rewind()
+        return self._request(
+            "upload",
+            "post",
+            upload_url,
+            blob_count=blob_count,
+            bytes_up=body.data_size,
+            data=body,
+            headers={"Content-Type": body.content_type},
+        )
+
+    def uploader(self, **kwargs):
+        """
+        Create a :py:class:`camlistore.uploader.Uploader` for uploading
+        a stream of blobs to this store.
+
+        Unlike :py:meth:`put_multi`, which requires all blobs to be
+        provided at once, the uploader accepts blobs one at a time and
+        uploads them in concurrent batches, blocking when too much data is
+        in flight. This allows an unbounded stream of blobs to be uploaded
+        with bounded memory usage. Keyword arguments are passed on to the
+        :py:class:`camlistore.uploader.Uploader` initializer.
+        """
+        from camlistore.uploader import Uploader
+        return Uploader(self, **kwargs)
+
+    def put_tree(self, path, **kwargs):
+        """
+        Upload a local directory tree, returning the blobref of the
+        ``directory`` schema blob describing its root.
+
+        This is a shortcut for :py:func:`camlistore.filetree.put_tree`,
+        which describes the available keyword arguments.
+        """
+        from camlistore.filetree import put_tree
+        return put_tree(self, path, **kwargs)
+
+    def get_tree(self, blobref, dest_path, **kwargs):
+        """
+        Restore a directory tree previously uploaded with
+        :py:meth:`put_tree`, given the blobref of its root ``directory``
+        schema blob, into the local directory ``dest_path``.
+
+        This is a shortcut for :py:func:`camlistore.filetree.get_tree`,
+        which describes the available keyword arguments.
+        """
+        from camlistore.filetree import get_tree
+        return get_tree(self, blobref, dest_path, **kwargs)
+
+    def diff_trees(self, old_ref, new_ref, **kwargs):
+        """
+        Compare two stored directory trees, given the blobrefs of their
+        root ``directory`` schema blobs, yielding the differences.
+
+        This is a shortcut for :py:func:`camlistore.filetree.diff_trees`,
+        which describes the result and the available keyword arguments.
+        """
+        from camlistore.filetree import diff_trees
+        return diff_trees(self, old_ref, new_ref, **kwargs)
 
 
 class Blob(object):
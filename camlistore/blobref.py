@@ -0,0 +1,181 @@
+class Blobref(str):
+    """
+    A validated blobref.
+
+    ``blobref`` is the usual string form of a blobref, such as
+    ``"sha1-0beec7b5ea3f0fdbc95d0dd47f3c5bc275da8a33"``, which is
+    validated; :py:exc:`ValueError` is raised if it is malformed or uses a
+    hash algorithm not listed in :py:data:`ALGORITHMS`. Many blobrefs can
+    be validated more quickly at once by :py:func:`parse_blobrefs`.
+
+    Since this class is a :py:class:`str` whose value is the blobref's
+    usual string form, an instance compares equal to and hashes the same
+    as that string, and can be used anywhere a blobref string can be.
+
+    To keep many millions of blobrefs in memory -- such as in a set for
+    finding duplicates -- it is best to keep each one's :py:attr:`key`
+    instead, a plain string holding a single byte identifying the hash
+    algorithm followed by the raw digest, which is less than half the size
+    of the usual form. Convert back with :py:meth:`from_key` when needed.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, blobref):
+        if isinstance(blobref, Blobref):
+            return blobref
+        try:
+            text = str(blobref)
+        except UnicodeEncodeError:
+            raise ValueError("Invalid blobref %r" % blobref)
+        (algorithm, sep, hexdigest) = text.partition("-")
+        if algorithm not in _ALGORITHM_IDS:
+            raise ValueError("Invalid blobref %r" % blobref)
+        digest_size = ALGORITHMS[algorithm]
+        if len(hexdigest) != digest_size * 2 or not _is_hex(hexdigest):
+            raise ValueError("Invalid blobref %r" % blobref)
+        return str.__new__(cls, text)
+
+    @classmethod
+    def from_digest(cls, algorithm, digest):
+        """
+        Create a :py:class:`Blobref` from the name of a hash algorithm and
+        a raw digest, as returned by the ``digest`` method of a
+        :py:mod:`hashlib` hash object.
+        """
+        import binascii
+
+        if algorithm not in _ALGORITHM_IDS:
+            raise ValueError("Unsupported hash algorithm %r" % algorithm)
+        if len(digest) != ALGORITHMS[algorithm]:
+            raise ValueError(
+                "Digest for %s must be %i bytes, not %i" % (
+                    algorithm,
+                    ALGORITHMS[algorithm],
+                    len(digest),
+                )
+            )
+        return str.__new__(
+            cls,
+            "%s-%s" % (algorithm, binascii.hexlify(digest)),
+        )
+
+    @classmethod
+    def from_key(cls, key):
+        """
+        Create a :py:class:`Blobref` from a value of :py:attr:`key`.
+        """
+        algorithm = _ALGORITHM_NAMES.get(key[:1])
+        if algorithm is None or len(key) != ALGORITHMS[algorithm] + 1:
+            raise ValueError("Invalid blobref key %r" % key)
+        return cls.from_digest(algorithm, key[1:])
+
+    @property
+    def key(self):
+        """
+        The compact form of this blobref as a plain :py:class:`str`, which
+        is hashable and sorts in the same order as blobrefs do, and is
+        the smallest way to keep a blobref in memory.
+        """
+        (algorithm, sep, hexdigest) = self.partition("-")
+        return _ALGORITHM_IDS[algorithm] + _unhexlify(hexdigest)
+
+    @property
+    def algorithm(self):
+        """
+        The name of the hash algorithm, such as ``"sha1"``.
+        """
+        return self.partition("-")[0]
+
+    @property
+    def digest(self):
+        """
+        The raw digest, as a :py:class:`str` of bytes.
+        """
+        return _unhexlify(self.partition("-")[2])
+
+    @property
+    def hexdigest(self):
+        """
+        The digest as a string of lowercase hexadecimal digits.
+        """
+        return self.partition("-")[2]
+
+    def __repr__(self):
+        return "Blobref(%r)" % str(self)
+
+    def __reduce__(self):
+        return (Blobref, (str(self),))
+
+
+#: The hash algorithms that :py:class:`Blobref` can represent, mapped to
+#: the sizes of their digests in bytes.
+ALGORITHMS = {
+    "sha1": 20,
+    "sha224": 28,
+    "sha256": 32,
+    "sha384": 48,
+    "sha512": 64,
+}
+
+
+def parse_blobrefs(blobrefs):
+    """
+    Parse an iterable of blobref strings, returning a list of
+    :py:class:`Blobref` objects.
+
+    This is equivalent to calling :py:class:`Blobref` for each blobref,
+    but the digests of all of the blobrefs using each hash algorithm are
+    validated together, which is considerably faster for large batches
+    such as the pages returned by
+    :py:meth:`camlistore.blobclient.BlobClient.enumerate`. Raises
+    :py:exc:`ValueError` if any of the blobrefs is malformed.
+    """
+    blobrefs = [str(blobref) for blobref in blobrefs]
+
+    groups = {}
+    for (i, blobref) in enumerate(blobrefs):
+        (algorithm, sep, hexdigest) = blobref.partition("-")
+        group = groups.get(algorithm)
+        if group is None:
+            group = groups[algorithm] = ([], [])
+        group[0].append(i)
+        group[1].append(hexdigest)
+
+    for (algorithm, (indexes, hexdigests)) in groups.iteritems():
+        digest_size = ALGORITHMS.get(algorithm)
+        if (
+            digest_size is None or
+            len(set(map(len, hexdigests))) != 1 or
+            len(hexdigests[0]) != digest_size * 2 or
+            not _is_hex("".join(hexdigests))
+        ):
+            # Parse the group one at a time to report the culprit.
+            for i in indexes:
+                Blobref(blobrefs[i])
+
+    new = str.__new__
+    return [new(Blobref, blobref) for blobref in blobrefs]
+
+
+def _is_hex(text):
+    # Blobrefs use lowercase digits only, so that each blob has exactly one
+    # blobref; unhexlify would also accept uppercase.
+    return not text.translate(None, "0123456789abcdef")
+
+
+def _unhexlify(text):
+    import binascii
+    return binascii.unhexlify(text)
+
+
+# The algorithm IDs are assigned in name order, so that keys sort in the
+# same order as the blobrefs' string forms.
+_ALGORITHM_IDS = dict(
+    (algorithm, chr(i + 1))
+    for (i, algorithm) in enumerate(sorted(ALGORITHMS))
+)
+_ALGORITHM_NAMES = dict(
+    (algorithm_id, algorithm)
+    for (algorithm, algorithm_id) in _ALGORITHM_IDS.iteritems()
+)
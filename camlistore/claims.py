@@ -0,0 +1,250 @@
+class AttributeResolver(object):
+    """
+    Client-side resolver for permanode attributes.
+
+    The indexer flattens the claims on a permanode into a set of attributes
+    whenever a permanode is described, but answering the same question
+    for many different points in time would require one describe request
+    per timestamp. This class instead folds claims, as returned by
+    :py:meth:`camlistore.searchclient.SearchClient.get_claims_for_permanode`,
+    into attribute maps locally.
+
+    Claims for each permanode are kept in a log sorted by claim time, so
+    new claims can be added at any time via :py:meth:`add_claims` and only
+    the affected part of the log is re-processed. Every
+    ``checkpoint_interval`` claims a snapshot of the attribute map is
+    retained, so a query for the state at a given time is answered by
+    a binary search over the log followed by applying at most
+    ``checkpoint_interval`` claims to the nearest snapshot.
+
+    The resulting attribute maps have attribute names as keys and lists
+    of values as values, since each attribute may have multiple values.
+    """
+
+    def __init__(self, checkpoint_interval=32):
+        self.checkpoint_interval = checkpoint_interval
+        self._logs = {}
+
+    def add_claims(self, claims):
+        """
+        Add claims, given as an iterable of
+        :py:class:`camlistore.searchclient.ClaimMeta`, to the resolver.
+
+        Claims may be for any number of different permanodes, and may be
+        given in any order. Claims already known to the resolver are
+        ignored, so it is safe to add the full set of claims for a
+        permanode again after more claims have been made.
+        """
+        for claim in claims:
+            permanode = claim.permanode_blobref
+            log = self._logs.get(permanode)
+            if log is None:
+                log = _ClaimLog(self.checkpoint_interval)
+                self._logs[permanode] = log
+            log.add(claim)
+
+    def attributes(self, permanode_blobref, at=None):
+        """
+        Return the attributes of the given permanode as of the given
+        :py:class:`datetime.datetime`, or as of the latest known claim
+        if no time is given.
+
+        Naive datetimes are assumed to be in UTC. The result is a
+        new :py:class:`dict` mapping attribute names to lists of values,
+        which the caller is free to modify.
+        """
+        log = self._logs.get(permanode_blobref)
+        if log is None:
+            return {}
+
+        return _copy_attrs(log.state_at(at))
+
+    def attribute(self, permanode_blobref, name, at=None):
+        """
+        Return the first value of a single attribute of the given permanode
+        as of the given time, or ``None`` if the attribute is not set.
+        """
+        log = self._logs.get(permanode_blobref)
+        if log is None:
+            return None
+
+        values = log.state_at(at).get(name)
+        if values:
+            return values[0]
+        else:
+            return None
+
+    def claims(self, permanode_blobref):
+        """
+        Return the known claims for the given permanode, in time order.
+        """
+        log = self._logs.get(permanode_blobref)
+        if log is None:
+            return []
+        return list(log.claims)
+
+    def permanodes(self):
+        """
+        Return the blobrefs of all of the permanodes that the resolver
+        has seen claims for.
+        """
+        return self._logs.keys()
+
+
+def apply_claim(attrs, claim):
+    """
+    Apply a single claim to an attribute map, modifying it in-place.
+
+    This implements the same semantics as the indexer: ``set-attribute``
+    replaces all values of an attribute, ``add-attribute`` adds a value
+    if it is not already present, and ``del-attribute`` removes either
+    a single value or, if no value is given, the whole attribute. Other
+    claim types have no effect on attributes.
+    """
+    claim_type = claim.type
+    if claim_type not in _ATTR_CLAIM_TYPES:
+        return
+
+    name = claim.raw_dict.get("attr")
+    if name is None:
+        return
+    name = str(name)
+    value = claim.value
+
+    if claim_type == "set-attribute":
+        attrs[name] = [value]
+    elif claim_type == "add-attribute":
+        values = attrs.setdefault(name, [])
+        if value not in values:
+            values.append(value)
+    elif value is None:
+        attrs.pop(name, None)
+    else:
+        values = attrs.get(name)
+        if values is not None and value in values:
+            values.remove(value)
+            if not values:
+                del attrs[name]
+
+
+_ATTR_CLAIM_TYPES = frozenset([
+    "set-attribute",
+    "add-attribute",
+    "del-attribute",
+])
+
+
+def _copy_attrs(attrs):
+    return {name: list(values) for name, values in attrs.iteritems()}
+
+
+def _claim_sort_key(claim):
+    # Claims made at the same instant are ordered by blobref, which matches
+    # the tie-breaking rule used by the indexer and makes the order stable.
+    # Claims with no timestamp sort first, as in parse_claims.
+    return (claim.time is not None, _utc(claim.time), claim.blobref)
+
+
+def _utc(when):
+    if when is not None and when.tzinfo is None:
+        from dateutil.tz import tzutc
+        return when.replace(tzinfo=tzutc())
+    return when
+
+
+class _ClaimLog(object):
+    # The sorted claims for a single permanode, along with snapshots of
+    # the attribute map taken every "interval" claims.
+    #
+    # _checkpoints[i] is the state after applying the first i * interval
+    # claims. Checkpoints are computed lazily and discarded when a claim
+    # is inserted before the point they describe.
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.keys = []
+        self.claims = []
+        self._blobrefs = set()
+        self._checkpoints = [{}]
+
+    def add(self, claim):
+        from bisect import bisect_right
+
+        if claim.blobref in self._blobrefs:
+            return
+        self._blobrefs.add(claim.blobref)
+
+        key = _claim_sort_key(claim)
+        index = bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.claims.insert(index, claim)
+
+        # Any checkpoint that includes the insertion point is now invalid.
+        del self._checkpoints[index // self.interval + 1:]
+
+    def state_at(self, when):
+        from bisect import bisect_right
+
+        if when is None:
+            count = len(self.claims)
+        else:
+            # Find the number of claims made no later than the given time.
+            # The sentinel compares greater than any blobref, so claims
+            # made at exactly the given time are included.
+            count = bisect_right(
+                self.keys,
+                (True, _utc(when), _AFTER_ALL),
+            )
+
+        return self._state_after(count)
+
+    def _state_after(self, count):
+        interval = self.interval
+        checkpoints = self._checkpoints
+        claims = self.claims
+
+        # Extend the checkpoints up to the one just before "count".
+        while len(checkpoints) <= count // interval:
+            start = (len(checkpoints) - 1) * interval
+            attrs = _copy_attrs(checkpoints[-1])
+            for claim in claims[start:start + interval]:
+                apply_claim(attrs, claim)
+            checkpoints.append(attrs)
+
+        base_index = count // interval
+        start = base_index * interval
+        if start == count:
+            return checkpoints[base_index]
+
+        attrs = _copy_attrs(checkpoints[base_index])
+        for claim in claims[start:count]:
+            apply_claim(attrs, claim)
+        return attrs
+
+
+class _AfterAll(object):
+    # Sorts after any string, for use in bisection keys.
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+    def __eq__(self, other):
+        return other is self
+
+    def __ne__(self, other):
+        return other is not self
+
+    def __le__(self, other):
+        return other is self
+
+    def __ge__(self, other):
+        return True
+
+    def __cmp__(self, other):
+        return 0 if other is self else 1
+
+
+_AFTER_ALL = _AfterAll()
@@ -0,0 +1,198 @@
+#: Content encodings that change the size of a body on the wire.
+ENCODINGS = ("gzip", "deflate", "zstd")
+
+#: Upload bodies are only sent compressed if compression shrinks them to
+#: at most this fraction of their original size, so that already-compressed
+#: data isn't needlessly recompressed by both ends.
+MIN_UPLOAD_RATIO = 0.9
+
+
+def accept_encoding():
+    """
+    Return a value for the ``Accept-Encoding`` request header listing the
+    content encodings this library can decode.
+
+    ``gzip`` and ``deflate`` are always supported. ``zstd`` is preferred
+    when the optional ``zstandard`` package is installed, since it
+    decompresses considerably faster than ``gzip`` for a similar ratio.
+    """
+    if _zstd_module() is not None:
+        return "zstd, gzip, deflate"
+    return "gzip, deflate"
+
+
+def decode_response(resp):
+    """
+    Decode the body of a response whose content encoding is not decoded by
+    the underlying HTTP library, returning the response.
+
+    ``requests`` transparently decodes ``gzip`` and ``deflate``, and newer
+    versions of ``urllib3`` also decode ``zstd``; this fills the gap
+    for older versions. Streamed responses are left untouched.
+    """
+    encoding = resp.headers.get("content-encoding")
+    if encoding != "zstd" or "zstd" in _library_decoders():
+        return resp
+    if getattr(resp, "_content", None) is False:
+        # The body has not been read yet, which means the caller asked
+        # for it to be streamed.
+        return resp
+
+    zstandard = _zstd_module()
+    if zstandard is None:
+        from camlistore.exceptions import ServerError
+        raise ServerError(
+            "Server sent a zstd-encoded response but zstandard is not "
+            "installed"
+        )
+    # Decompressors can't be shared between threads, so make a new one.
+    decompressor = zstandard.ZstdDecompressor().decompressobj()
+    resp._content = decompressor.decompress(resp.content)
+    return resp
+
+
+def wire_size(resp, decoded_size):
+    """
+    Estimate the number of body bytes that were transferred over the wire
+    for the given response, whose decoded body is ``decoded_size`` bytes.
+    """
+    if resp.headers.get("content-encoding") not in ENCODINGS:
+        return decoded_size
+    length = resp.headers.get("content-length")
+    if length is not None:
+        return int(length)
+    tell = getattr(resp.raw, "tell", None)
+    if tell is not None:
+        return tell()
+    return decoded_size
+
+
+def gzip_compress(data, level=6):
+    """
+    Compress a string into the ``gzip`` format.
+    """
+    import zlib
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compressed_multipart(body):
+    """
+    Compress a :py:class:`camlistore.multipart.MultipartBody` with
+    ``gzip``, reading it a chunk at a time.
+
+    Returns a tuple of a :py:class:`CompressedBody` and the headers it
+    must be sent with, or ``None`` if compression does not save enough to
+    be worthwhile, in which case the body should be rewound and sent
+    uncompressed. To decide, the body is compressed once without keeping
+    the result, stopping early once it is clear that compression will not
+    save enough.
+    """
+    limit = len(body) * MIN_UPLOAD_RATIO
+    compressed_size = 0
+    for piece in _gzip_chunks(body):
+        compressed_size += len(piece)
+        if compressed_size > limit:
+            return None
+
+    return (CompressedBody(body, compressed_size), {
+        "Content-Type": body.content_type,
+        "Content-Encoding": "gzip",
+    })
+
+
+class CompressedBody(object):
+    """
+    The ``gzip``-compressed form of a
+    :py:class:`camlistore.multipart.MultipartBody`, as returned by
+    :py:func:`compressed_multipart`.
+
+    Like the body it wraps, it is compressed a chunk at a time as it is
+    sent, so no more than a chunk of it is held in memory. Since
+    compression is deterministic, its size is known from the first pass
+    made by :py:func:`compressed_multipart`, and :py:func:`len` gives it
+    for use as the ``Content-Length``.
+    """
+
+    def __init__(self, body, size):
+        self.body = body
+        self._size = size
+        self.rewind()
+
+    def read(self, size=-1):
+        """
+        Read up to ``size`` bytes of the compressed body, or the whole of
+        the rest of it if ``size`` is not given, returning an empty string
+        once the end has been reached.
+        """
+        if size is None or size < 0:
+            size = self._size
+        pieces = []
+        while size > 0:
+            if self._offset >= len(self._current):
+                self._current = next(self._chunks, "")
+                self._offset = 0
+                if not self._current:
+                    break
+            piece = self._current[self._offset:self._offset + size]
+            self._offset += len(piece)
+            size -= len(piece)
+            pieces.append(piece)
+        return "".join(pieces)
+
+    def rewind(self):
+        """
+        Return to the start of the compressed body, so that it can be read
+        again.
+        """
+        self._chunks = _gzip_chunks(self.body)
+        self._current = ""
+        self._offset = 0
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        # requests only streams bodies that are iterable.
+        self.rewind()
+        return _gzip_chunks(self.body)
+
+
+def _gzip_chunks(body):
+    # Yields the gzip-compressed form of the given MultipartBody, read from
+    # its start a chunk at a time.
+    import zlib
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    body.rewind()
+    while True:
+        chunk = body.read(body.chunk_size)
+        if not chunk:
+            break
+        piece = compressor.compress(chunk)
+        if piece:
+            yield piece
+    yield compressor.flush()
+
+
+def _library_decoders():
+    try:
+        from urllib3.response import HTTPResponse
+    except ImportError:
+        return ()
+    return getattr(HTTPResponse, "CONTENT_DECODERS", ())
+
+
+def _zstd_module():
+    global _zstd
+    if _zstd is _NOT_LOADED:
+        try:
+            import zstandard
+        except ImportError:
+            zstandard = None
+        _zstd = zstandard
+    return _zstd
+
+
+_NOT_LOADED = object()
+_zstd = _NOT_LOADED
@@ -36,28 +36,60 @@ class Connection(object):
         blob_root=None,
         search_root=None,
         sign_root=None,
+        observers=None,
+        compress_uploads=False,
     ):
         self.http_session = http_session
         self.blob_root = blob_root
         self.search_root = search_root
         self.sign_root = sign_root
 
+        # This list is shared with the clients, so observers added later
+        # are seen by them too.
+        self.observers = list(observers) if observers is not None else []
+
         from camlistore.blobclient import BlobClient
         self.blobs = BlobClient(
             http_session=http_session,
             base_url=blob_root,
+            observers=self.observers,
+            compress_uploads=compress_uploads,
         )
 
         from camlistore.searchclient import SearchClient
         self.searcher = SearchClient(
             http_session=http_session,
             base_url=search_root,
+            observers=self.observers,
         )
 
+    def add_observer(self, observer):
+        """
+        Register a callable to be notified of each operation made via this
+        connection.
+
+        The observer is called with a single
+        :py:class:`camlistore.metrics.RequestEvent` argument once each
+        HTTP request completes, and also when an operation is answered
+        from a local cache. Observers may be called from several threads
+        at once, and should return quickly since they are called
+        synchronously. :py:class:`camlistore.metrics.MetricsAggregator`
+        is a ready-made observer that aggregates counters and latency
+        histograms.
+        """
+        self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        """
+        Stop notifying an observer previously registered with
+        :py:meth:`add_observer`.
+        """
+        self.observers.remove(observer)
+
 
 # Internals of the public "connect" function, split out so we can easily test
 # it with a mock http_session while not making the public interface look weird.
-def _connect(base_url, http_session):
+def _connect(base_url, http_session, compress_uploads=False):
     from urlparse import urljoin
 
     config_url = urljoin(base_url, '?camli.mode=config')
@@ -109,10 +141,11 @@ def _connect(base_url, http_session):
         blob_root=blob_root,
         search_root=search_root,
         sign_root=sign_root,
+        compress_uploads=compress_uploads,
     )
 
 
-def connect(base_url):
+def connect(base_url, compress_uploads=False):
     """
     Create a connection to the Camlistore instance at the given base URL.
 
@@ -123,12 +156,18 @@ def connect(base_url):
     For now we assume an unauthenticated connection, which is generally
     only possible when connecting via ``localhost``. In future this function
     will be extended with some options for configuring authentication.
+
+    Responses are requested in compressed form where the server supports
+    it. If ``compress_uploads`` is set, uploads are compressed too; see
+    :py:class:`camlistore.blobclient.BlobClient` for details.
     """
     import requests
+    from camlistore.compression import accept_encoding
 
     http_session = requests.Session()
     http_session.trust_env = False
     http_session.headers["User-Agent"] = user_agent
+    http_session.headers["Accept-Encoding"] = accept_encoding()
     # TODO: let the caller pass in a trusted SSL cert and then turn
     # on SSL cert verification. Until we do that we're vulnerable to
     # certain types of MITM attack on our SSL connections.
@@ -136,4 +175,5 @@ def connect(base_url):
     return _connect(
         base_url,
         http_session=http_session,
+        compress_uploads=compress_uploads,
     )
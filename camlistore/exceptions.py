@@ -27,7 +27,12 @@ class ServerError(Exception):
     """
     The server returned an unexpected error in response to some operation.
     """
-    pass
+
+    def __init__(self, message, status_code=None):
+        Exception.__init__(self, message)
+
+        #: The HTTP status code of the server's response, if known.
+        self.status_code = status_code
 
 
 class ServerFeatureUnavailableError(Exception):
@@ -0,0 +1,680 @@
+import BaseHTTPServer
+import SocketServer
+
+
+class FakeServer(object):
+    """
+    An in-process stand-in for a Camlistore server, for use in tests and
+    benchmarks.
+
+    The server listens on a local port in a background thread and
+    implements enough of the Camlistore protocol for this library:
+    configuration discovery, the blob store's ``stat``, ``upload`` and
+    ``enumerate-blobs`` operations, retrieval of individual blobs, and
+    a basic search interface supporting ``query``, ``describe`` and
+    ``claims``. Search requests are answered from a
+    :py:class:`camlistore.localindex.LocalIndex` that is updated as
+    each blob is uploaded.
+
+    Blobs are kept in ``storage``, which defaults to a new
+    :py:class:`MemoryStorage`; use :py:class:`DirectoryStorage` to keep
+    them on disk instead.
+
+    To simulate realistic network conditions, each request can be
+    delayed by ``latency`` seconds and request and response bodies can
+    be throttled to ``bandwidth`` bytes per second. Requests fail with
+    a 500 status with probability ``error_rate``; the random number
+    generator is seeded with ``seed`` so that failures are reproducible.
+    Further failures can be scheduled with :py:meth:`inject_error` and
+    :py:meth:`inject_disconnect`. Blob retrieval supports single-range
+    HTTP range requests. Enumeration supports long polling with
+    ``maxwaitsec``: a request that would return no blobs waits up to that
+    many seconds, at most 30, for a blob to be uploaded.
+
+    If ``compress_responses`` is set, response bodies are ``gzip``-encoded
+    for clients that accept it. Request bodies with a ``gzip`` content
+    encoding are rejected with a 415 status unless
+    ``accept_compressed_uploads`` is set.
+
+    The server can be used as a context manager, which starts it on entry
+    and stops it on exit:
+
+    .. code-block:: python
+
+        with FakeServer(latency=0.01) as server:
+            conn = camlistore.connect(server.url)
+    """
+
+    def __init__(
+        self,
+        storage=None,
+        latency=0,
+        bandwidth=None,
+        error_rate=0,
+        seed=0,
+        host="127.0.0.1",
+        port=0,
+        compress_responses=False,
+        accept_compressed_uploads=False,
+    ):
+        import random
+        import threading
+        from camlistore.localindex import LocalIndex
+
+        self.storage = storage if storage is not None else MemoryStorage()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.compress_responses = compress_responses
+        self.accept_compressed_uploads = accept_compressed_uploads
+        self.host = host
+        self.port = port
+
+        #: The number of requests handled so far, by operation name.
+        self.request_counts = {}
+
+        self._random = random.Random(seed)
+        self._injected_errors = []
+        self._injected_disconnects = []
+        self._lock = threading.Lock()
+        self._blob_added = threading.Condition(self._lock)
+        self._index = LocalIndex(":memory:", check_same_thread=False)
+        self._httpd = None
+        self._thread = None
+
+        for (blobref, size) in self.storage.enumerate():
+            self._index_blob(blobref, self.storage.get(blobref))
+
+    @property
+    def url(self):
+        """
+        The base URL of the running server, suitable for passing to
+        :py:func:`camlistore.connect`.
+        """
+        return "http://%s:%i/" % (self.host, self.port)
+
+    def start(self):
+        """
+        Start listening for requests in a background thread.
+        """
+        import threading
+
+        self._httpd = _HTTPServer((self.host, self.port), _RequestHandler)
+        self._httpd.fake_server = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the server and wait for its thread to exit.
+        """
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+            self._httpd = None
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def inject_error(self, status=500, count=1, operation=None):
+        """
+        Arrange for the next ``count`` requests for the given operation
+        -- or for any operation, if none is given -- to fail with the
+        given HTTP status code.
+
+        Operation names are those used as keys of
+        :py:attr:`request_counts`, such as ``"get"``, ``"stat"``,
+        ``"head"``, ``"upload"``, ``"enumerate"`` or ``"describe"``.
+        """
+        with self._lock:
+            self._injected_errors.append([operation, status, count])
+
+    def inject_disconnect(self, after_bytes, count=1, operation=None):
+        """
+        Arrange for the responses to the next ``count`` requests for the
+        given operation -- or for any operation, if none is given -- to be
+        cut off by closing the connection after ``after_bytes`` bytes of
+        the response body have been sent.
+        """
+        with self._lock:
+            self._injected_disconnects.append([operation, after_bytes, count])
+
+    def add_blob(self, data):
+        """
+        Add a blob directly to the server's storage, bypassing HTTP,
+        and return its blobref.
+        """
+        from camlistore.blobclient import Blob
+        blob = Blob(data)
+        self._store_blob(blob.blobref, data)
+        return blob.blobref
+
+    def _store_blob(self, blobref, data):
+        with self._lock:
+            if self.storage.get_size(blobref) is None:
+                self.storage.put(blobref, data)
+                self._index_blob(blobref, data)
+                self._blob_added.notify_all()
+
+    def _index_blob(self, blobref, data):
+        from camlistore.schema import parse_schema
+        with self._index.db:
+            self._index.add_blob(blobref, len(data), parse_schema(data))
+
+    def _choose_error(self, operation):
+        # Returns the status code to fail the given operation with, if any.
+        with self._lock:
+            counts = self.request_counts
+            counts[operation] = counts.get(operation, 0) + 1
+
+            status = _take_injected(self._injected_errors, operation)
+            if status is not None:
+                return status
+
+            if self.error_rate and self._random.random() < self.error_rate:
+                return 500
+
+        return None
+
+    def _choose_disconnect(self, operation):
+        # Returns the number of body bytes to send before disconnecting
+        # while responding to the given operation, if any.
+        with self._lock:
+            return _take_injected(self._injected_disconnects, operation)
+
+
+def _take_injected(injected_list, operation):
+    # Consumes one use of the first injected fault that applies to the
+    # given operation, returning its value or None if there isn't one.
+    for injected in injected_list:
+        (for_operation, value, count) = injected
+        if for_operation is None or for_operation == operation:
+            if count <= 1:
+                injected_list.remove(injected)
+            else:
+                injected[2] = count - 1
+            return value
+    return None
+
+
+class MemoryStorage(object):
+    """
+    Blob storage for :py:class:`FakeServer` that keeps blobs in memory.
+    """
+
+    def __init__(self):
+        self._blobs = {}
+        self._sorted_refs = []
+
+    def get(self, blobref):
+        """
+        Return the data of the given blob, or ``None`` if it's not present.
+        """
+        return self._blobs.get(blobref)
+
+    def get_size(self, blobref):
+        """
+        Return the size of the given blob, or ``None`` if it's not present.
+        """
+        data = self._blobs.get(blobref)
+        return len(data) if data is not None else None
+
+    def put(self, blobref, data):
+        """
+        Store a blob.
+        """
+        from bisect import insort
+        if blobref not in self._blobs:
+            insort(self._sorted_refs, blobref)
+        self._blobs[blobref] = data
+
+    def enumerate(self, after=None, limit=None):
+        """
+        Return a list of ``(blobref, size)`` tuples for up to ``limit``
+        stored blobs whose blobrefs sort after ``after``, in blobref order.
+        """
+        from bisect import bisect_right
+
+        refs = self._sorted_refs
+        start = bisect_right(refs, after) if after is not None else 0
+        end = start + limit if limit is not None else len(refs)
+        return [
+            (blobref, len(self._blobs[blobref]))
+            for blobref in refs[start:end]
+        ]
+
+
+class DirectoryStorage(object):
+    """
+    Blob storage for :py:class:`FakeServer` that keeps each blob in a
+    separate file in the given directory, which must already exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _blob_path(self, blobref):
+        import os.path
+        return os.path.join(self.path, blobref)
+
+    def get(self, blobref):
+        """
+        Return the data of the given blob, or ``None`` if it's not present.
+        """
+        try:
+            with open(self._blob_path(blobref), "rb") as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def get_size(self, blobref):
+        """
+        Return the size of the given blob, or ``None`` if it's not present.
+        """
+        import os
+        try:
+            return os.path.getsize(self._blob_path(blobref))
+        except OSError:
+            return None
+
+    def put(self, blobref, data):
+        """
+        Store a blob.
+        """
+        import os
+        path = self._blob_path(blobref)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.rename(path + ".tmp", path)
+
+    def enumerate(self, after=None, limit=None):
+        """
+        Return a list of ``(blobref, size)`` tuples for up to ``limit``
+        stored blobs whose blobrefs sort after ``after``, in blobref order.
+        """
+        import os
+        refs = sorted(
+            name for name in os.listdir(self.path)
+            if not name.endswith(".tmp") and (after is None or name > after)
+        )
+        if limit is not None:
+            refs = refs[:limit]
+        return [(blobref, self.get_size(blobref)) for blobref in refs]
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    # Buffer each response and send it without delay, so that small
+    # responses don't incur delayed-ACK stalls that a real server wouldn't.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    # Maps (method, path) to (operation name, handler method name) for
+    # the fixed paths. Blob retrieval is handled separately.
+    routes = {
+        ("GET", "/"): ("config", "handle_config"),
+        ("POST", "/bs/camli/stat"): ("stat", "handle_stat"),
+        ("GET", "/bs/camli/stat"): ("stat", "handle_stat"),
+        ("POST", "/bs/camli/upload"): ("upload", "handle_upload"),
+        ("GET", "/bs/camli/enumerate-blobs"): (
+            "enumerate", "handle_enumerate",
+        ),
+        ("POST", "/my-search/camli/search/query"): (
+            "query", "handle_query",
+        ),
+        ("GET", "/my-search/camli/search/describe"): (
+            "describe", "handle_describe",
+        ),
+        ("POST", "/my-search/camli/search/describe"): (
+            "describe", "handle_describe",
+        ),
+        ("GET", "/my-search/camli/search/claims"): (
+            "claims", "handle_claims",
+        ),
+    }
+
+    def log_message(self, format, *args):
+        # Keep test and benchmark output quiet.
+        pass
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_HEAD(self):
+        self.dispatch("HEAD")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def dispatch(self, method):
+        import time
+        from urlparse import urlparse, parse_qs
+
+        fake = self.server.fake_server
+        parsed = urlparse(self.path)
+        self.query = parse_qs(parsed.query)
+        self.body = self.read_body()
+
+        route = self.routes.get((method, parsed.path))
+        if route is None and parsed.path.startswith("/bs/camli/"):
+            if method == "GET":
+                route = ("get", "handle_get_blob")
+            elif method == "HEAD":
+                route = ("head", "handle_get_blob")
+            self.blobref = parsed.path[len("/bs/camli/"):]
+
+        if route is None:
+            return self.send_error_response(404, "Not Found")
+
+        (operation, handler_name) = route
+        self.operation = operation
+
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        status = fake._choose_error(operation)
+        if status is not None:
+            return self.send_error_response(status, "Injected error")
+
+        encoding = self.headers.get("content-encoding")
+        if encoding:
+            if encoding != "gzip" or not fake.accept_compressed_uploads:
+                return self.send_error_response(
+                    415, "Unsupported content encoding %s" % encoding,
+                )
+            import zlib
+            self.body = zlib.decompress(self.body, 47)
+
+        getattr(self, handler_name)(method)
+
+    def read_body(self):
+        length = int(self.headers.get("content-length") or 0)
+        chunks = []
+        remaining = length
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, self.chunk_size()))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+            self.throttle(len(chunk))
+        return "".join(chunks)
+
+    def chunk_size(self):
+        bandwidth = self.server.fake_server.bandwidth
+        if bandwidth:
+            return max(1024, int(bandwidth) // 20)
+        return 65536
+
+    def throttle(self, byte_count):
+        import time
+        bandwidth = self.server.fake_server.bandwidth
+        if bandwidth:
+            time.sleep(float(byte_count) / bandwidth)
+
+    def send_body(
+        self,
+        body,
+        status=200,
+        content_type="application/octet-stream",
+        send_data=True,
+        extra_headers=(),
+    ):
+        # Never compress HEAD responses, so that their Content-Length
+        # is that of the blob itself.
+        if send_data and self.should_compress(body):
+            from camlistore.compression import gzip_compress
+            body = gzip_compress(body)
+            extra_headers = (("Content-Encoding", "gzip"),) + tuple(
+                extra_headers
+            )
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for (name, value) in extra_headers:
+            self.send_header(name, value)
+        self.end_headers()
+
+        if not send_data:
+            return
+
+        disconnect_after = None
+        if status < 400:
+            fake = self.server.fake_server
+            disconnect_after = fake._choose_disconnect(self.operation)
+        if disconnect_after is not None:
+            body = body[:disconnect_after]
+            self.close_connection = 1
+
+        chunk_size = self.chunk_size()
+        for start in xrange(0, len(body), chunk_size):
+            chunk = body[start:start + chunk_size]
+            self.wfile.write(chunk)
+            if self.server.fake_server.bandwidth:
+                self.wfile.flush()
+                self.throttle(len(chunk))
+
+    def should_compress(self, body):
+        if not self.server.fake_server.compress_responses or not body:
+            return False
+        accepted = self.headers.get("accept-encoding") or ""
+        return "gzip" in [
+            encoding.split(";")[0].strip() for encoding in accepted.split(",")
+        ]
+
+    def send_json(self, data, status=200):
+        import json
+        self.send_body(
+            json.dumps(data),
+            status=status,
+            content_type="text/javascript",
+        )
+
+    def send_error_response(self, status, message):
+        self.send_body(message, status=status, content_type="text/plain")
+
+    def handle_config(self, method):
+        if "camli.mode" not in self.query:
+            return self.send_error_response(404, "Not Found")
+        self.send_json({
+            "blobRoot": "/bs/",
+            "searchRoot": "/my-search/",
+        })
+
+    def handle_get_blob(self, method):
+        fake = self.server.fake_server
+        data = fake.storage.get(self.blobref)
+        if data is None:
+            return self.send_error_response(404, "Blob not found")
+
+        byte_range = self.parse_range(len(data))
+        if byte_range is None:
+            return self.send_body(data, send_data=(method != "HEAD"))
+
+        (start, end) = byte_range
+        if start >= len(data):
+            return self.send_body(
+                "",
+                status=416,
+                extra_headers=(("Content-Range", "bytes */%i" % len(data)),),
+            )
+        self.send_body(
+            data[start:end + 1],
+            status=206,
+            send_data=(method != "HEAD"),
+            extra_headers=(
+                ("Content-Range", "bytes %i-%i/%i" % (
+                    start, end, len(data),
+                )),
+            ),
+        )
+
+    def parse_range(self, size):
+        # Returns the inclusive (start, end) of a single-range Range
+        # header, or None if there isn't one we understand.
+        header = self.headers.get("range") or ""
+        if not header.startswith("bytes=") or "," in header:
+            return None
+        (start, _, end) = header[6:].partition("-")
+        try:
+            if not start:
+                # A suffix range, for the last "end" bytes.
+                return (max(0, size - int(end)), size - 1)
+            end = int(end) if end else size - 1
+            return (int(start), min(end, size - 1))
+        except ValueError:
+            return None
+
+    def handle_stat(self, method):
+        from urlparse import parse_qs
+
+        fake = self.server.fake_server
+        form = dict(self.query)
+        form.update(parse_qs(self.body))
+
+        stat = []
+        for key in sorted(form):
+            if not key.startswith("blob"):
+                continue
+            for blobref in form[key]:
+                size = fake.storage.get_size(blobref)
+                if size is not None:
+                    stat.append({"blobRef": blobref, "size": size})
+
+        self.send_json({"stat": stat, "canLongPoll": False})
+
+    def handle_upload(self, method):
+        import cgi
+        from StringIO import StringIO
+        from camlistore.blobclient import Blob
+        from camlistore.exceptions import HashMismatchError
+
+        fake = self.server.fake_server
+        form = cgi.FieldStorage(
+            fp=StringIO(self.body),
+            headers=self.headers,
+            environ={
+                "REQUEST_METHOD": "POST",
+                "CONTENT_TYPE": self.headers.get("content-type", ""),
+                "CONTENT_LENGTH": str(len(self.body)),
+            },
+        )
+
+        received = []
+        for field in form.list or ():
+            blobref = field.name
+            data = field.value
+            try:
+                Blob(data, blobref=blobref)
+            except (HashMismatchError, ValueError):
+                return self.send_error_response(
+                    400, "Data does not match blobref %s" % blobref,
+                )
+            fake._store_blob(blobref, data)
+            received.append({"blobRef": blobref, "size": len(data)})
+
+        self.send_json({"received": received})
+
+    def handle_enumerate(self, method):
+        fake = self.server.fake_server
+        after = self.query.get("after", [None])[0]
+        limit = int(self.query.get("limit", ["1000"])[0])
+        max_wait = min(int(self.query.get("maxwaitsec", ["0"])[0]), 30)
+
+        with fake._lock:
+            # Ask for one more than the limit so we know whether to
+            # continue.
+            blobs = fake.storage.enumerate(after=after, limit=limit + 1)
+            if not blobs and max_wait > 0:
+                # Any new blob wakes the request, even one that sorts
+                # before "after" and so still isn't returned.
+                fake._blob_added.wait(max_wait)
+                blobs = fake.storage.enumerate(after=after, limit=limit + 1)
+
+        data = {
+            "blobs": [
+                {"blobRef": blobref, "size": size}
+                for (blobref, size) in blobs[:limit]
+            ],
+        }
+        if len(blobs) > limit:
+            data["continueAfter"] = blobs[limit - 1][0]
+
+        self.send_json(data)
+
+    def handle_query(self, method):
+        import json
+
+        fake = self.server.fake_server
+        search_query = json.loads(self.body or "{}")
+        expression = search_query.get("expression") or ""
+
+        with fake._lock:
+            if expression.startswith("attr:"):
+                (attr, value) = expression[5:].split(":", 1)
+                blobrefs = fake._index.find_permanodes(attr, value)
+            else:
+                blobrefs = [
+                    blobref for (blobref,) in fake._index.db.execute(
+                        "SELECT blobref FROM blobs "
+                        "WHERE camli_type = 'permanode' ORDER BY blobref",
+                    )
+                ]
+
+            data = {"blobs": [{"blob": blobref} for blobref in blobrefs]}
+            if search_query.get("describe") is not None:
+                meta = {}
+                for blobref in blobrefs:
+                    desc = fake._index.describe_blob(blobref)
+                    meta.update(desc.other_raw_dicts)
+                data["description"] = {"meta": meta}
+
+        self.send_json(data)
+
+    def handle_describe(self, method):
+        import json
+        from camlistore.exceptions import NotFoundError
+
+        fake = self.server.fake_server
+        if method == "POST":
+            blobrefs = json.loads(self.body).get("blobrefs") or []
+        else:
+            blobrefs = self.query.get("blobref", [])
+
+        meta = {}
+        with fake._lock:
+            for blobref in blobrefs:
+                try:
+                    desc = fake._index.describe_blob(blobref)
+                except NotFoundError:
+                    continue
+                meta.update(desc.other_raw_dicts)
+
+        self.send_json({"meta": meta})
+
+    def handle_claims(self, method):
+        fake = self.server.fake_server
+        permanode = self.query.get("permanode", [None])[0]
+
+        with fake._lock:
+            claims = fake._index.get_claims_for_permanode(permanode)
+
+        self.send_json({
+            "claims": [claim.raw_dict for claim in claims],
+        })
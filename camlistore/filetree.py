@@ -0,0 +1,758 @@
+class StatCache(object):
+    """
+    A persistent record of the files uploaded by :py:func:`put_tree`,
+    kept in a SQLite database at ``path``, so that unchanged files need
+    not be read again.
+
+    Each file is identified by its absolute path, inode number, size,
+    modification time and permissions. A file is assumed unchanged if all
+    of these match what was recorded, so changes that preserve all of
+    them -- which ordinary writes do not -- will go unnoticed.
+
+    Pass ``":memory:"`` as the path for a temporary in-memory cache.
+    """
+
+    def __init__(self, path):
+        import sqlite3
+
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.text_factory = str
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, "
+            "inode INTEGER, "
+            "size INTEGER, "
+            "mtime REAL, "
+            "mode INTEGER, "
+            "fileref TEXT)"
+        )
+        self.db.commit()
+
+    def lookup(self, path, file_stat):
+        """
+        Return the blobref of the ``file`` schema blob recorded for the
+        given path, or ``None`` if there is none or the given result of
+        :py:func:`os.stat` shows that the file has changed.
+        """
+        row = self.db.execute(
+            "SELECT fileref FROM files "
+            "WHERE path = ? AND inode = ? AND size = ? AND mtime = ? "
+            "AND mode = ?",
+            (path,) + _stat_key(file_stat),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def record(self, path, file_stat, fileref):
+        """
+        Record the blobref of the ``file`` schema blob for the given path
+        and result of :py:func:`os.stat`.
+        """
+        self.db.execute(
+            "INSERT OR REPLACE INTO files "
+            "(path, inode, size, mtime, mode, fileref) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (path,) + _stat_key(file_stat) + (fileref,),
+        )
+
+    def commit(self):
+        """
+        Write any new records to disk.
+        """
+        self.db.commit()
+
+    def close(self):
+        """
+        Commit and close the underlying database.
+        """
+        self.db.commit()
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+
+def put_tree(
+    blob_client,
+    path,
+    stat_cache=None,
+    chunk_size=1024 * 1024,
+    concurrency=4,
+    max_pending_files=1000,
+    **uploader_options
+):
+    """
+    Upload the local directory tree rooted at ``path``, returning the
+    blobref of the ``directory`` schema blob describing its root.
+
+    ``blob_client`` is a :py:class:`camlistore.blobclient.BlobClient`, or
+    anything else with an ``uploader`` method. Each regular file is split
+    into chunks of ``chunk_size`` bytes and described by a ``file`` schema
+    blob, and each directory by a ``directory`` schema blob whose entries
+    are listed in a ``static-set``. Symbolic links are recorded as
+    ``symlink`` schema blobs and are not followed, and other special files
+    are skipped.
+
+    Up to ``concurrency`` files are read and hashed at once, and blobs are
+    uploaded via a :py:class:`camlistore.uploader.Uploader` created with
+    the given ``uploader_options``, so blobs already on the server are not
+    uploaded again. No more than ``max_pending_files`` files are queued
+    for reading at once, bounding memory usage for very large trees.
+
+    If a :py:class:`StatCache` is given, files whose path, inode, size,
+    modification time and permissions are unchanged since they were last
+    uploaded with the same cache are not read at all, and their previous
+    ``file`` schema blobref is reused. This makes repeated uploads of a
+    mostly-unchanged tree much faster, but relies on the server still
+    having the blobs uploaded before. Files are only recorded in the cache
+    once the whole tree has been uploaded successfully.
+    """
+    import os
+    import stat
+    import sys
+    from collections import deque
+    from multiprocessing.pool import ThreadPool
+    from camlistore.schema import (
+        directory_schema,
+        schema_blob,
+        static_set_schema,
+        symlink_schema,
+    )
+
+    root = os.path.abspath(path)
+
+    # Directories whose schema blobs have not yet been built, in the
+    # order they are visited. Since the walk is bottom-up, each directory
+    # comes after all of its subdirectories.
+    pending = deque()
+    # Maps each directory path to a single-item list that will hold the
+    # blobref of its schema once it's built.
+    dir_refs = {}
+    outstanding = [0]
+    # Stat cache records for the files read, which are only saved once
+    # all of the blobs have been uploaded.
+    cache_records = []
+
+    def finish_directory():
+        (dir_path, dir_stat, entries, holder) = pending.popleft()
+        members = []
+        for (kind, entry_path, entry_stat, value) in entries:
+            if kind == "job":
+                value = value.get()
+                outstanding[0] -= 1
+                cache_records.append((entry_path, entry_stat, value))
+            elif kind == "dir":
+                value = value[0]
+            members.append(value)
+
+        entries_blob = schema_blob(static_set_schema(members))
+        uploader.add(entries_blob)
+        dir_blob = schema_blob(directory_schema(
+            os.path.basename(dir_path),
+            entries_blob.blobref,
+            mode=dir_stat.st_mode,
+            mtime=dir_stat.st_mtime,
+        ))
+        uploader.add(dir_blob)
+        holder[0] = dir_blob.blobref
+
+    def is_ready(entries):
+        return all(
+            value.ready() for (kind, _, _, value) in entries if kind == "job"
+        )
+
+    pool = ThreadPool(concurrency)
+    uploader = blob_client.uploader(**uploader_options)
+    try:
+        for (dir_path, dir_names, file_names) in os.walk(root, topdown=False):
+            entries = []
+            for name in sorted(dir_names + file_names):
+                entry_path = os.path.join(dir_path, name)
+                try:
+                    entry_stat = os.lstat(entry_path)
+                except OSError:
+                    # Removed since the directory was listed.
+                    continue
+                mode = entry_stat.st_mode
+
+                if stat.S_ISDIR(mode):
+                    holder = dir_refs.pop(entry_path, None)
+                    if holder is not None:
+                        entries.append(("dir", entry_path, None, holder))
+                elif stat.S_ISLNK(mode):
+                    link_blob = schema_blob(symlink_schema(
+                        name,
+                        os.readlink(entry_path),
+                        mtime=entry_stat.st_mtime,
+                    ))
+                    uploader.add(link_blob)
+                    entries.append(
+                        ("ref", entry_path, None, link_blob.blobref),
+                    )
+                elif stat.S_ISREG(mode):
+                    fileref = None
+                    if stat_cache is not None:
+                        fileref = stat_cache.lookup(entry_path, entry_stat)
+                    if fileref is not None:
+                        entries.append(("ref", entry_path, None, fileref))
+                    else:
+                        job = pool.apply_async(
+                            _put_file,
+                            (uploader, entry_path, name, entry_stat,
+                             chunk_size),
+                        )
+                        outstanding[0] += 1
+                        entries.append(("job", entry_path, entry_stat, job))
+
+            try:
+                dir_stat = os.stat(dir_path)
+            except OSError:
+                continue
+            holder = [None]
+            dir_refs[dir_path] = holder
+            pending.append((dir_path, dir_stat, entries, holder))
+
+            while pending and (
+                outstanding[0] > max_pending_files or
+                is_ready(pending[0][2])
+            ):
+                finish_directory()
+
+        while pending:
+            finish_directory()
+
+        uploader.close()
+    except BaseException:
+        uploader.__exit__(*sys.exc_info())
+        raise
+    finally:
+        pool.terminate()
+
+    if stat_cache is not None:
+        for (entry_path, entry_stat, fileref) in cache_records:
+            stat_cache.record(entry_path, entry_stat, fileref)
+        stat_cache.commit()
+
+    holder = dir_refs.get(root)
+    if holder is None:
+        raise OSError("Cannot read directory %s" % path)
+    return holder[0]
+
+
+def _put_file(uploader, path, name, file_stat, chunk_size):
+    # Uploads the data of a file in chunks, followed by its file schema,
+    # returning the blobref of the file schema.
+    from camlistore.blobclient import Blob
+    from camlistore.schema import file_schema, schema_blob
+
+    parts = []
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            blob = Blob(data)
+            uploader.add(blob)
+            parts.append((blob.blobref, len(data)))
+
+    file_blob = schema_blob(file_schema(
+        name,
+        parts,
+        mode=file_stat.st_mode,
+        mtime=file_stat.st_mtime,
+    ))
+    uploader.add(file_blob)
+    return file_blob.blobref
+
+
+def get_tree(
+    blob_client,
+    blobref,
+    dest_path,
+    skip_existing=True,
+    concurrency=8,
+    max_pending_chunks=1000,
+):
+    """
+    Restore the directory tree described by the ``directory`` or
+    ``static-set`` schema blob with the given blobref into the local
+    directory ``dest_path``, which is created if necessary.
+
+    ``blob_client`` is a :py:class:`camlistore.blobclient.BlobClient`.
+    The tree is resolved one level at a time, fetching the schema blobs of
+    each level concurrently, while the chunks of the files found so far
+    are downloaded by a separate pool of ``concurrency`` threads. Each
+    file is created at its full size up front and each chunk is written
+    at its own offset as soon as it arrives, so chunks need not arrive in
+    order. No more than ``max_pending_chunks`` chunk downloads are queued
+    at once. Every chunk is checked against its blobref as it is
+    downloaded.
+
+    If ``skip_existing`` is set, any chunk whose data is already present
+    at the right offset of an existing local file is not downloaded,
+    so restoring over a partial or earlier copy of the tree only
+    transfers what differs.
+
+    Permissions and modification times are restored where recorded, and
+    symbolic links are recreated. Entries whose names are not safe to use
+    as a single path component cause :py:class:`ValueError` to be raised.
+    Symbolic links are never followed within ``dest_path``: any found
+    where a directory is to be restored are replaced by the directory.
+    """
+    import os
+    from collections import deque
+    from multiprocessing.pool import ThreadPool
+
+    meta_pool = ThreadPool(concurrency)
+    data_pool = ThreadPool(concurrency)
+    pending_chunks = deque()
+    restored_dirs = []
+
+    def fetch_schema(ref):
+        return _get_schema(blob_client, ref)
+
+    def fetch_members(item):
+        (path, schema) = item
+        if schema.get("camliType") == "directory":
+            return fetch_schema(schema["entries"]).get("members") or []
+        return schema.get("members") or []
+
+    def wait_for_chunk():
+        pending_chunks.popleft().get()
+
+    try:
+        root = fetch_schema(blobref)
+        if not os.path.isdir(dest_path):
+            os.makedirs(dest_path)
+        real_dest_path = os.path.realpath(dest_path)
+        level = [(dest_path, root)]
+
+        while level:
+            entry_lists = meta_pool.map(fetch_members, level)
+            member_refs = [ref for refs in entry_lists for ref in refs]
+            member_schemas = iter(meta_pool.map(fetch_schema, member_refs))
+
+            next_level = []
+            for ((dir_path, dir_schema), refs) in zip(level, entry_lists):
+                _check_within(real_dest_path, dir_path)
+                restored_dirs.append((dir_path, dir_schema))
+                for ref in refs:
+                    schema = next(member_schemas)
+                    camli_type = schema.get("camliType")
+                    if camli_type not in ("directory", "file", "symlink"):
+                        continue
+                    path = os.path.join(dir_path, _entry_name(schema))
+
+                    if camli_type == "directory":
+                        # A symbolic link to a directory, whether left
+                        # over locally or restored from an earlier entry
+                        # of the same name, would lead outside the tree.
+                        if os.path.islink(path):
+                            os.remove(path)
+                        if not os.path.isdir(path):
+                            os.mkdir(path)
+                        next_level.append((path, schema))
+                    elif camli_type == "symlink":
+                        _restore_symlink(path, schema)
+                    else:
+                        restore = _FileRestore(
+                            blob_client,
+                            path,
+                            schema,
+                            skip_existing,
+                        )
+                        for extent in restore.start():
+                            while len(pending_chunks) >= max_pending_chunks:
+                                wait_for_chunk()
+                            pending_chunks.append(data_pool.apply_async(
+                                restore.restore_extent,
+                                extent,
+                            ))
+
+            level = next_level
+
+        while pending_chunks:
+            wait_for_chunk()
+    finally:
+        meta_pool.terminate()
+        data_pool.terminate()
+
+    # Directory attributes are restored last, deepest first, since
+    # writing their contents would change their modification times.
+    for (dir_path, dir_schema) in reversed(restored_dirs):
+        _restore_attributes(dir_path, dir_schema)
+
+
+def diff_trees(blob_client, old_ref, new_ref, concurrency=8):
+    """
+    Compare two stored directory trees, given the blobrefs of their root
+    ``directory`` schema blobs, yielding a :py:class:`TreeChange` for each
+    entry that differs between them.
+
+    Since schema blobs are content-addressed, entries with the same
+    blobref in both trees are identical and are skipped without being
+    fetched, as are entire subdirectories whose blobrefs match. The cost
+    of a comparison is therefore proportional to the size of the
+    difference rather than the size of the trees. Each level of the trees
+    is compared in turn, fetching the schema blobs that differ with up to
+    ``concurrency`` requests at once.
+
+    Changes are yielded one directory level at a time, ordered by path
+    within each level. An added or removed directory is reported as a
+    single change, without listing its contents. A directory present in
+    both trees is reported as modified only if its own attributes, such as
+    its mode or modification time, differ; its contents are compared only
+    if its ``entries`` static-set differs.
+    """
+    import posixpath
+    from multiprocessing.pool import ThreadPool
+
+    if old_ref == new_ref:
+        return
+
+    pool = ThreadPool(concurrency)
+    try:
+        def fetch_schema(ref):
+            return _get_schema(blob_client, ref)
+
+        def fetch_members(dir_schema):
+            return fetch_schema(dir_schema["entries"]).get("members") or []
+
+        (old_root, new_root) = pool.map(fetch_schema, (old_ref, new_ref))
+        level = [("", old_root, new_root)]
+
+        while level:
+            member_lists = pool.map(
+                fetch_members,
+                [schema for (_, old, new) in level for schema in (old, new)],
+            )
+
+            # Members present in both sets are identical, so only the
+            # others need to be fetched to find out what they are.
+            unmatched = []
+            for i in xrange(len(level)):
+                old_members = set(member_lists[i * 2])
+                new_members = set(member_lists[i * 2 + 1])
+                unmatched.append((
+                    old_members - new_members,
+                    new_members - old_members,
+                ))
+            refs = sorted(set(
+                ref
+                for (old_only, new_only) in unmatched
+                for ref in old_only | new_only
+            ))
+            schemas = dict(zip(refs, pool.map(fetch_schema, refs)))
+
+            changes = []
+            next_level = []
+            for ((path, _, _), (old_only, new_only)) in zip(level, unmatched):
+                old_entries = _entries_by_name(old_only, schemas)
+                new_entries = _entries_by_name(new_only, schemas)
+
+                for name in set(old_entries) | set(new_entries):
+                    entry_path = posixpath.join(path, name)
+                    (old_entry_ref, old) = old_entries.get(name, (None, None))
+                    (new_entry_ref, new) = new_entries.get(name, (None, None))
+
+                    if old is None:
+                        kind = "added"
+                    elif new is None:
+                        kind = "removed"
+                    elif (
+                        old.get("camliType") == "directory" and
+                        new.get("camliType") == "directory"
+                    ):
+                        # The directory's own blobref changed, so either
+                        # its contents or its attributes (or both) did.
+                        if old["entries"] != new["entries"]:
+                            next_level.append((entry_path, old, new))
+                        if (
+                            _without_entries(old) ==
+                            _without_entries(new)
+                        ):
+                            continue
+                        kind = "modified"
+                    else:
+                        kind = "modified"
+
+                    changes.append(TreeChange(
+                        kind,
+                        entry_path,
+                        old_entry_ref,
+                        new_entry_ref,
+                        old,
+                        new,
+                    ))
+
+            changes.sort(key=lambda change: change.path)
+            for change in changes:
+                yield change
+
+            level = sorted(next_level, key=lambda item: item[0])
+    finally:
+        pool.terminate()
+
+
+class TreeChange(object):
+    """
+    Describes an entry that differs between two directory trees, as
+    yielded by :py:func:`diff_trees`.
+    """
+
+    def __init__(self, kind, path, old_ref, new_ref, old, new):
+        #: ``"added"`` if the entry is only in the new tree, ``"removed"``
+        #: if it is only in the old tree, or ``"modified"`` if it is in
+        #: both but has changed.
+        self.kind = kind
+
+        #: The path of the entry relative to the root of the trees.
+        self.path = path
+
+        #: The blobref of the entry's schema blob in the old tree, or
+        #: ``None`` if the entry was added.
+        self.old_ref = old_ref
+
+        #: The blobref of the entry's schema blob in the new tree, or
+        #: ``None`` if the entry was removed.
+        self.new_ref = new_ref
+
+        #: The entry's parsed schema blob in the old tree, or ``None``.
+        self.old = old
+
+        #: The entry's parsed schema blob in the new tree, or ``None``.
+        self.new = new
+
+    def __repr__(self):
+        return "<camlistore.filetree.TreeChange %s %s>" % (
+            self.kind,
+            self.path,
+        )
+
+
+def _without_entries(dir_schema):
+    return dict(
+        (key, value)
+        for (key, value) in dir_schema.iteritems()
+        if key != "entries"
+    )
+
+
+def _entries_by_name(refs, schemas):
+    entries = {}
+    for ref in refs:
+        schema = schemas[ref]
+        if schema.get("camliType") in ("directory", "file", "symlink"):
+            entries[_entry_name(schema)] = (ref, schema)
+    return entries
+
+
+class _FileRestore(object):
+    # Restores a single file, whose extents may be written concurrently
+    # by several threads.
+
+    def __init__(self, blob_client, path, schema, skip_existing):
+        import threading
+
+        self.blob_client = blob_client
+        self.path = path
+        self.schema = schema
+        self.skip_existing = skip_existing
+        self._lock = threading.Lock()
+        self._remaining = 0
+
+    def start(self):
+        # Creates the file at its full size and returns the list of
+        # extents still to be restored, as argument tuples for
+        # restore_extent.
+        import os
+
+        extents = []
+        offset = 0
+        for (length, blobref, blob_offset) in _file_extents(
+            self.blob_client,
+            self.schema,
+        ):
+            if blobref is not None:
+                extents.append((offset, length, blobref, blob_offset))
+            offset += length
+
+        existing = os.path.isfile(self.path) and not os.path.islink(self.path)
+        check_existing = self.skip_existing and existing
+        if os.path.lexists(self.path) and not check_existing:
+            os.remove(self.path)
+        elif check_existing:
+            # Its permissions are restored once we're done with it.
+            os.chmod(self.path, 0600)
+
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0600)
+        try:
+            # Sets the final size up front, leaving any holes zero-filled.
+            os.ftruncate(fd, offset)
+        finally:
+            os.close(fd)
+
+        self._remaining = len(extents)
+        if not extents:
+            self._finish()
+        return [extent + (check_existing,) for extent in extents]
+
+    def restore_extent(self, offset, length, blobref, blob_offset, check):
+        import os
+
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            if not (check and self._matches(fd, offset, length, blobref)):
+                data = self.blob_client.get(blobref).data
+                _write_at(
+                    fd,
+                    offset,
+                    data[blob_offset:blob_offset + length],
+                )
+        finally:
+            os.close(fd)
+
+        with self._lock:
+            self._remaining -= 1
+            done = self._remaining == 0
+        if done:
+            self._finish()
+
+    def _matches(self, fd, offset, length, blobref):
+        import hashlib
+        import os
+
+        os.lseek(fd, offset, os.SEEK_SET)
+        chunks = []
+        remaining = length
+        while remaining > 0:
+            chunk = os.read(fd, remaining)
+            if not chunk:
+                return False
+            chunks.append(chunk)
+            remaining -= len(chunk)
+
+        (hash_func_name, digest) = blobref.split("-", 1)
+        try:
+            hasher = hashlib.new(hash_func_name)
+        except ValueError:
+            return False
+        hasher.update("".join(chunks))
+        return hasher.hexdigest() == digest
+
+    def _finish(self):
+        _restore_attributes(self.path, self.schema)
+
+
+def _write_at(fd, offset, data):
+    import os
+
+    os.lseek(fd, offset, os.SEEK_SET)
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+def _file_extents(blob_client, schema, skip=0, limit=None):
+    # Returns a list of (length, blobref, blob_offset) tuples describing
+    # the bytes from "skip" to "skip + limit" of a file or bytes schema,
+    # in order. blobref is None for ranges that are zero-filled.
+    extents = []
+    position = 0
+    for part in schema.get("parts") or ():
+        size = int(part.get("size", 0))
+        part_start = position
+        part_end = position + size
+        position = part_end
+
+        start = max(skip, part_start)
+        end = part_end if limit is None else min(part_end, skip + limit)
+        if start >= end:
+            continue
+
+        inner_offset = int(part.get("offset", 0)) + (start - part_start)
+        length = end - start
+        if part.get("blobRef"):
+            extents.append((length, part["blobRef"], inner_offset))
+        elif part.get("bytesRef"):
+            extents.extend(_file_extents(
+                blob_client,
+                _get_schema(blob_client, part["bytesRef"]),
+                inner_offset,
+                length,
+            ))
+        else:
+            extents.append((length, None, 0))
+    return extents
+
+
+def _get_schema(blob_client, blobref):
+    from camlistore.schema import parse_schema
+
+    schema = parse_schema(blob_client.get(blobref).data)
+    if schema is None:
+        raise ValueError("Blob %s is not a schema blob" % blobref)
+    return schema
+
+
+def _entry_name(schema):
+    if "fileNameBytes" in schema:
+        name = "".join(chr(b) for b in schema["fileNameBytes"])
+    else:
+        name = schema.get("fileName") or ""
+        if isinstance(name, unicode):
+            name = name.encode("utf-8")
+    if name in ("", ".", "..") or "/" in name or "\0" in name:
+        raise ValueError("Unsafe file name %r in schema" % name)
+    return name
+
+
+def _restore_symlink(path, schema):
+    import os
+
+    target = schema.get("symlinkTarget") or ""
+    if isinstance(target, unicode):
+        target = target.encode("utf-8")
+    if os.path.lexists(path):
+        if os.path.islink(path) and os.readlink(path) == target:
+            return
+        os.remove(path)
+    os.symlink(target, path)
+
+
+def _check_within(root, path):
+    import os
+
+    real_path = os.path.realpath(path)
+    if real_path != root and not real_path.startswith(
+        os.path.join(root, ""),
+    ):
+        raise ValueError("Path %s is outside of %s" % (path, root))
+
+
+def _restore_attributes(path, schema):
+    import calendar
+    import os
+    from camlistore.searchclient import parse_time
+
+    permission = schema.get("unixPermission")
+    if permission:
+        os.chmod(path, int(permission, 8))
+
+    mtime = schema.get("unixMtime")
+    if mtime:
+        when = parse_time(mtime)
+        timestamp = (
+            calendar.timegm(when.utctimetuple()) +
+            when.microsecond / 1000000.0
+        )
+        os.utime(path, (timestamp, timestamp))
+
+
+def _stat_key(file_stat):
+    return (
+        file_stat.st_ino,
+        file_stat.st_size,
+        file_stat.st_mtime,
+        file_stat.st_mode,
+    )
@@ -0,0 +1,357 @@
+class GarbageCollector(object):
+    """
+    Finds the blobs in a blob store that are no longer reachable from a
+    given set of root blobs.
+
+    ``blob_client`` is a :py:class:`camlistore.blobclient.BlobClient`.
+    Collection happens in two phases. The *mark* phase visits every blob
+    reachable from the roots, fetching and parsing schema blobs to find
+    the blobs they refer to, as described for
+    :py:func:`camlistore.schema.schema_references`. Up to ``concurrency``
+    blobs are fetched at once. The *sweep* phase then enumerates the store
+    and reports each blob that was not visited.
+
+    Only the first ``max_schema_size`` bytes of a referenced blob are
+    fetched, and larger blobs are assumed not to be schema blobs. File
+    chunks and public keys are known from their referrers not to be schema
+    blobs, so they are marked without being fetched at all.
+
+    The Camlistore roots are usually the permanodes and claims, which can
+    be listed from a local index by
+    :py:meth:`camlistore.localindex.LocalIndex.blobrefs_of_type`.
+
+    Blobs uploaded while a collection is in progress may not yet be
+    reachable from the roots given to the mark phase, so they may be
+    reported as garbage. Collection should therefore only be run while
+    the store is not being written, or its results treated with care.
+    """
+
+    #: Referenced blobs larger than this many bytes are assumed not to be
+    #: schema blobs.
+    max_schema_size = 1024 * 1024
+
+    def __init__(self, blob_client, concurrency=8):
+        self.blob_client = blob_client
+        self.concurrency = concurrency
+
+    def mark(self, roots, on_missing=None):
+        """
+        Visit every blob reachable from the given iterable of root
+        blobrefs, returning a :py:class:`DigestSet` of the visited blobs.
+
+        The roots are consumed lazily, so they may be produced by a
+        generator. ``on_missing`` may be given as a callable to be called
+        with the blobref of each blob that is referred to but does not
+        exist in the store.
+        """
+        from multiprocessing.pool import ThreadPool
+        import Queue
+
+        roots = iter(roots)
+        marked = DigestSet()
+        # The frontier is worked as a stack, so that it holds roughly one
+        # path's worth of pending schema blobs rather than a whole level.
+        frontier = []
+        results = Queue.Queue()
+        inflight = 0
+
+        def next_blobref():
+            if frontier:
+                return frontier.pop()
+            for root in roots:
+                if marked.add(root):
+                    return root
+            return None
+
+        pool = ThreadPool(self.concurrency)
+        try:
+            while True:
+                while inflight < self.concurrency * 2:
+                    blobref = next_blobref()
+                    if blobref is None:
+                        break
+                    pool.apply_async(
+                        self._fetch_references,
+                        (blobref,),
+                        callback=results.put,
+                    )
+                    inflight += 1
+
+                if not inflight:
+                    break
+
+                (blobref, refs, error) = results.get()
+                inflight -= 1
+                if error is not None:
+                    raise error[0], error[1], error[2]
+                if refs is None:
+                    if on_missing is not None:
+                        on_missing(blobref)
+                    continue
+                for (ref, may_be_schema) in refs:
+                    if marked.add(ref) and may_be_schema:
+                        frontier.append(ref)
+        finally:
+            pool.terminate()
+
+        return marked
+
+    def sweep(self, marked):
+        """
+        Enumerate the blobs in the store that are not in the given
+        :py:class:`DigestSet`, as returned by :py:meth:`mark`, yielding a
+        :py:class:`camlistore.blobclient.BlobMeta` for each.
+        """
+        for meta in self.blob_client.enumerate():
+            if meta.blobref not in marked:
+                yield meta
+
+    def collect(self, roots, delete=None, delete_batch_size=100):
+        """
+        Run both phases of a collection from the given iterable of root
+        blobrefs, returning a :py:class:`GCReport`.
+
+        Most Camlistore servers do not allow blobs to be removed, so by
+        default the garbage is only counted. If ``delete`` is given, it
+        is called with lists of up to ``delete_batch_size`` garbage
+        blobrefs to remove them, such as via some server-specific
+        interface.
+        """
+        report = GCReport()
+        marked = self.mark(roots, on_missing=report.missing.append)
+        report.marked_count = len(marked)
+
+        batch = []
+        for meta in self.blob_client.enumerate():
+            report.blob_count += 1
+            if meta.blobref in marked:
+                continue
+            report.garbage_count += 1
+            report.garbage_bytes += meta.size or 0
+            if delete is not None:
+                batch.append(meta.blobref)
+                if len(batch) >= delete_batch_size:
+                    delete(batch)
+                    batch = []
+        if batch:
+            delete(batch)
+
+        return report
+
+    def _fetch_references(self, blobref):
+        # Returns a tuple of the blobref, a list of (ref, may_be_schema)
+        # tuples for the blobs it refers to (or None if it does not exist)
+        # and the exc_info of any other error.
+        import sys
+        from camlistore.exceptions import NotFoundError
+        from camlistore.schema import parse_schema
+
+        try:
+            data = self.blob_client.get_range(
+                blobref, 0, self.max_schema_size + 1,
+            )
+        except NotFoundError:
+            return (blobref, None, None)
+        except Exception:
+            return (blobref, None, sys.exc_info())
+
+        if len(data) > self.max_schema_size:
+            return (blobref, [], None)
+        schema = parse_schema(data)
+        if schema is None:
+            return (blobref, [], None)
+        return (blobref, _child_references(schema), None)
+
+
+class GCReport(object):
+    """
+    The result of :py:meth:`GarbageCollector.collect`.
+
+    Callers should not instantiate this class directly.
+    """
+
+    def __init__(self):
+        #: The number of blobs found to be reachable from the roots,
+        #: including any that are missing from the store.
+        self.marked_count = 0
+
+        #: The number of blobs enumerated during the sweep.
+        self.blob_count = 0
+
+        #: The number of unreachable blobs found.
+        self.garbage_count = 0
+
+        #: The total size of the unreachable blobs, in bytes, as reported
+        #: by enumeration.
+        self.garbage_bytes = 0
+
+        #: A list of the blobrefs that are referred to by reachable blobs
+        #: but do not exist in the store.
+        self.missing = []
+
+    def __repr__(self):
+        return "<camlistore.gc.GCReport %i blobs, %i garbage>" % (
+            self.blob_count,
+            self.garbage_count,
+        )
+
+
+class DigestSet(object):
+    """
+    A compact set of blobrefs, for tracking large numbers of blobs.
+
+    Rather than keeping each blobref string, the set stores each blob's
+    :py:attr:`camlistore.blobref.Blobref.key` -- a byte identifying the
+    hash algorithm followed by the raw digest -- in an open-addressed hash
+    table of fixed-width slots, using around 30 to 60 bytes per SHA-1
+    blob. Since the whole digest is kept, membership is exact. Strings
+    that aren't valid blobrefs are kept as they are, in an ordinary set.
+    """
+
+    #: The tables are grown when more than this fraction of them is in use.
+    max_load = 0.7
+
+    def __init__(self, capacity=1024):
+        self._capacity = capacity
+        # A table for each key width, since each hash algorithm has its
+        # own digest size.
+        self._tables = {}
+        self._others = set()
+
+    def add(self, blobref):
+        """
+        Add a blobref to the set, returning ``True`` if it was not already
+        present.
+        """
+        key = _blobref_key(blobref)
+        if key is None:
+            if blobref in self._others:
+                return False
+            self._others.add(blobref)
+            return True
+
+        table = self._tables.get(len(key))
+        if table is None:
+            table = self._tables[len(key)] = _KeyTable(
+                len(key),
+                self._capacity,
+                self.max_load,
+            )
+        return table.add(key)
+
+    def __contains__(self, blobref):
+        key = _blobref_key(blobref)
+        if key is None:
+            return blobref in self._others
+        table = self._tables.get(len(key))
+        return table is not None and key in table
+
+    def __len__(self):
+        return len(self._others) + sum(
+            len(table) for table in self._tables.itervalues()
+        )
+
+
+class _KeyTable(object):
+    # An open-addressed hash table of blobref keys of a single width,
+    # stored end to end in a bytearray. The first byte of a key is never
+    # zero, so a zero byte marks an empty slot.
+
+    def __init__(self, width, capacity, max_load):
+        self.width = width
+        self.max_load = max_load
+        size = 8
+        while size * max_load < capacity:
+            size *= 2
+        self._alloc(size)
+        self._count = 0
+
+    def add(self, key):
+        (slots, offset) = self._find(key)
+        if slots[offset]:
+            return False
+        slots[offset:offset + self.width] = key
+        self._count += 1
+        if self._count > self._limit:
+            self._grow()
+        return True
+
+    def __contains__(self, key):
+        (slots, offset) = self._find(key)
+        return slots[offset] != 0
+
+    def __len__(self):
+        return self._count
+
+    def _find(self, key):
+        # Returns the table and the offset of the key's slot, or of the
+        # empty slot where it belongs.
+        slots = self._slots
+        width = self.width
+        mask = self._mask
+        slot = hash(key) & mask
+        while True:
+            offset = slot * width
+            if not slots[offset] or slots[offset:offset + width] == key:
+                return (slots, offset)
+            slot = (slot + 1) & mask
+
+    def _alloc(self, size):
+        self._slots = bytearray(size * self.width)
+        self._mask = size - 1
+        self._limit = int(size * self.max_load)
+
+    def _grow(self):
+        old_slots = self._slots
+        width = self.width
+        self._alloc(len(old_slots) // width * 2)
+        for offset in xrange(0, len(old_slots), width):
+            if old_slots[offset]:
+                key = str(old_slots[offset:offset + width])
+                (slots, new_offset) = self._find(key)
+                slots[new_offset:new_offset + width] = key
+
+
+def _child_references(schema):
+    # Returns the references of a schema blob as (ref, may_be_schema)
+    # tuples. The data chunks of files and the signers' public keys are
+    # never schema blobs, so there is no need to fetch them.
+    from camlistore.schema import schema_references
+
+    leaves = set()
+    signer = schema.get("camliSigner")
+    if signer:
+        leaves.add(signer)
+    if schema.get("camliType") in ("file", "bytes"):
+        for part in schema.get("parts") or ():
+            ref = part.get("blobRef")
+            if ref:
+                leaves.add(ref)
+
+    return [(ref, ref not in leaves) for ref in schema_references(schema)]
+
+
+def _blobref_key(blobref):
+    # Returns the Blobref.key of the given blobref, or None if it isn't a
+    # valid blobref.
+    from camlistore.blobref import ALGORITHMS, _ALGORITHM_IDS, _is_hex
+
+    if isinstance(blobref, unicode):
+        try:
+            blobref = blobref.encode("ascii")
+        except UnicodeEncodeError:
+            return None
+    (algorithm, sep, hexdigest) = blobref.partition("-")
+    algorithm_id = _ALGORITHM_IDS.get(algorithm)
+    if (
+        algorithm_id is None or
+        len(hexdigest) != ALGORITHMS[algorithm] * 2 or
+        not _is_hex(hexdigest)
+    ):
+        return None
+    return algorithm_id + _unhexlify(hexdigest)
+
+
+def _unhexlify(text):
+    import binascii
+    return binascii.unhexlify(text)
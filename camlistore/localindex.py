@@ -0,0 +1,486 @@
+class LocalIndex(object):
+    """
+    A local, on-disk mirror of a subset of the Camlistore search index.
+
+    The index is built by enumerating the blobs in a store via a
+    :py:class:`camlistore.blobclient.BlobClient` and recording the contents
+    of the schema blobs it finds -- permanodes and their claims, files,
+    directories and static sets -- in a SQLite database at ``path``.
+
+    Calling :py:meth:`update` ingests any blobs added since the previous
+    update, since enumeration resumes after the last blobref seen.
+    Afterwards, :py:meth:`describe_blob`,
+    :py:meth:`get_claims_for_permanode` and the attribute lookup methods
+    answer queries locally, without contacting the server's indexer.
+    :py:meth:`describe_blob` returns
+    :py:class:`camlistore.searchclient.BlobDescription` objects whose
+    structure mimics that returned by the real indexer, so they can be
+    used in place of those from
+    :py:class:`camlistore.searchclient.SearchClient` for files,
+    directories and permanodes.
+
+    The references between blobs are also recorded, so that
+    :py:meth:`referrers` can find the blobs that refer to a given blob,
+    which the server cannot answer at all.
+
+    Since enumeration is in blobref order rather than upload order,
+    blobs uploaded after an update whose blobrefs sort *before* the last
+    blobref seen will not be found by subsequent incremental updates.
+    Call :py:meth:`update` with ``full=True`` periodically to re-scan
+    the whole store; blobs already indexed are not fetched again.
+
+    Pass ``":memory:"`` as the path for a temporary in-memory index.
+
+    By default the index may only be used from the thread that created it.
+    Pass ``check_same_thread=False`` to allow it to be used from other
+    threads, in which case the caller must ensure that only one thread
+    uses it at a time.
+    """
+
+    #: Blobs larger than this many bytes are assumed not to be schema
+    #: blobs, and are recorded without being fetched.
+    max_schema_size = 1024 * 1024
+
+    def __init__(self, path, blob_client=None, check_same_thread=True):
+        import sqlite3
+
+        self.path = path
+        self.blob_client = blob_client
+        self.db = sqlite3.connect(path, check_same_thread=check_same_thread)
+        self.db.text_factory = str
+        self._create_tables()
+
+    def _create_tables(self):
+        self.db.executescript(_SCHEMA_SQL)
+        self.db.commit()
+
+    def _get_meta(self, key):
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def _set_meta(self, key, value):
+        self.db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, value),
+        )
+
+    @property
+    def last_blobref(self):
+        """
+        The last blobref ingested by :py:meth:`update`, from which the
+        next incremental update will resume, or ``None`` if nothing has
+        yet been ingested.
+        """
+        return self._get_meta("last_blobref")
+
+    def update(self, full=False, concurrency=4, batch_size=100):
+        """
+        Ingest new blobs from the store into the index, returning the
+        number of blobs added.
+
+        Up to ``concurrency`` blobs are fetched at once, and progress is
+        committed to the database after every ``batch_size`` blobs, so an
+        interrupted update can be resumed without repeating work. Only the
+        first few bytes of each blob are fetched at first, and the rest
+        only if it may be a schema blob, so file chunks are not downloaded.
+        """
+        from multiprocessing.pool import ThreadPool
+
+        if self.blob_client is None:
+            from camlistore.exceptions import ServerFeatureUnavailableError
+            raise ServerFeatureUnavailableError(
+                "Local index has no blob client to update from"
+            )
+
+        after = None if full else self.last_blobref
+        pool = ThreadPool(concurrency)
+        count = 0
+        try:
+            batch = []
+            for blob_meta in self.blob_client.enumerate(after=after):
+                if full and self._has_blob(blob_meta.blobref):
+                    continue
+                batch.append(blob_meta)
+                if len(batch) >= batch_size:
+                    count += self._ingest_batch(pool, batch)
+                    batch = []
+            if batch:
+                count += self._ingest_batch(pool, batch)
+        finally:
+            pool.terminate()
+
+        return count
+
+    def _has_blob(self, blobref):
+        return self.db.execute(
+            "SELECT 1 FROM blobs WHERE blobref = ?", (blobref,),
+        ).fetchone() is not None
+
+    def _fetch_schema(self, blob_meta):
+        from camlistore.schema import (
+            parse_schema,
+            _may_be_schema,
+            _SCHEMA_PREFIX_SIZE,
+        )
+
+        size = blob_meta.size
+        if size is not None and size > self.max_schema_size:
+            return None
+        # Most blobs are file chunks, which can be ruled out from their
+        # first few bytes without downloading the rest.
+        prefix = self.blob_client.get_range(
+            blob_meta.blobref, 0, _SCHEMA_PREFIX_SIZE,
+        )
+        if not _may_be_schema(prefix):
+            return None
+        blob = self.blob_client.get(blob_meta.blobref)
+        return parse_schema(blob.data)
+
+    def _ingest_batch(self, pool, batch):
+        schemas = pool.map(self._fetch_schema, batch)
+        with self.db:
+            for blob_meta, schema in zip(batch, schemas):
+                self.add_blob(blob_meta.blobref, blob_meta.size, schema)
+            last_blobref = self.last_blobref
+            if last_blobref is None or batch[-1].blobref > last_blobref:
+                self._set_meta("last_blobref", batch[-1].blobref)
+        return len(batch)
+
+    def add_blob(self, blobref, size, schema=None):
+        """
+        Record a single blob in the index.
+
+        ``schema`` is the parsed schema blob, as returned by
+        :py:func:`camlistore.schema.parse_schema`, or ``None`` for blobs
+        that are not schema blobs. This is called by :py:meth:`update`
+        for each ingested blob, but may also be called directly to
+        record blobs that the caller has obtained some other way. The
+        caller is responsible for committing the change.
+        """
+        import json
+        from camlistore.schema import file_size, schema_references
+
+        db = self.db
+        camli_type = schema.get("camliType") if schema else None
+
+        db.execute(
+            "INSERT OR REPLACE INTO blobs (blobref, size, camli_type) "
+            "VALUES (?, ?, ?)",
+            (blobref, size, camli_type),
+        )
+
+        if camli_type == "claim":
+            value = schema.get("value")
+            db.execute(
+                "INSERT OR REPLACE INTO claims "
+                "(blobref, permanode, signer, date, claim_type, attr, value) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    blobref,
+                    schema.get("permaNode"),
+                    schema.get("camliSigner"),
+                    schema.get("claimDate"),
+                    schema.get("claimType"),
+                    schema.get("attribute"),
+                    json.dumps(value) if value is not None else None,
+                ),
+            )
+        elif camli_type == "file":
+            db.execute(
+                "INSERT OR REPLACE INTO files "
+                "(blobref, file_name, size, whole_ref, mtime) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    blobref,
+                    schema.get("fileName"),
+                    file_size(schema),
+                    schema.get("wholeRef"),
+                    schema.get("unixMtime"),
+                ),
+            )
+        elif camli_type == "directory":
+            db.execute(
+                "INSERT OR REPLACE INTO dirs "
+                "(blobref, file_name, entries, mtime) "
+                "VALUES (?, ?, ?, ?)",
+                (
+                    blobref,
+                    schema.get("fileName"),
+                    schema.get("entries"),
+                    schema.get("unixMtime"),
+                ),
+            )
+        elif camli_type == "static-set":
+            db.execute(
+                "DELETE FROM set_members WHERE set_ref = ?", (blobref,),
+            )
+            db.executemany(
+                "INSERT INTO set_members (set_ref, position, member) "
+                "VALUES (?, ?, ?)",
+                [
+                    (blobref, i, member)
+                    for i, member in enumerate(schema.get("members") or ())
+                ],
+            )
+
+        db.execute("DELETE FROM refs WHERE from_ref = ?", (blobref,))
+        if schema:
+            db.executemany(
+                "INSERT OR IGNORE INTO refs (from_ref, to_ref) VALUES (?, ?)",
+                [(blobref, ref) for ref in schema_references(schema)],
+            )
+
+    def get_claims_for_permanode(self, blobref):
+        """
+        Get the indexed claims for a particular permanode, as a list of
+        :py:class:`camlistore.searchclient.ClaimMeta` ordered by time.
+
+        This is equivalent to
+        :py:meth:`camlistore.searchclient.SearchClient.get_claims_for_permanode`
+        but is answered from the local index.
+        """
+        import json
+        from camlistore.searchclient import parse_claims
+
+        rows = self.db.execute(
+            "SELECT blobref, signer, date, claim_type, attr, value "
+            "FROM claims WHERE permanode = ?",
+            (blobref,),
+        )
+        raw_claims = []
+        for (claim_ref, signer, date, claim_type, attr, value) in rows:
+            raw = {
+                "blobref": claim_ref,
+                "signer": signer,
+                "permanode": blobref,
+                "date": date,
+                "type": claim_type,
+            }
+            if attr is not None:
+                raw["attr"] = attr
+            if value is not None:
+                raw["value"] = json.loads(value)
+            raw_claims.append(raw)
+
+        return parse_claims(raw_claims)
+
+    def permanode_attributes(self, blobref, at=None):
+        """
+        Return the attributes of the given permanode as of the given
+        :py:class:`datetime.datetime`, or as of now if no time is given,
+        as a :py:class:`dict` mapping attribute names to lists of values.
+        """
+        from camlistore.claims import AttributeResolver
+
+        resolver = AttributeResolver()
+        resolver.add_claims(self.get_claims_for_permanode(blobref))
+        return resolver.attributes(blobref, at=at)
+
+    def find_permanodes(self, attr, value=None):
+        """
+        Return the blobrefs of the permanodes that currently have the given
+        attribute set, optionally restricted to those where one of its
+        values is ``value``.
+        """
+        import json
+
+        if value is None:
+            rows = self.db.execute(
+                "SELECT DISTINCT permanode FROM claims WHERE attr = ?",
+                (attr,),
+            )
+        else:
+            rows = self.db.execute(
+                "SELECT DISTINCT permanode FROM claims "
+                "WHERE attr = ? AND value = ?",
+                (attr, json.dumps(value)),
+            )
+
+        # The claims only tell us which permanodes *may* have the given
+        # attribute value, since later claims may have changed it.
+        ret = []
+        for (permanode,) in rows.fetchall():
+            values = self.permanode_attributes(permanode).get(attr)
+            if values and (value is None or value in values):
+                ret.append(permanode)
+        return sorted(ret)
+
+    def references(self, blobref):
+        """
+        Return a sorted list of the blobrefs that the given indexed schema
+        blob refers to, as described for
+        :py:func:`camlistore.schema.schema_references`.
+        """
+        rows = self.db.execute(
+            "SELECT to_ref FROM refs WHERE from_ref = ? ORDER BY to_ref",
+            (blobref,),
+        )
+        return [to_ref for (to_ref,) in rows]
+
+    def referrers(self, blobref):
+        """
+        Return a sorted list of the blobrefs of the indexed schema blobs
+        that refer to the given blob, such as the files containing a chunk,
+        the static sets listing a file or the claims on a permanode.
+        """
+        rows = self.db.execute(
+            "SELECT from_ref FROM refs WHERE to_ref = ? ORDER BY from_ref",
+            (blobref,),
+        )
+        return [from_ref for (from_ref,) in rows]
+
+    def blobrefs_of_type(self, *camli_types):
+        """
+        Iterate over the blobrefs of the indexed schema blobs whose
+        ``camliType`` is one of those given, in blobref order.
+
+        For example, the permanodes and claims that are the roots for
+        :py:class:`camlistore.gc.GarbageCollector` can be listed with
+        ``index.blobrefs_of_type("permanode", "claim")``.
+        """
+        rows = self.db.execute(
+            "SELECT blobref FROM blobs WHERE camli_type IN (%s) "
+            "ORDER BY blobref" % ", ".join("?" * len(camli_types)),
+            camli_types,
+        )
+        for (blobref,) in rows:
+            yield blobref
+
+    def describe_blob(self, blobref):
+        """
+        Describe a blob from the local index, returning a
+        :py:class:`camlistore.searchclient.BlobDescription`.
+
+        Descriptions of directories include descriptions of their
+        entries as related blobs, so that
+        :py:meth:`camlistore.searchclient.BlobDescription.describe_another`
+        can be used to visit them. Raises
+        :py:class:`camlistore.exceptions.NotFoundError` if the blob has
+        not been indexed.
+        """
+        from camlistore.searchclient import BlobDescription
+
+        raw = self._describe_raw(blobref)
+        if raw is None:
+            from camlistore.exceptions import NotFoundError
+            raise NotFoundError(
+                "Blob not found in local index: %s" % blobref,
+            )
+
+        meta = {blobref: raw}
+        for child_ref in raw.get("dirChildren", ()):
+            child_raw = self._describe_raw(child_ref)
+            if child_raw is not None:
+                meta[child_ref] = child_raw
+
+        return BlobDescription(self, raw, other_raw_dicts=meta)
+
+    def _describe_raw(self, blobref):
+        db = self.db
+        row = db.execute(
+            "SELECT size, camli_type FROM blobs WHERE blobref = ?",
+            (blobref,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        (size, camli_type) = row
+        raw = {
+            "blobRef": blobref,
+            "size": size,
+        }
+        if camli_type is not None:
+            raw["camliType"] = camli_type
+
+        if camli_type == "permanode":
+            raw["permanode"] = {
+                "attr": self.permanode_attributes(blobref),
+            }
+        elif camli_type == "file":
+            (file_name, file_size, whole_ref) = db.execute(
+                "SELECT file_name, size, whole_ref FROM files "
+                "WHERE blobref = ?",
+                (blobref,),
+            ).fetchone()
+            raw["file"] = {
+                "fileName": file_name,
+                "size": file_size,
+            }
+            if whole_ref is not None:
+                raw["file"]["wholeRef"] = whole_ref
+        elif camli_type == "directory":
+            (file_name, entries) = db.execute(
+                "SELECT file_name, entries FROM dirs WHERE blobref = ?",
+                (blobref,),
+            ).fetchone()
+            raw["dir"] = {
+                "fileName": file_name,
+            }
+            children = [
+                member for (member,) in db.execute(
+                    "SELECT member FROM set_members WHERE set_ref = ? "
+                    "ORDER BY position",
+                    (entries,),
+                )
+            ]
+            if children:
+                raw["dirChildren"] = children
+
+        return raw
+
+    def close(self):
+        """
+        Close the underlying database.
+        """
+        self.db.close()
+
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    blobref TEXT PRIMARY KEY,
+    size INTEGER,
+    camli_type TEXT
+);
+CREATE TABLE IF NOT EXISTS claims (
+    blobref TEXT PRIMARY KEY,
+    permanode TEXT,
+    signer TEXT,
+    date TEXT,
+    claim_type TEXT,
+    attr TEXT,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS claims_permanode ON claims (permanode);
+CREATE INDEX IF NOT EXISTS claims_attr_value ON claims (attr, value);
+CREATE TABLE IF NOT EXISTS files (
+    blobref TEXT PRIMARY KEY,
+    file_name TEXT,
+    size INTEGER,
+    whole_ref TEXT,
+    mtime TEXT
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    blobref TEXT PRIMARY KEY,
+    file_name TEXT,
+    entries TEXT,
+    mtime TEXT
+);
+CREATE TABLE IF NOT EXISTS set_members (
+    set_ref TEXT,
+    position INTEGER,
+    member TEXT
+);
+CREATE INDEX IF NOT EXISTS set_members_set_ref ON set_members (set_ref);
+CREATE TABLE IF NOT EXISTS refs (
+    from_ref TEXT,
+    to_ref TEXT,
+    PRIMARY KEY (from_ref, to_ref)
+);
+CREATE INDEX IF NOT EXISTS refs_to_ref ON refs (to_ref, from_ref);
+"""
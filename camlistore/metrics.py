@@ -0,0 +1,388 @@
+class RequestEvent(object):
+    """
+    Describes a single operation performed by a client, as passed to
+    the observers registered with
+    :py:meth:`camlistore.Connection.add_observer`.
+
+    Most events represent one HTTP request, but operations answered from
+    a local cache also produce events, with :py:attr:`cache_hit` set and
+    :py:attr:`status` set to ``None``.
+    """
+
+    __slots__ = (
+        "operation",
+        "url_kind",
+        "blob_count",
+        "bytes_up",
+        "bytes_down",
+        "wire_bytes_up",
+        "wire_bytes_down",
+        "latency",
+        "status",
+        "cache_hit",
+        "error",
+    )
+
+    def __init__(
+        self,
+        operation,
+        url_kind,
+        blob_count=0,
+        bytes_up=0,
+        bytes_down=0,
+        latency=0.0,
+        status=None,
+        cache_hit=None,
+        error=None,
+        wire_bytes_up=None,
+        wire_bytes_down=None,
+    ):
+        #: The name of the client operation, such as ``"get"``,
+        #: ``"stat"``, ``"upload"`` or ``"describe"``.
+        self.operation = operation
+
+        #: The kind of server endpoint involved: ``"blob"`` for the
+        #: blob store or ``"search"`` for the search interface.
+        self.url_kind = url_kind
+
+        #: The number of blobs the operation concerned.
+        self.blob_count = blob_count
+
+        #: The number of bytes of payload sent to the server.
+        self.bytes_up = bytes_up
+
+        #: The number of bytes of payload received from the server.
+        self.bytes_down = bytes_down
+
+        #: The number of bytes of payload actually sent over the wire,
+        #: which is less than :py:attr:`bytes_up` if the request body was
+        #: compressed.
+        self.wire_bytes_up = (
+            wire_bytes_up if wire_bytes_up is not None else bytes_up
+        )
+
+        #: The number of bytes of payload actually received over the wire,
+        #: which is less than :py:attr:`bytes_down` if the response body
+        #: was compressed.
+        self.wire_bytes_down = (
+            wire_bytes_down if wire_bytes_down is not None else bytes_down
+        )
+
+        #: The time taken, in seconds.
+        self.latency = latency
+
+        #: The HTTP status code of the response, or ``None`` if no
+        #: response was received.
+        self.status = status
+
+        #: ``True`` if the operation was answered from a cache, ``False``
+        #: if a cache was consulted but could not answer it, or ``None``
+        #: if no cache was involved.
+        self.cache_hit = cache_hit
+
+        #: The exception raised while making the request, if any.
+        self.error = error
+
+    def __repr__(self):
+        return "<camlistore.metrics.RequestEvent %s %s %.3fs>" % (
+            self.operation,
+            self.status,
+            self.latency,
+        )
+
+
+def notify(observers, event):
+    """
+    Deliver an event to each of the given observers.
+
+    An exception raised by an observer is not allowed to interfere with
+    the operation being observed, so such exceptions are discarded.
+    """
+    for observer in observers:
+        try:
+            observer(event)
+        except Exception:
+            pass
+
+
+def observed_request(
+    http_session,
+    observers,
+    operation,
+    url_kind,
+    method,
+    url,
+    blob_count=0,
+    bytes_up=0,
+    cache_hit=None,
+    wire_bytes_up=None,
+    **kwargs
+):
+    """
+    Make a request via the given HTTP session, reporting a
+    :py:class:`RequestEvent` to the given observers once it completes.
+
+    ``method`` is the name of the HTTP session method to call, such as
+    ``"get"`` or ``"post"``; ``"head"`` is sent via the session's
+    generic ``request`` method. When there are no observers the request
+    is made directly, so instrumentation costs nothing unless it is used.
+    Each request is also wrapped in a tracing span, as described in
+    :py:mod:`camlistore.tracing`.
+
+    ``cache_hit`` should be ``False`` if the request is being made because
+    a cache could not answer the operation. ``wire_bytes_up`` should be
+    given if the request body was compressed, as the size of the
+    compressed body. Compressed response bodies are decoded as described
+    in :py:func:`camlistore.compression.decode_response`.
+    """
+    from camlistore.compression import decode_response
+    from camlistore.tracing import span
+
+    def send():
+        if method == "head":
+            return http_session.request("HEAD", url, **kwargs)
+        else:
+            return decode_response(
+                getattr(http_session, method)(url, **kwargs)
+            )
+
+    with span(
+        "camlistore.request",
+        operation=operation,
+        url_kind=url_kind,
+        blob_count=blob_count,
+        bytes_up=bytes_up,
+    ) as current_span:
+        current_span.set_attribute("http.url", url)
+
+        if not observers:
+            resp = send()
+            current_span.set_attribute("http.status_code", resp.status_code)
+            return resp
+
+        import time
+
+        start = time.time()
+        try:
+            resp = send()
+        except Exception as e:
+            notify(observers, RequestEvent(
+                operation,
+                url_kind,
+                blob_count=blob_count,
+                bytes_up=bytes_up,
+                wire_bytes_up=wire_bytes_up,
+                latency=time.time() - start,
+                cache_hit=cache_hit,
+                error=e,
+            ))
+            raise
+
+        latency = time.time() - start
+        current_span.set_attribute("http.status_code", resp.status_code)
+
+    if method == "head" or kwargs.get("stream"):
+        bytes_down = 0
+        wire_bytes_down = 0
+    else:
+        from camlistore.compression import wire_size
+        bytes_down = len(resp.content)
+        wire_bytes_down = wire_size(resp, bytes_down)
+
+    notify(observers, RequestEvent(
+        operation,
+        url_kind,
+        blob_count=blob_count,
+        bytes_up=bytes_up,
+        bytes_down=bytes_down,
+        wire_bytes_up=wire_bytes_up,
+        wire_bytes_down=wire_bytes_down,
+        latency=latency,
+        status=resp.status_code,
+        cache_hit=cache_hit,
+    ))
+    return resp
+
+
+class LatencyHistogram(object):
+    """
+    A histogram of latencies with fixed, roughly-exponential buckets.
+
+    Recording a value is cheap and memory use is constant, at the cost
+    of percentiles being approximate: :py:meth:`percentile` returns the
+    upper bound of the bucket containing the requested percentile.
+    """
+
+    #: The upper bounds of the buckets, in seconds. A final bucket
+    #: collects all values greater than the last bound.
+    bounds = (
+        0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+        0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    )
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        """
+        Record a single latency, in seconds.
+        """
+        from bisect import bisect_left
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        """
+        The mean of the recorded latencies, or ``None`` if nothing has
+        been recorded.
+        """
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def percentile(self, percent):
+        """
+        Return the approximate latency at the given percentile, between
+        0 and 100, or ``None`` if nothing has been recorded.
+        """
+        if self.count == 0:
+            return None
+
+        threshold = self.count * percent / 100.0
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold and count:
+                if i < len(self.bounds):
+                    return min(self.bounds[i], self.max)
+                break
+        return self.max
+
+    def as_dict(self):
+        """
+        Return the state of the histogram as a :py:class:`dict` suitable
+        for serializing, for export to other metrics systems.
+        """
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "max": self.max,
+            "buckets": [
+                (bound, count)
+                for bound, count in zip(
+                    self.bounds + (float("inf"),),
+                    self.counts,
+                )
+            ],
+        }
+
+
+class MetricsAggregator(object):
+    """
+    An observer that aggregates :py:class:`RequestEvent` objects into
+    counters and latency histograms, broken down by operation.
+
+    An instance can be registered with any number of connections via
+    :py:meth:`camlistore.Connection.add_observer`. Recording an event
+    takes a lock and updates a handful of counters, so it is cheap
+    enough to leave enabled in production. Call :py:meth:`snapshot`
+    periodically to export the current values to some other metrics
+    system.
+    """
+
+    def __init__(self):
+        import threading
+        self._lock = threading.Lock()
+        self._operations = {}
+
+    def __call__(self, event):
+        with self._lock:
+            stats = self._operations.get(event.operation)
+            if stats is None:
+                stats = _OperationStats()
+                self._operations[event.operation] = stats
+            stats.record(event)
+
+    def snapshot(self):
+        """
+        Return the current counters as a :py:class:`dict` keyed by
+        operation name, each value being a :py:class:`dict` of counters
+        along with a ``"latency"`` histogram as returned by
+        :py:meth:`LatencyHistogram.as_dict`.
+        """
+        with self._lock:
+            return {
+                operation: stats.as_dict()
+                for operation, stats in self._operations.iteritems()
+            }
+
+    def latency(self, operation):
+        """
+        Return the :py:class:`LatencyHistogram` for the given operation,
+        or ``None`` if no such operation has been observed.
+        """
+        stats = self._operations.get(operation)
+        return stats.latency if stats is not None else None
+
+    def reset(self):
+        """
+        Discard all of the aggregated values.
+        """
+        with self._lock:
+            self._operations = {}
+
+
+class _OperationStats(object):
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.blobs = 0
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.wire_bytes_up = 0
+        self.wire_bytes_down = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.statuses = {}
+        self.latency = LatencyHistogram()
+
+    def record(self, event):
+        if event.cache_hit:
+            self.cache_hits += 1
+        else:
+            if event.cache_hit is not None:
+                self.cache_misses += 1
+            self.requests += 1
+            status = event.status
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status is None or status >= 400:
+                self.errors += 1
+            self.latency.record(event.latency)
+        self.blobs += event.blob_count
+        self.bytes_up += event.bytes_up
+        self.bytes_down += event.bytes_down
+        self.wire_bytes_up += event.wire_bytes_up
+        self.wire_bytes_down += event.wire_bytes_down
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "blobs": self.blobs,
+            "bytes_up": self.bytes_up,
+            "bytes_down": self.bytes_down,
+            "wire_bytes_up": self.wire_bytes_up,
+            "wire_bytes_down": self.wire_bytes_down,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "statuses": dict(self.statuses),
+            "latency": self.latency.as_dict(),
+        }
@@ -0,0 +1,147 @@
+class MultipartBody(object):
+    """
+    A ``multipart/form-data`` request body that is produced a piece at a
+    time as it is read, rather than being built in memory.
+
+    ``parts`` is an iterable of ``(name, data)`` tuples, one for each file
+    in the form. ``data`` may be a :py:class:`str`, another object
+    supporting the buffer interface such as a :py:class:`bytearray`, or a
+    file object opened in binary mode, from whose current position the
+    rest of the file is sent. Each part is sent as a file of type
+    ``application/octet-stream`` whose filename is the same as its name,
+    as the Camlistore upload handler expects.
+
+    Since the size of every part is known in advance, :py:func:`len` gives
+    the size of the whole body, which ``requests`` sends as the
+    ``Content-Length``. The body is then read and sent in chunks of no more
+    than ``chunk_size`` bytes, so only that much of it need be held in
+    memory beyond the parts themselves.
+    """
+
+    def __init__(self, parts, boundary=None, chunk_size=65536):
+        import uuid
+
+        self.boundary = boundary or uuid.uuid4().hex
+        self.chunk_size = chunk_size
+
+        self._parts = []
+        for (name, data) in parts:
+            header = (
+                '--%s\r\n'
+                'Content-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                'Content-Type: application/octet-stream\r\n'
+                '\r\n'
+            ) % (self.boundary, name, name)
+            start = data.tell() if hasattr(data, "read") else 0
+            self._parts.append((header, data, start, _data_size(data)))
+        self._trailer = "--%s--\r\n" % self.boundary
+
+        #: The total size of the parts' data, excluding the headers and
+        #: boundaries that separate them.
+        self.data_size = sum(size for (_, _, _, size) in self._parts)
+
+        self._length = len(self._trailer) + sum(
+            len(header) + size + 2
+            for (header, _, _, size) in self._parts
+        )
+        self.rewind()
+
+    @property
+    def content_type(self):
+        """
+        The value of the ``Content-Type`` header that the body must be sent
+        with, including its boundary.
+        """
+        return "multipart/form-data; boundary=%s" % self.boundary
+
+    def read(self, size=-1):
+        """
+        Read up to ``size`` bytes of the body, or the whole of the rest of
+        it if ``size`` is not given, returning an empty string once the
+        end has been reached.
+        """
+        if size is None or size < 0:
+            size = self._length
+        pieces = []
+        while size > 0:
+            if self._offset >= len(self._current):
+                self._current = next(self._chunks, "")
+                self._offset = 0
+                if not self._current:
+                    break
+            piece = self._current[self._offset:self._offset + size]
+            self._offset += len(piece)
+            size -= len(piece)
+            pieces.append(piece)
+        return "".join(pieces)
+
+    def rewind(self):
+        """
+        Return to the start of the body, so that it can be read again,
+        such as to retry a request. The file objects given as part data
+        must support ``seek`` for this to work once they have been read.
+        """
+        self._chunks = self._generate()
+        self._current = ""
+        self._offset = 0
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        # requests only streams bodies that are iterable.
+        self.rewind()
+        return self._generate()
+
+    def _generate(self):
+        chunk_size = self.chunk_size
+        for (header, data, start, size) in self._parts:
+            yield header
+            if hasattr(data, "read"):
+                data.seek(start)
+                remaining = size
+                while remaining > 0:
+                    chunk = data.read(min(chunk_size, remaining))
+                    if not chunk:
+                        raise IOError(
+                            "File ended %i bytes before its expected size "
+                            "while sending it" % remaining
+                        )
+                    remaining -= len(chunk)
+                    yield chunk
+            else:
+                for offset in xrange(0, size, chunk_size):
+                    yield _slice(data, offset, offset + chunk_size)
+            yield "\r\n"
+        yield self._trailer
+
+
+def _data_size(data):
+    # Returns the number of bytes of the given part data that remain to
+    # be sent.
+    if not hasattr(data, "read"):
+        return len(data)
+
+    import os
+    import stat
+    start = data.tell()
+    try:
+        file_stat = os.fstat(data.fileno())
+    except (AttributeError, IOError, OSError, ValueError):
+        file_stat = None
+    # Only a regular file's size is its length; devices and other special
+    # files report zero or something unrelated.
+    if file_stat is not None and stat.S_ISREG(file_stat.st_mode):
+        return file_stat.st_size - start
+    data.seek(0, os.SEEK_END)
+    end = data.tell()
+    data.seek(start)
+    return end - start
+
+
+def _slice(data, start, end):
+    if isinstance(data, str):
+        return data[start:end]
+    if isinstance(data, memoryview):
+        return data[start:end].tobytes()
+    return str(buffer(data, start, end - start))
@@ -0,0 +1,563 @@
+class ReplicatedConnection(object):
+    """
+    Represents a logical connection to several replicas of the same
+    Camlistore server, spreading reads across them.
+
+    Most callers should not instantiate this directly, but should instead
+    use :py:func:`connect_replicas`.
+
+    ``connections`` is a list of :py:class:`camlistore.Connection` objects,
+    one per replica. Reads made via :py:attr:`blobs` and :py:attr:`searcher`
+    are sent to whichever healthy replica is expected to answer soonest, as
+    described for :py:class:`ReplicaSet`, whose behavior can be customized
+    via additional keyword arguments. Writes are sent to the replica at
+    index ``primary``, or to every replica if ``write_to_all`` is set.
+    """
+
+    #: Provides access to the replicated blob stores via an instance of
+    #: :py:class:`ReplicatedBlobClient`.
+    blobs = None
+
+    #: Provides access to the replicated search interfaces via an
+    #: instance of :py:class:`ReplicatedSearchClient`.
+    searcher = None
+
+    def __init__(
+        self,
+        connections,
+        primary=0,
+        write_to_all=False,
+        **replica_options
+    ):
+        if not connections:
+            raise ValueError("At least one connection is required")
+
+        self.connections = list(connections)
+        self.blobs = ReplicatedBlobClient(
+            ReplicaSet(
+                [conn.blobs for conn in self.connections],
+                **replica_options
+            ),
+            primary=primary,
+            write_to_all=write_to_all,
+        )
+        self.searcher = ReplicatedSearchClient(
+            ReplicaSet(
+                [conn.searcher for conn in self.connections],
+                **replica_options
+            ),
+        )
+
+    def add_observer(self, observer):
+        """
+        Register an observer with each of the underlying connections, as
+        described for :py:meth:`camlistore.Connection.add_observer`.
+        """
+        for conn in self.connections:
+            conn.add_observer(observer)
+
+    def remove_observer(self, observer):
+        """
+        Stop notifying an observer previously registered with
+        :py:meth:`add_observer`.
+        """
+        for conn in self.connections:
+            conn.remove_observer(observer)
+
+    def close(self):
+        """
+        Release the worker threads used for hedged requests.
+        """
+        self.blobs.replicas.close()
+        self.searcher.replicas.close()
+
+
+def connect_replicas(base_urls, **kwargs):
+    """
+    Create a connection to several replicas of a Camlistore server, given
+    their base URLs.
+
+    Each server is discovered as for :py:func:`camlistore.connect`, and
+    the resulting connections are combined into a
+    :py:class:`ReplicatedConnection`, which is returned. Keyword arguments
+    are passed on to the :py:class:`ReplicatedConnection` initializer.
+    """
+    from camlistore.connection import connect
+
+    return ReplicatedConnection(
+        [connect(base_url) for base_url in base_urls],
+        **kwargs
+    )
+
+
+class ReplicaSet(object):
+    """
+    Dispatches read operations across a set of equivalent clients,
+    tracking the health of each.
+
+    Each operation is sent to one healthy replica, chosen by comparing the
+    recent latency and number of outstanding requests of two randomly
+    selected replicas and taking the better of the two. This spreads load
+    while steering away from replicas that are slow or busy.
+
+    If an operation has not completed within the ``hedge_percentile``
+    percentile of the latencies observed for that operation -- or within
+    ``initial_hedge_delay`` seconds, until enough latencies have been
+    observed -- a duplicate *hedged* request is sent to another replica and
+    whichever answers first is used. Set ``hedge_percentile`` to ``None``
+    to disable hedging. If a replica fails, the operation is retried on
+    the others, and
+    :py:class:`camlistore.exceptions.NotFoundError` is raised only once
+    every replica has reported that the requested object does not exist,
+    since a replica may not yet have received recently-written data.
+
+    A replica is ejected for ``ejection_time`` seconds when it fails
+    ``max_failures`` times in a row, or when its recent latency exceeds
+    ``slow_factor`` times that of the fastest replica. Ejected replicas
+    are only used if no others are available.
+    """
+
+    def __init__(
+        self,
+        clients,
+        hedge_percentile=95,
+        initial_hedge_delay=0.1,
+        max_failures=3,
+        ejection_time=30,
+        slow_factor=5,
+        max_workers=16,
+        clock=None,
+    ):
+        import random
+        import threading
+        import time
+
+        if not clients:
+            raise ValueError("At least one client is required")
+
+        self.clients = list(clients)
+        self.hedge_percentile = hedge_percentile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.max_failures = max_failures
+        self.ejection_time = ejection_time
+        self.slow_factor = slow_factor
+        self.max_workers = max_workers
+
+        self._clock = clock or time.time
+        self._random = random.Random()
+        self._lock = threading.Lock()
+        self._endpoints = [_Endpoint(client) for client in self.clients]
+        self._latencies = {}
+        self._pool = None
+
+    def call(self, operation, func):
+        """
+        Perform an operation on one or more replicas, returning the first
+        successful result.
+
+        ``operation`` is a name used to group latencies for deciding when
+        to hedge, and ``func`` is called with a single client argument to
+        perform the operation on that client. ``func`` may be called
+        several times concurrently, so it must not have side-effects.
+        """
+        import time
+        from Queue import Empty, Queue
+
+        candidates = self._candidates()
+        results = Queue()
+        state = {"next": 0, "outstanding": 0}
+
+        def launch():
+            if state["next"] >= len(candidates):
+                return False
+            endpoint = candidates[state["next"]]
+            state["next"] += 1
+            state["outstanding"] += 1
+            with self._lock:
+                endpoint.inflight += 1
+            self._get_pool().apply_async(
+                self._attempt,
+                (operation, endpoint, func, results),
+            )
+            return True
+
+        launch()
+
+        # A hedged request is made if no result has arrived by the time
+        # the hedge is due.
+        hedge_at = None
+        hedge_delay = self._hedge_delay(operation)
+        if hedge_delay is not None and len(candidates) > 1:
+            hedge_at = time.time() + hedge_delay
+
+        not_found = None
+        error = None
+        while True:
+            if hedge_at is None:
+                (exc_info, result) = results.get()
+            else:
+                try:
+                    (exc_info, result) = results.get(
+                        timeout=max(0, hedge_at - time.time()),
+                    )
+                except Empty:
+                    hedge_at = None
+                    launch()
+                    continue
+
+            state["outstanding"] -= 1
+            if exc_info is None:
+                return result
+
+            from camlistore.exceptions import NotFoundError
+            if isinstance(exc_info[1], NotFoundError):
+                not_found = not_found or exc_info
+            else:
+                error = error or exc_info
+
+            # Fail over to another replica, if there's one left.
+            if not launch() and state["outstanding"] == 0:
+                exc_info = error or not_found
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+    def healthy_clients(self):
+        """
+        Return the list of clients that are not currently ejected.
+        """
+        now = self._clock()
+        with self._lock:
+            return [
+                endpoint.client for endpoint in self._endpoints
+                if endpoint.ejected_until <= now
+            ]
+
+    def close(self):
+        """
+        Release the worker threads used for hedged requests.
+        """
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                from multiprocessing.pool import ThreadPool
+                self._pool = ThreadPool(self.max_workers)
+            return self._pool
+
+    def _candidates(self):
+        # Returns all of the endpoints in the order they should be tried:
+        # first the better of two randomly-chosen healthy endpoints, then
+        # the other healthy endpoints from best to worst, and finally the
+        # ejected endpoints, soonest-to-return first.
+        now = self._clock()
+        with self._lock:
+            healthy = [
+                endpoint for endpoint in self._endpoints
+                if endpoint.ejected_until <= now
+            ]
+            ejected = sorted(
+                (
+                    endpoint for endpoint in self._endpoints
+                    if endpoint.ejected_until > now
+                ),
+                key=lambda endpoint: endpoint.ejected_until,
+            )
+            if len(healthy) > 2:
+                pair = self._random.sample(healthy, 2)
+                first = min(pair, key=_Endpoint.score)
+            elif healthy:
+                first = min(healthy, key=_Endpoint.score)
+            else:
+                return ejected
+            rest = sorted(
+                (endpoint for endpoint in healthy if endpoint is not first),
+                key=_Endpoint.score,
+            )
+            return [first] + rest + ejected
+
+    def _hedge_delay(self, operation):
+        if self.hedge_percentile is None:
+            return None
+        with self._lock:
+            histogram = self._latencies.get(operation)
+            if histogram is None or histogram.count < _MIN_HEDGE_SAMPLES:
+                return self.initial_hedge_delay
+            return histogram.percentile(self.hedge_percentile)
+
+    def _attempt(self, operation, endpoint, func, results):
+        import sys
+        from camlistore.exceptions import NotFoundError
+
+        start = self._clock()
+        try:
+            result = func(endpoint.client)
+        except NotFoundError:
+            # The replica is working fine; it just doesn't have the data.
+            self._record(operation, endpoint, self._clock() - start, True)
+            results.put((sys.exc_info(), None))
+        except Exception:
+            self._record(operation, endpoint, None, False)
+            results.put((sys.exc_info(), None))
+        else:
+            self._record(operation, endpoint, self._clock() - start, True)
+            results.put((None, result))
+
+    def _record(self, operation, endpoint, latency, success):
+        from camlistore.metrics import LatencyHistogram
+
+        now = self._clock()
+        with self._lock:
+            endpoint.inflight -= 1
+            if not success:
+                endpoint.failures += 1
+                if endpoint.failures >= self.max_failures:
+                    endpoint.failures = 0
+                    endpoint.ejected_until = now + self.ejection_time
+                return
+
+            endpoint.failures = 0
+            endpoint.record_latency(latency)
+
+            histogram = self._latencies.get(operation)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self._latencies[operation] = histogram
+            histogram.record(latency)
+
+            # Eject this endpoint if it's much slower than the fastest
+            # healthy one, as long as that leaves another to use.
+            others = [
+                other.latency for other in self._endpoints
+                if other is not endpoint and
+                other.ejected_until <= now and
+                other.latency is not None
+            ]
+            if (
+                self.slow_factor and
+                others and
+                endpoint.samples >= _MIN_EJECTION_SAMPLES and
+                endpoint.latency > min(others) * self.slow_factor
+            ):
+                endpoint.ejected_until = now + self.ejection_time
+                endpoint.latency = None
+                endpoint.samples = 0
+
+
+class ReplicatedBlobClient(object):
+    """
+    A blob client that reads from several replicas via a
+    :py:class:`ReplicaSet`, offering the same methods as
+    :py:class:`camlistore.blobclient.BlobClient`.
+
+    Callers should not instantiate this class directly. Instead, call
+    :py:func:`connect_replicas` and access
+    :py:attr:`ReplicatedConnection.blobs`.
+
+    Writes go to the client at index ``primary`` of the replica set, or
+    to every client if ``write_to_all`` is set, in which case a write
+    fails if it fails on any replica. :py:meth:`enumerate` always uses
+    the primary, since replicas may hold different sets of blobs.
+    """
+
+    def __init__(self, replicas, primary=0, write_to_all=False):
+        #: The :py:class:`ReplicaSet` used to read from the replicas.
+        self.replicas = replicas
+        self.primary = primary
+        self.write_to_all = write_to_all
+
+    @property
+    def primary_client(self):
+        """
+        The :py:class:`camlistore.blobclient.BlobClient` for the primary
+        replica.
+        """
+        return self.replicas.clients[self.primary]
+
+    def get(self, blobref):
+        """
+        Get the data for a blob, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.get`.
+        """
+        return self.replicas.call("get", lambda blobs: blobs.get(blobref))
+
+    def get_size(self, blobref):
+        """
+        Get the size of a blob, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.get_size`.
+        """
+        return self.replicas.call(
+            "get_size",
+            lambda blobs: blobs.get_size(blobref),
+        )
+
+    def get_range(self, blobref, offset, length=None):
+        """
+        Get part of the data for a blob, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.get_range`.
+        """
+        return self.replicas.call(
+            "get_range",
+            lambda blobs: blobs.get_range(blobref, offset, length),
+        )
+
+    def blob_exists(self, blobref):
+        """
+        Determine if a blob exists, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.blob_exists`.
+        """
+        from camlistore.exceptions import NotFoundError
+        try:
+            self.get_size(blobref)
+        except NotFoundError:
+            return False
+        else:
+            return True
+
+    def get_size_multi(self, *blobrefs):
+        """
+        Get the sizes of several blobs, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.get_size_multi`.
+
+        The sizes are retrieved from a single replica. When writing only
+        to the primary, this may report as missing blobs that have not yet
+        been replicated.
+        """
+        return self.replicas.call(
+            "stat",
+            lambda blobs: blobs.get_size_multi(*blobrefs),
+        )
+
+    def enumerate(self, after=None):
+        """
+        Enumerate the blobs on the primary replica, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.enumerate`.
+        """
+        return self.primary_client.enumerate(after=after)
+
+    def put(self, blob):
+        """
+        Write a single blob, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.put`.
+        """
+        return self.put_multi(blob)[0]
+
+    def put_multi(self, *blobs):
+        """
+        Upload several blobs, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.put_multi`.
+        """
+        if not self.write_to_all:
+            return self.primary_client.put_multi(*blobs)
+
+        from multiprocessing.pool import ThreadPool
+
+        clients = self.replicas.clients
+        pool = ThreadPool(len(clients))
+        try:
+            pending = [
+                pool.apply_async(client.put_multi, blobs)
+                for client in clients
+            ]
+            # get() re-raises any exception from the upload.
+            return [result.get() for result in pending][0]
+        finally:
+            pool.terminate()
+
+    def uploader(self, **kwargs):
+        """
+        Create a :py:class:`camlistore.uploader.Uploader` that uploads
+        via :py:meth:`put_multi`.
+        """
+        from camlistore.uploader import Uploader
+        return Uploader(self, **kwargs)
+
+
+class ReplicatedSearchClient(object):
+    """
+    A search client that reads from several replicas via a
+    :py:class:`ReplicaSet`, offering the same query methods as
+    :py:class:`camlistore.searchclient.SearchClient`.
+
+    Callers should not instantiate this class directly. Instead, call
+    :py:func:`connect_replicas` and access
+    :py:attr:`ReplicatedConnection.searcher`.
+    """
+
+    def __init__(self, replicas):
+        #: The :py:class:`ReplicaSet` used to read from the replicas.
+        self.replicas = replicas
+
+    def query(self, expression):
+        """
+        Run a query, as described for
+        :py:meth:`camlistore.searchclient.SearchClient.query`.
+        """
+        return self.replicas.call(
+            "query",
+            lambda searcher: searcher.query(expression),
+        )
+
+    def describe_blob(self, blobref, **kwargs):
+        """
+        Describe a blob, as described for
+        :py:meth:`camlistore.searchclient.SearchClient.describe_blob`.
+        """
+        return self.replicas.call(
+            "describe",
+            lambda searcher: searcher.describe_blob(blobref, **kwargs),
+        )
+
+    def describe_blobs(self, blobrefs, **kwargs):
+        """
+        Describe several blobs, as described for
+        :py:meth:`camlistore.searchclient.SearchClient.describe_blobs`.
+        """
+        return self.replicas.call(
+            "describe",
+            lambda searcher: searcher.describe_blobs(blobrefs, **kwargs),
+        )
+
+    def get_claims_for_permanode(self, blobref):
+        """
+        Get the claims for a permanode, as described for the method of
+        the same name on :py:class:`camlistore.searchclient.SearchClient`.
+        """
+        return self.replicas.call(
+            "claims",
+            lambda searcher: searcher.get_claims_for_permanode(blobref),
+        )
+
+
+class _Endpoint(object):
+
+    # Weight of the newest sample in the latency moving average.
+    alpha = 0.3
+
+    def __init__(self, client):
+        self.client = client
+        self.latency = None
+        self.samples = 0
+        self.inflight = 0
+        self.failures = 0
+        self.ejected_until = 0
+
+    def record_latency(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.alpha * (latency - self.latency)
+        self.samples += 1
+
+    def score(self):
+        # Lower is better. Endpoints we know nothing about are tried
+        # first so that we learn about them.
+        return (self.latency or 0.0) * (self.inflight + 1)
+
+
+_MIN_HEDGE_SAMPLES = 20
+_MIN_EJECTION_SAMPLES = 5
@@ -0,0 +1,202 @@
+def parse_schema(data):
+    """
+    Parse the given blob data as a schema blob, returning the decoded
+    JSON object as a :py:class:`dict`, or ``None`` if the data is not
+    a schema blob.
+    """
+    import json
+
+    # Cheap check first, since most blobs in a typical store are file
+    # chunks that aren't JSON at all.
+    if not _may_be_schema(data):
+        return None
+
+    try:
+        schema = json.loads(data)
+    except ValueError:
+        return None
+
+    if not isinstance(schema, dict) or "camliVersion" not in schema:
+        return None
+
+    return schema
+
+
+def schema_references(schema):
+    """
+    Return a list of the blobrefs referred to by the given parsed schema
+    blob.
+
+    This covers the references that keep other blobs alive: the parts of
+    files and byte sequences, the entries of directories, the members of
+    static sets, the permanode a claim applies to and any blob it sets as
+    a permanode's ``camliContent``, the target of a share, and the public
+    key that signed the blob.
+    """
+    camli_type = schema.get("camliType")
+    refs = []
+
+    signer = schema.get("camliSigner")
+    if signer:
+        refs.append(signer)
+
+    if camli_type in ("file", "bytes"):
+        for part in schema.get("parts") or ():
+            for key in ("blobRef", "bytesRef"):
+                ref = part.get(key)
+                if ref:
+                    refs.append(ref)
+    elif camli_type == "directory":
+        entries = schema.get("entries")
+        if entries:
+            refs.append(entries)
+    elif camli_type == "static-set":
+        refs.extend(member for member in schema.get("members") or () if member)
+    elif camli_type == "claim":
+        permanode = schema.get("permaNode")
+        if permanode:
+            refs.append(permanode)
+        if schema.get("attribute") == "camliContent":
+            value = schema.get("value")
+            if value:
+                refs.append(value)
+    elif camli_type == "share":
+        target = schema.get("target")
+        if target:
+            refs.append(target)
+
+    return refs
+
+
+def file_size(schema):
+    """
+    Return the total size in bytes of a ``file`` or ``bytes`` schema blob,
+    as the sum of the sizes of its parts.
+    """
+    return sum(
+        int(part.get("size", 0)) for part in schema.get("parts") or ()
+    )
+
+
+def schema_blob(schema):
+    """
+    Serialize a schema object as a :py:class:`camlistore.Blob`.
+
+    ``camliVersion`` is added if not already present, and is placed first
+    in the serialized JSON as Camlistore requires. The remaining keys are
+    sorted, so that equal schema objects always produce the same blob.
+    """
+    import json
+    from camlistore.blobclient import Blob
+
+    rest = dict(schema)
+    version = rest.pop("camliVersion", 1)
+    body = json.dumps(rest, indent=2, sort_keys=True, separators=(",", ": "))
+    if rest:
+        data = '{"camliVersion": %i,\n%s' % (version, body[2:])
+    else:
+        data = '{"camliVersion": %i\n}' % version
+    return Blob(data)
+
+
+def format_time(timestamp):
+    """
+    Format a Unix timestamp in the RFC3339 format used in schema blobs.
+    """
+    from datetime import datetime
+    return datetime.utcfromtimestamp(timestamp).strftime(
+        "%Y-%m-%dT%H:%M:%S.%fZ"
+    )
+
+
+def file_schema(file_name, parts, mode=None, mtime=None):
+    """
+    Build a ``file`` schema object for a file with the given name, whose
+    data is the concatenation of the given parts.
+
+    ``parts`` is a list of ``(blobref, size)`` tuples. ``mode`` and
+    ``mtime`` are the file's permission bits and modification time as
+    returned by :py:func:`os.stat`, and are recorded if given.
+    """
+    schema = {
+        "camliType": "file",
+        "parts": [
+            {"blobRef": blobref, "size": size}
+            for (blobref, size) in parts
+        ],
+    }
+    _set_file_name(schema, file_name)
+    _add_unix_attributes(schema, mode, mtime)
+    return schema
+
+
+def directory_schema(file_name, entries_ref, mode=None, mtime=None):
+    """
+    Build a ``directory`` schema object for a directory with the given
+    name, whose entries are the members of the ``static-set`` schema blob
+    with blobref ``entries_ref``.
+    """
+    schema = {
+        "camliType": "directory",
+        "entries": entries_ref,
+    }
+    _set_file_name(schema, file_name)
+    _add_unix_attributes(schema, mode, mtime)
+    return schema
+
+
+def symlink_schema(file_name, target, mtime=None):
+    """
+    Build a ``symlink`` schema object for a symbolic link with the given
+    name pointing at the given target path.
+    """
+    schema = {
+        "camliType": "symlink",
+        "symlinkTarget": target,
+    }
+    _set_file_name(schema, file_name)
+    _add_unix_attributes(schema, None, mtime)
+    return schema
+
+
+def static_set_schema(members):
+    """
+    Build a ``static-set`` schema object with the given member blobrefs.
+    """
+    return {
+        "camliType": "static-set",
+        "members": list(members),
+    }
+
+
+def _may_be_schema(data):
+    # Whether data starting with the given bytes could be a schema blob,
+    # judging by no more than its first _SCHEMA_PREFIX_SIZE bytes.
+    return (
+        data.lstrip()[:1] == "{" and
+        "camliVersion" in data[:_SCHEMA_PREFIX_SIZE]
+    )
+
+
+def _set_file_name(schema, file_name):
+    # Names that aren't valid UTF-8 can't be represented as JSON strings,
+    # so Camlistore records their bytes instead.
+    if isinstance(file_name, str):
+        try:
+            file_name.decode("utf-8")
+        except UnicodeDecodeError:
+            schema["fileNameBytes"] = [ord(c) for c in file_name]
+            return
+    schema["fileName"] = file_name
+
+
+def _add_unix_attributes(schema, mode, mtime):
+    if mode is not None:
+        schema["unixPermission"] = "0%o" % (mode & 07777)
+    if mtime is not None:
+        schema["unixMtime"] = format_time(mtime)
+
+
+# The camliVersion property must appear within this many bytes of the
+# start of a schema blob.
+_SCHEMA_PREFIX_SIZE = 256
@@ -0,0 +1,291 @@
+class Scrubber(object):
+    """
+    Verifies that the blobs in a blob store match their blobrefs.
+
+    ``blob_client`` is a :py:class:`camlistore.blobclient.BlobClient`.
+    Each blob listed by :py:meth:`camlistore.blobclient.BlobClient.enumerate`
+    is downloaded with
+    :py:meth:`camlistore.blobclient.BlobClient.download`, hashing its data
+    as it arrives, and its size and hash are checked against what the
+    enumeration reported. Up to ``concurrency`` blobs are verified at once,
+    so that fetching some blobs overlaps with hashing others; since
+    :py:mod:`hashlib` releases the interpreter lock while hashing large
+    buffers, the hashing itself can use several cores.
+
+    To limit the load placed on a production server, verification can be
+    throttled to ``max_bytes_per_second`` bytes of blob data and
+    ``max_blobs_per_second`` blobs.
+    """
+
+    def __init__(
+        self,
+        blob_client,
+        concurrency=4,
+        max_bytes_per_second=None,
+        max_blobs_per_second=None,
+    ):
+        self.blob_client = blob_client
+        self.concurrency = concurrency
+        self._byte_limiter = (
+            _TokenBucket(max_bytes_per_second)
+            if max_bytes_per_second else None
+        )
+        self._blob_limiter = (
+            _TokenBucket(max_blobs_per_second)
+            if max_blobs_per_second else None
+        )
+
+    def scrub(
+        self,
+        after=None,
+        checkpoint_path=None,
+        checkpoint_interval=1000,
+        on_problem=None,
+    ):
+        """
+        Verify every blob in the store, returning a :py:class:`ScrubReport`.
+
+        If ``after`` is given, only blobs whose blobrefs sort after it are
+        verified, which allows an earlier scrub to be resumed from
+        :py:attr:`ScrubReport.last_blobref`.
+
+        If ``checkpoint_path`` is given, progress is saved to that file
+        every ``checkpoint_interval`` blobs. When ``after`` is not given
+        and the file exists, the scrub resumes from the saved position.
+        The file is removed once the scrub completes, so that the next
+        scrub starts from the beginning.
+
+        Problems are collected in the report; ``on_problem`` may also be
+        given as a callable to be called with each :py:class:`ScrubProblem`
+        as soon as it is found.
+        """
+        from collections import deque
+        from multiprocessing.pool import ThreadPool
+
+        if after is None and checkpoint_path is not None:
+            after = _read_checkpoint(checkpoint_path)
+
+        report = ScrubReport(after)
+        window = deque()
+        since_checkpoint = 0
+
+        def finish_oldest():
+            (meta, result) = window.popleft()
+            problem = result.get()
+            report._record(meta, problem)
+            if problem is not None and on_problem is not None:
+                on_problem(problem)
+
+        pool = ThreadPool(self.concurrency)
+        try:
+            for meta in self.blob_client.enumerate(after=after):
+                self._throttle(meta.size)
+                window.append((
+                    meta,
+                    pool.apply_async(self.verify, (meta.blobref, meta.size)),
+                ))
+
+                # Results are consumed in enumeration order so that
+                # last_blobref is always safe to resume from, with a
+                # bounded number of verifications queued up.
+                if len(window) >= self.concurrency * 2:
+                    finish_oldest()
+                    since_checkpoint += 1
+
+                if (
+                    checkpoint_path is not None and
+                    since_checkpoint >= checkpoint_interval
+                ):
+                    _write_checkpoint(checkpoint_path, report.last_blobref)
+                    since_checkpoint = 0
+
+            while window:
+                finish_oldest()
+        finally:
+            pool.terminate()
+
+        if checkpoint_path is not None:
+            _remove_checkpoint(checkpoint_path)
+
+        return report
+
+    def verify(self, blobref, expected_size=None):
+        """
+        Verify a single blob, returning a :py:class:`ScrubProblem`
+        describing what is wrong with it, or ``None`` if it is intact.
+        """
+        from camlistore.exceptions import (
+            HashMismatchError,
+            NotFoundError,
+        )
+
+        sink = _CountingSink()
+        try:
+            self.blob_client.download(blobref, sink)
+        except NotFoundError:
+            return ScrubProblem(blobref, "missing", "Blob not found")
+        except HashMismatchError as e:
+            return ScrubProblem(blobref, "corrupt", str(e))
+        except Exception as e:
+            return ScrubProblem(blobref, "error", str(e))
+
+        if expected_size is not None and sink.size != expected_size:
+            return ScrubProblem(
+                blobref,
+                "size",
+                "Expected %i bytes but got %i" % (expected_size, sink.size),
+            )
+
+        return None
+
+    def _throttle(self, size):
+        if self._blob_limiter is not None:
+            self._blob_limiter.consume(1)
+        if self._byte_limiter is not None and size:
+            self._byte_limiter.consume(size)
+
+
+class ScrubReport(object):
+    """
+    The result of :py:meth:`Scrubber.scrub`.
+
+    Callers should not instantiate this class directly.
+    """
+
+    def __init__(self, after=None):
+        #: The number of blobs verified.
+        self.blob_count = 0
+
+        #: The total size of the blobs verified, in bytes, as reported
+        #: by enumeration.
+        self.byte_count = 0
+
+        #: A list of :py:class:`ScrubProblem` objects describing the
+        #: blobs that failed verification, in blobref order.
+        self.problems = []
+
+        #: The blobref of the last blob verified, suitable for passing
+        #: as the ``after`` argument of :py:meth:`Scrubber.scrub` to
+        #: resume scrubbing. If no blobs were verified, this is the
+        #: position the scrub started from.
+        self.last_blobref = after
+
+    @property
+    def ok(self):
+        """
+        ``True`` if no problems were found.
+        """
+        return not self.problems
+
+    def problems_of_kind(self, kind):
+        """
+        Return the list of problems of the given kind, as described for
+        :py:attr:`ScrubProblem.kind`.
+        """
+        return [problem for problem in self.problems if problem.kind == kind]
+
+    def _record(self, meta, problem):
+        self.blob_count += 1
+        self.byte_count += meta.size or 0
+        self.last_blobref = meta.blobref
+        if problem is not None:
+            self.problems.append(problem)
+
+    def __repr__(self):
+        return "<camlistore.scrub.ScrubReport %i blobs, %i problems>" % (
+            self.blob_count,
+            len(self.problems),
+        )
+
+
+class ScrubProblem(object):
+    """
+    Describes a blob that failed verification during a scrub.
+    """
+
+    def __init__(self, blobref, kind, detail):
+        #: The blobref of the problematic blob.
+        self.blobref = blobref
+
+        #: The kind of problem: ``"corrupt"`` if the blob's data does not
+        #: match its blobref, ``"size"`` if its size does not match that
+        #: reported by enumeration, ``"missing"`` if it was enumerated
+        #: but could not then be retrieved, or ``"error"`` if it could
+        #: not be verified due to some other error.
+        self.kind = kind
+
+        #: A human-readable description of the problem.
+        self.detail = detail
+
+    def __repr__(self):
+        return "<camlistore.scrub.ScrubProblem %s %s>" % (
+            self.kind,
+            self.blobref,
+        )
+
+
+class _CountingSink(object):
+    # A write-only file that discards its data, remembering only its size.
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+class _TokenBucket(object):
+    # Limits the rate at which some resource is consumed, allowing bursts
+    # of up to one second's worth.
+
+    def __init__(self, rate, clock=None, sleep=None):
+        import threading
+        import time
+
+        self.rate = float(rate)
+        self._clock = clock or time.time
+        self._sleep = sleep or time.sleep
+        self._lock = threading.Lock()
+        self._tokens = self.rate
+        self._updated = self._clock()
+
+    def consume(self, amount):
+        # Blocks until the given amount may be consumed. Amounts larger
+        # than the burst size are allowed, but must be paid back before
+        # anything else is consumed.
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self.rate,
+                self._tokens + (now - self._updated) * self.rate,
+            )
+            self._updated = now
+            self._tokens -= amount
+            deficit = -self._tokens
+        if deficit > 0:
+            self._sleep(deficit / self.rate)
+
+
+def _read_checkpoint(path):
+    try:
+        with open(path) as f:
+            return f.read().strip() or None
+    except IOError:
+        return None
+
+
+def _write_checkpoint(path, blobref):
+    import os
+    if blobref is None:
+        return
+    with open(path + ".tmp", "w") as f:
+        f.write(blobref + "\n")
+    os.rename(path + ".tmp", path)
+
+
+def _remove_checkpoint(path):
+    import os
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -1,5 +1,3 @@
-
-
 class SearchClient(object):
     """
     Low-level interface to Camlistore indexer search operations.
@@ -22,9 +20,44 @@ class SearchClient(object):
     object and access :py:attr:`camlistore.Connection.searcher`.
     """
 
-    def __init__(self, http_session, base_url):
+    #: An optional :py:class:`DescribeCache` instance used to answer
+    #: :py:meth:`describe_blob` requests locally when a recent enough
+    #: description is available. ``None`` (the default) disables caching.
+    describe_cache = None
+
+    def __init__(
+        self,
+        http_session,
+        base_url,
+        describe_cache=None,
+        observers=None,
+    ):
         self.http_session = http_session
         self.base_url = base_url
+        self.describe_cache = describe_cache
+        self.observers = observers if observers is not None else []
+
+    def _request(self, operation, method, url, **kwargs):
+        from camlistore.metrics import observed_request
+        return observed_request(
+            self.http_session,
+            self.observers,
+            operation,
+            "search",
+            method,
+            url,
+            **kwargs
+        )
+
+    def _notify_cache_hit(self, operation, blob_count):
+        if self.observers:
+            from camlistore.metrics import notify, RequestEvent
+            notify(self.observers, RequestEvent(
+                operation,
+                "search",
+                blob_count=blob_count,
+                cache_hit=True,
+            ))
 
     def _make_url(self, path):
         if self.base_url is not None:
@@ -46,39 +79,62 @@ class SearchClient(object):
 
         Query constraints are not yet supported.
         """
-        import json
-        req_url = self._make_url("camli/search/query")
-
-        data = {
+        raw_data = self._query_raw({
             # TODO: Understand how constraints work and implement them
             # https://github.com/bradfitz/camlistore/blob/
             # ca58231336e5711abacb059763beb06e8b2b1788/pkg/search/query.go#L255
             #"constraint": "",
             "expression": expression,
-        }
+        })
 
-        resp = self.http_session.post(
+        return [
+            SearchResult(x["blob"]) for x in raw_data["blobs"] or ()
+        ]
+
+    def subscribe(self, expression, callback=None, **kwargs):
+        """
+        Subscribe to changes in the results of a query, returning a
+        :py:class:`camlistore.subscription.QuerySubscription`.
+
+        The subscription can be iterated to obtain each change as it
+        happens. Alternatively, if ``callback`` is given, it is called
+        with each change from a background thread until the subscription
+        is closed. Keyword arguments are passed on to the
+        :py:class:`camlistore.subscription.QuerySubscription` initializer.
+        """
+        from camlistore.subscription import QuerySubscription
+
+        subscription = QuerySubscription(self, expression, **kwargs)
+        if callback is not None:
+            subscription.start(callback)
+        return subscription
+
+    def _query_raw(self, search_query):
+        # Runs the given search query object, returning the raw response.
+        import json
+        req_url = self._make_url("camli/search/query")
+
+        resp = self._request(
+            "query",
+            "post",
             req_url,
-            data=json.dumps(data),
+            data=json.dumps(search_query),
         )
 
         if resp.status_code != 200:
             from camlistore.exceptions import ServerError
             raise ServerError(
                 "Failed to search for %r: server returned %i %s" % (
-                    expression,
+                    search_query.get("expression"),
                     resp.status_code,
                     resp.reason,
-                )
+                ),
+                status_code=resp.status_code,
             )
 
-        raw_data = json.loads(resp.content)
-
-        return [
-            SearchResult(x["blob"]) for x in raw_data["blobs"]
-        ]
+        return json.loads(resp.content)
 
-    def describe_blob(self, blobref):
+    def describe_blob(self, blobref, at=None, max_age=None):
         """
         Request a description of a particular blob, returning a
         :py:class:`BlobDescription` object.
@@ -87,33 +143,187 @@ class SearchClient(object):
         so it contains only the subset of information retained by the
         indexer. The level of detail in the returned object will thus
         depend on what the indexer knows about the given object.
+
+        If ``at`` is given as a :py:class:`datetime.datetime`, the
+        indexer describes the blob as it was at that point in time, which
+        is mainly useful for permanodes.
+
+        If :py:attr:`describe_cache` is set, a description of the blob
+        that was already retrieved -- either directly or as a related blob
+        in some other response -- is returned without contacting the
+        server, as long as it is no older than ``max_age`` seconds. If
+        ``max_age`` is not given, the cache's own default applies. Pass
+        ``max_age=0`` to force a new request.
         """
         import json
-        req_url = self._make_url("camli/search/describe")
-        resp = self.http_session.get(
-            req_url,
-            params={
-                "blobref": blobref,
-            },
-        )
+        from camlistore.tracing import span
 
-        if resp.status_code != 200:
-            from camlistore.exceptions import ServerError
-            raise ServerError(
-                "Failed to describe %s: server returned %i %s" % (
+        with span(
+            "camlistore.describe_blob",
+            blobref=blobref,
+        ) as current_span:
+            options = _describe_options(at)
+            cache = self.describe_cache
+
+            if cache is not None:
+                cached = cache.get(
                     blobref,
-                    resp.status_code,
-                    resp.reason,
+                    options=options,
+                    max_age=max_age,
                 )
+                current_span.set_attribute(
+                    "camlistore.cache_hit",
+                    cached is not None,
+                )
+                if cached is not None:
+                    self._notify_cache_hit("describe", 1)
+                    return BlobDescription(
+                        self,
+                        cached,
+                        other_raw_dicts={blobref: cached},
+                    )
+
+            params = {
+                "blobref": blobref,
+            }
+            params.update(options)
+
+            req_url = self._make_url("camli/search/describe")
+            resp = self._request(
+                "describe",
+                "get",
+                req_url,
+                blob_count=1,
+                cache_hit=False if cache is not None else None,
+                params=params,
             )
 
-        raw = json.loads(resp.content)
-        my_raw = raw["meta"][blobref]
-        other_raw = raw["meta"]
-        return BlobDescription(
+            if resp.status_code != 200:
+                from camlistore.exceptions import ServerError
+                raise ServerError(
+                    "Failed to describe %s: server returned %i %s" % (
+                        blobref,
+                        resp.status_code,
+                        resp.reason,
+                    )
+                )
+
+            raw = json.loads(resp.content)
+            my_raw = raw["meta"][blobref]
+            other_raw = raw["meta"]
+
+            if cache is not None:
+                cache.add(other_raw, options=options)
+
+            return BlobDescription(
+                self,
+                my_raw,
+                other_raw_dicts=other_raw,
+            )
+
+    def describe_blobs(self, blobrefs, depth=None, max_age=None):
+        """
+        Request descriptions of several blobs at once, returning a
+        :py:class:`dict` mapping each given blobref to a
+        :py:class:`BlobDescription`.
+
+        This is a batch version of :py:meth:`describe_blob`, retrieving all
+        of the descriptions in a single request. Blobs that the indexer
+        was unable to describe are omitted from the result. If ``depth``
+        is given, it is passed to the indexer to control how far it
+        follows relationships when describing related blobs.
+
+        As with :py:meth:`describe_blob`, blobs already present in
+        :py:attr:`describe_cache` are not requested again.
+        """
+        import json
+        from camlistore.tracing import span
+
+        with span(
+            "camlistore.describe_blobs",
+            blob_count=len(blobrefs),
+        ) as current_span:
+            ret = {}
+            cache = self.describe_cache
+            to_request = []
+
+            for blobref in blobrefs:
+                cached = None
+                if cache is not None:
+                    cached = cache.get(blobref, max_age=max_age)
+                if cached is not None:
+                    ret[blobref] = BlobDescription(
+                        self,
+                        cached,
+                        other_raw_dicts={blobref: cached},
+                    )
+                else:
+                    to_request.append(blobref)
+
+            current_span.set_attribute("camlistore.cache_hits", len(ret))
+            if len(ret) > 0:
+                self._notify_cache_hit("describe", len(ret))
+
+            if len(to_request) == 0:
+                return ret
+
+            data = {
+                "blobrefs": to_request,
+            }
+            if depth is not None:
+                data["depth"] = depth
+
+            req_url = self._make_url("camli/search/describe")
+            resp = self._request(
+                "describe",
+                "post",
+                req_url,
+                blob_count=len(to_request),
+                cache_hit=False if cache is not None else None,
+                data=json.dumps(data),
+            )
+
+            if resp.status_code != 200:
+                from camlistore.exceptions import ServerError
+                raise ServerError(
+                    "Failed to describe %i blobs: server returned %i %s" % (
+                        len(to_request),
+                        resp.status_code,
+                        resp.reason,
+                    )
+                )
+
+            raw = json.loads(resp.content)
+            other_raw = raw.get("meta") or {}
+
+            if cache is not None:
+                cache.add(other_raw)
+
+            for blobref in to_request:
+                if blobref in other_raw:
+                    ret[blobref] = BlobDescription(
+                        self,
+                        other_raw[blobref],
+                        other_raw_dicts=other_raw,
+                    )
+
+            return ret
+
+    def walk(self, root_blobref, concurrency=8, batch_size=100):
+        """
+        Walk the filesystem tree rooted at the given directory blobref,
+        in a similar manner to :py:func:`os.walk`.
+
+        This is a convenience wrapper around
+        :py:func:`camlistore.treewalk.walk`; see that function for
+        details.
+        """
+        from camlistore.treewalk import walk
+        return walk(
             self,
-            my_raw,
-            other_raw_dicts=other_raw,
+            root_blobref,
+            concurrency=concurrency,
+            batch_size=batch_size,
         )
 
     def get_claims_for_permanode(self, blobref):
@@ -134,7 +344,9 @@ class SearchClient(object):
         """
         import json
         req_url = self._make_url("camli/search/claims")
-        resp = self.http_session.get(
+        resp = self._request(
+            "claims",
+            "get",
             req_url,
             params={"permanode": blobref},
         )
@@ -155,6 +367,126 @@ class SearchClient(object):
         ]
 
 
+def _describe_options(at):
+    # Returns the describe request parameters, other than the blobref,
+    # as a tuple of pairs so that it can also serve as part of a cache key.
+    if at is None:
+        return ()
+
+    if at.tzinfo is not None:
+        from dateutil.tz import tzutc
+        at = at.astimezone(tzutc()).replace(tzinfo=None)
+
+    return (
+        ("at", at.strftime("%Y-%m-%dT%H:%M:%S.%fZ")),
+    )
+
+
+class DescribeCache(object):
+    """
+    A size-bounded, time-bounded cache of blob descriptions.
+
+    When attached to a :py:class:`SearchClient` via
+    :py:attr:`SearchClient.describe_cache`, every describe response
+    is merged into this cache, including the descriptions of related
+    blobs that the indexer returns alongside the requested one. Later
+    calls to :py:meth:`SearchClient.describe_blob` or
+    :py:meth:`BlobDescription.describe_another` for any blob that has
+    already been seen are then answered locally.
+
+    Entries older than ``max_age`` seconds are considered stale and are
+    not returned. Once more than ``max_entries`` descriptions are
+    retained, the least-recently-used ones are discarded.
+
+    Descriptions are keyed both by blobref and by the options of the
+    request that produced them, so a description of a permanode at some
+    past time will never be returned for a request about its current state.
+
+    It is safe to share a single cache between several threads.
+    """
+
+    def __init__(self, max_age=60, max_entries=10000, clock=None):
+        import threading
+        import time
+        from collections import OrderedDict
+
+        #: The default maximum age of returned entries, in seconds.
+        self.max_age = max_age
+
+        #: The maximum number of descriptions to retain.
+        self.max_entries = max_entries
+
+        self._clock = clock if clock is not None else time.time
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, blobref, options=(), max_age=None):
+        """
+        Return the raw description dictionary for the given blobref, or
+        ``None`` if there is no sufficiently-fresh cached description.
+
+        ``max_age``, if given, overrides :py:attr:`max_age` for this
+        lookup only. A ``max_age`` of zero or less never returns a cached
+        description, even one added at the same instant.
+        """
+        if max_age is None:
+            max_age = self.max_age
+        if max_age <= 0:
+            return None
+
+        key = (blobref, options)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            (stored_at, raw_dict) = entry
+            age = self._clock() - stored_at
+            if age > max_age:
+                if age > self.max_age:
+                    # Too old for default lookups too, so discard it.
+                    del self._entries[key]
+                return None
+
+            # Move to the end so that it's the last to be evicted.
+            del self._entries[key]
+            self._entries[key] = entry
+            return raw_dict
+
+    def add(self, raw_dicts, options=()):
+        """
+        Merge a mapping of blobrefs to raw description dictionaries, as
+        found in the ``meta`` property of a describe response, into the
+        cache.
+        """
+        now = self._clock()
+        with self._lock:
+            entries = self._entries
+            for blobref, raw_dict in raw_dicts.iteritems():
+                key = (blobref, options)
+                entries.pop(key, None)
+                entries[key] = (now, raw_dict)
+
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def invalidate(self, blobref=None):
+        """
+        Discard cached descriptions of the given blobref, or discard
+        all cached descriptions if no blobref is given.
+        """
+        with self._lock:
+            if blobref is None:
+                self._entries.clear()
+                return
+
+            for key in [k for k in self._entries if k[0] == blobref]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
 class SearchResult(object):
     """
     Represents a search result from :py:meth:`SearchClient.query`.
@@ -176,10 +508,22 @@ class BlobDescription(object):
     :py:meth:`SearchClient.describe_blob`.
     """
 
+    __slots__ = (
+        "searcher",
+        "raw_dict",
+        "other_raw_dicts",
+        "_permanode",
+        "_file",
+        "_directory",
+    )
+
     def __init__(self, searcher, raw_dict, other_raw_dicts={}):
         self.searcher = searcher
         self.raw_dict = raw_dict
         self.other_raw_dicts = other_raw_dicts
+        self._permanode = _NOT_PARSED
+        self._file = _NOT_PARSED
+        self._directory = _NOT_PARSED
 
     @property
     def blobref(self):
@@ -205,6 +549,51 @@ class BlobDescription(object):
     # plus some other stuff that varies depending on type
     # https://github.com/bradfitz/camlistore/blob/
     # ca58231336e5711abacb059763beb06e8b2b1788/pkg/search/handler.go#L722
+    # which is exposed via the typed views below.
+
+    @property
+    def permanode(self):
+        """
+        A :py:class:`PermanodeView` of the permanode's attributes, or
+        ``None`` if the blob is not a permanode or the indexer did not
+        describe its attributes.
+
+        The view is built on first access and then retained, as for the
+        other typed views.
+        """
+        if self._permanode is _NOT_PARSED:
+            raw = self.raw_dict.get("permanode")
+            self._permanode = PermanodeView(raw) if raw is not None else None
+        return self._permanode
+
+    @property
+    def file(self):
+        """
+        A :py:class:`FileView` of the file's metadata, or ``None`` if the
+        blob is not a file or the indexer did not describe it.
+        """
+        if self._file is _NOT_PARSED:
+            raw = self.raw_dict.get("file")
+            self._file = FileView(raw) if raw is not None else None
+        return self._file
+
+    @property
+    def directory(self):
+        """
+        A :py:class:`DirectoryView` of the directory's metadata and
+        children, or ``None`` if the blob is not a directory or the
+        indexer did not describe it.
+        """
+        if self._directory is _NOT_PARSED:
+            raw = self.raw_dict.get("dir")
+            if raw is not None:
+                self._directory = DirectoryView(
+                    raw,
+                    self.raw_dict.get("dirChildren"),
+                )
+            else:
+                self._directory = None
+        return self._directory
 
     def describe_another(self, blobref):
         """
@@ -223,14 +612,22 @@ class BlobDescription(object):
         stale data. If the latest data is absolutely required, prefer to
         call directly :py:meth:`SearchClient.describe_blob`.
         """
-        if blobref in self.other_raw_dicts:
-            return BlobDescription(
-                self.searcher,
-                self.other_raw_dicts[blobref],
-                self.other_raw_dicts,
-            )
-        else:
-            return self.searcher.describe_blob(blobref)
+        from camlistore.tracing import span
+
+        with span(
+            "camlistore.describe_another",
+            blobref=blobref,
+        ) as current_span:
+            related = blobref in self.other_raw_dicts
+            current_span.set_attribute("camlistore.related_hit", related)
+            if related:
+                return BlobDescription(
+                    self.searcher,
+                    self.other_raw_dicts[blobref],
+                    self.other_raw_dicts,
+                )
+            else:
+                return self.searcher.describe_blob(blobref)
 
     def __repr__(self):
         return "<camlistore.searchclient.BlobDescription %s %s>" % (
@@ -239,6 +636,107 @@ class BlobDescription(object):
         )
 
 
+class PermanodeView(object):
+    """
+    The attributes of a permanode, from :py:attr:`BlobDescription.permanode`.
+
+    Each attribute may have several values. :py:meth:`get` returns the
+    first value of an attribute, for those that are conventionally
+    single-valued such as ``title``, while :py:meth:`get_all` returns the
+    full list. Attribute names are interned, so the many descriptions of
+    a large result set share a single copy of each name.
+    """
+
+    __slots__ = ("attrs",)
+
+    def __init__(self, raw_dict):
+        #: A :py:class:`dict` mapping each attribute name to its list of
+        #: values.
+        self.attrs = dict(
+            (_intern_name(name), list(values or ()))
+            for (name, values) in (raw_dict.get("attr") or {}).iteritems()
+        )
+
+    def get(self, attr, default=None):
+        """
+        Return the first value of the given attribute, or ``default`` if
+        it has no values.
+        """
+        values = self.attrs.get(attr)
+        return values[0] if values else default
+
+    def get_all(self, attr):
+        """
+        Return the list of values of the given attribute, which is empty
+        if it has none.
+        """
+        return list(self.attrs.get(attr, ()))
+
+    @property
+    def content_blobref(self):
+        """
+        The blobref of the permanode's content, from its ``camliContent``
+        attribute, or ``None`` if it has none.
+        """
+        return self.get("camliContent")
+
+    def __contains__(self, attr):
+        return bool(self.attrs.get(attr))
+
+    def __repr__(self):
+        return "<camlistore.searchclient.PermanodeView %s>" % (
+            ", ".join(sorted(self.attrs)),
+        )
+
+
+class FileView(object):
+    """
+    The metadata of a file, from :py:attr:`BlobDescription.file`.
+    """
+
+    __slots__ = ("file_name", "size", "mime_type", "whole_ref")
+
+    def __init__(self, raw_dict):
+        #: The name of the file, without any directory.
+        self.file_name = raw_dict.get("fileName")
+
+        #: The total size of the file's content, in bytes.
+        self.size = raw_dict.get("size")
+
+        #: The indexer's idea of the file's MIME type, or ``None`` if it
+        #: is not known.
+        self.mime_type = raw_dict.get("mimeType")
+
+        #: The blobref of the file's whole content as a single blob, or
+        #: ``None`` if it is not known.
+        self.whole_ref = raw_dict.get("wholeRef")
+
+    def __repr__(self):
+        return "<camlistore.searchclient.FileView %s>" % self.file_name
+
+
+class DirectoryView(object):
+    """
+    The metadata of a directory, from :py:attr:`BlobDescription.directory`.
+
+    The descriptions of the children can be obtained by passing their
+    blobrefs to :py:meth:`BlobDescription.describe_another`.
+    """
+
+    __slots__ = ("file_name", "children")
+
+    def __init__(self, raw_dict, children=None):
+        #: The name of the directory, without any parent directories.
+        self.file_name = raw_dict.get("fileName")
+
+        #: A list of the blobrefs of the directory's entries, as returned
+        #: by the indexer.
+        self.children = list(children or ())
+
+    def __repr__(self):
+        return "<camlistore.searchclient.DirectoryView %s>" % self.file_name
+
+
 class ClaimMeta(object):
     """
     Description of a claim.
@@ -254,6 +752,7 @@ class ClaimMeta(object):
 
     def __init__(self, raw_dict):
         self.raw_dict = raw_dict
+        self._time = _NOT_PARSED
 
     @property
     def type(self):
@@ -307,14 +806,18 @@ class ClaimMeta(object):
         :py:class:datetime.datetime:. The timestamps of claims are used
         to order them and to allow the indexer to decide the state of
         a permanode on any given date, by filtering later permanodes.
+
+        The timestamp is parsed on first access and then retained, so
+        repeated access (such as when sorting claims) is cheap.
         """
-        from dateutil.parser import parse
+        if self._time is _NOT_PARSED:
+            raw = self.raw_dict.get("date")
+            if raw is not None:
+                self._time = parse_time(raw)
+            else:
+                self._time = None
 
-        raw = self.raw_dict.get("date")
-        if raw is not None:
-            return parse(raw)
-        else:
-            return None
+        return self._time
 
     @property
     def permanode_blobref(self):
@@ -335,3 +838,100 @@ class ClaimMeta(object):
         if target is not None:
             parts.append(target)
         return "<%s>" % " ".join(parts)
+
+
+def parse_claims(raw_claims):
+    """
+    Parse a list of raw claim dictionaries, as found in the ``claims``
+    property of a claims response, into a list of :py:class:`ClaimMeta`
+    sorted by claim time.
+
+    The timestamp of each claim is parsed exactly once, so the resulting
+    objects can be sorted or compared by :py:attr:`ClaimMeta.time` again
+    without further parsing cost. Claims with the same timestamp are
+    ordered by blobref, and claims with no timestamp sort first.
+    """
+    claims = [ClaimMeta(raw_dict) for raw_dict in raw_claims]
+    claims.sort(key=lambda claim: (
+        claim.time is not None,
+        claim.time,
+        claim.blobref,
+    ))
+    return claims
+
+
+def parse_time(raw):
+    """
+    Parse a timestamp string as used in claims and other schema blobs,
+    returning a timezone-aware :py:class:`datetime.datetime`.
+
+    The RFC3339 format produced by Camlistore is parsed directly, which
+    is much faster than the general-purpose :py:mod:`dateutil` parser
+    that is used as a fallback for any other format.
+    """
+    global _RFC3339_RE
+    from datetime import datetime
+
+    if _RFC3339_RE is None:
+        import re
+        _RFC3339_RE = re.compile(_RFC3339_PATTERN)
+
+    match = _RFC3339_RE.match(raw)
+    if match is None:
+        from dateutil.parser import parse
+        return parse(raw)
+
+    (
+        year, month, day, hour, minute, second, fraction, zone,
+    ) = match.groups()
+
+    if fraction is not None:
+        # datetime only has microsecond precision, so truncate any
+        # nanoseconds and pad any shorter fraction out to six digits.
+        microsecond = int(fraction[:6].ljust(6, "0"))
+    else:
+        microsecond = 0
+
+    return datetime(
+        int(year), int(month), int(day),
+        int(hour), int(minute), int(second),
+        microsecond,
+        tzinfo=_get_tz(zone),
+    )
+
+
+def _get_tz(zone):
+    tz = _TZ_CACHE.get(zone)
+    if tz is None:
+        if zone in ("Z", "z"):
+            from dateutil.tz import tzutc
+            tz = tzutc()
+        else:
+            from dateutil.tz import tzoffset
+            sign = -1 if zone[0] == "-" else 1
+            offset = sign * (int(zone[1:3]) * 3600 + int(zone[4:6]) * 60)
+            tz = tzoffset(None, offset)
+        _TZ_CACHE[zone] = tz
+    return tz
+
+
+def _intern_name(name):
+    # Attribute names are usually ASCII, but intern() only accepts byte
+    # strings, so other names are left as they are.
+    try:
+        return intern(str(name))
+    except UnicodeEncodeError:
+        return name
+
+
+_RFC3339_PATTERN = (
+    r"^(\d{4})-(\d{2})-(\d{2})[Tt ](\d{2}):(\d{2}):(\d{2})"
+    r"(?:\.(\d+))?([Zz]|[+-]\d{2}:\d{2})$"
+)
+# Compiled on first use by parse_time.
+_RFC3339_RE = None
+_TZ_CACHE = {}
+
+# Marker for a ClaimMeta time or BlobDescription view that has not yet
+# been parsed, since None is a valid parsed value.
+_NOT_PARSED = object()
@@ -0,0 +1,333 @@
+class HashRing(object):
+    """
+    Assigns keys to nodes by consistent hashing.
+
+    Each node is placed at ``vnodes`` pseudo-random points on a ring of
+    hash values, and a key belongs to the node at the first point at or
+    after the key's own hash. Adding or removing a node therefore only
+    moves the keys between that node's points and their predecessors --
+    about ``1 / len(nodes)`` of all keys -- while every other key stays
+    where it was.
+
+    ``nodes`` is an iterable of distinct node names, which must be strings.
+    """
+
+    def __init__(self, nodes=(), vnodes=128):
+        self.vnodes = vnodes
+        self._points = []
+        self._owners = []
+        self.nodes = []
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node):
+        """
+        Add a node to the ring.
+        """
+        from bisect import bisect_left
+
+        if node in self.nodes:
+            raise ValueError("Node %r is already in the ring" % node)
+        self.nodes.append(node)
+        for i in xrange(self.vnodes):
+            point = _ring_hash("%s#%i" % (node, i))
+            index = bisect_left(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove_node(self, node):
+        """
+        Remove a node from the ring, so that its keys are reassigned to
+        the remaining nodes.
+        """
+        self.nodes.remove(node)
+        kept = [
+            (point, owner)
+            for (point, owner) in zip(self._points, self._owners)
+            if owner != node
+        ]
+        self._points = [point for (point, owner) in kept]
+        self._owners = [owner for (point, owner) in kept]
+
+    def node_for(self, key):
+        """
+        Return the node that the given key belongs to.
+        """
+        from bisect import bisect_left
+
+        if not self._points:
+            raise ValueError("Hash ring has no nodes")
+        index = bisect_left(self._points, _ring_hash(key))
+        if index == len(self._points):
+            index = 0
+        return self._owners[index]
+
+
+class ShardedBlobClient(object):
+    """
+    A blob client that spreads blobs across several independent blob
+    stores, offering the same methods as
+    :py:class:`camlistore.blobclient.BlobClient`.
+
+    ``shards`` is a :py:class:`dict` mapping a name for each shard to the
+    :py:class:`camlistore.blobclient.BlobClient` for that shard. The names
+    determine where blobs are placed, as described for
+    :py:class:`HashRing`, so they must stay the same for as long as the
+    blobs are stored; a server's base URL is usually a good choice.
+
+    Operations on several blobs are split into one batch per shard, and
+    up to ``concurrency`` batches are run at once, by worker threads that
+    are started when first needed. Call :py:meth:`close` to stop them once
+    the client is no longer needed.
+    """
+
+    def __init__(self, shards, vnodes=128, concurrency=8):
+        import threading
+
+        self.shards = dict(shards)
+        self.concurrency = concurrency
+        self.ring = HashRing(sorted(self.shards), vnodes=vnodes)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def shard_for(self, blobref):
+        """
+        Return the name of the shard that the given blob belongs to.
+        """
+        return self.ring.node_for(blobref)
+
+    def client_for(self, blobref):
+        """
+        Return the :py:class:`camlistore.blobclient.BlobClient` for the
+        shard that the given blob belongs to.
+        """
+        return self.shards[self.ring.node_for(blobref)]
+
+    def add_shard(self, name, blob_client):
+        """
+        Add a new shard.
+
+        Blobs placed from now on will be spread across the new set of
+        shards, but blobs already stored are not moved, and a small
+        fraction of them will no longer be found by this client until
+        :py:meth:`rebalance` has been run.
+        """
+        self.ring.add_node(name)
+        self.shards[name] = blob_client
+
+    def get(self, blobref):
+        """
+        Get the data for a blob, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.get`.
+        """
+        return self.client_for(blobref).get(blobref)
+
+    def get_size(self, blobref):
+        """
+        Get the size of a blob, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.get_size`.
+        """
+        return self.client_for(blobref).get_size(blobref)
+
+    def get_range(self, blobref, offset, length=None):
+        """
+        Get part of the data for a blob, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.get_range`.
+        """
+        return self.client_for(blobref).get_range(blobref, offset, length)
+
+    def download(self, blobref, f, **kwargs):
+        """
+        Write the data for a blob to a file, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.download`.
+        """
+        return self.client_for(blobref).download(blobref, f, **kwargs)
+
+    def blob_exists(self, blobref):
+        """
+        Determine if a blob exists, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.blob_exists`.
+        """
+        return self.client_for(blobref).blob_exists(blobref)
+
+    def get_size_multi(self, *blobrefs):
+        """
+        Get the sizes of several blobs, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.get_size_multi`.
+        """
+        ret = {}
+        for sizes in self._map_shards(
+            blobrefs,
+            lambda blobref: blobref,
+            lambda blob_client, batch: blob_client.get_size_multi(*batch),
+        ):
+            ret.update(sizes)
+        return ret
+
+    def put(self, blob):
+        """
+        Write a single blob, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.put`.
+        """
+        return self.client_for(blob.blobref).put(blob)
+
+    def put_multi(self, *blobs):
+        """
+        Upload several blobs, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.put_multi`.
+        """
+        self._map_shards(
+            blobs,
+            lambda blob: blob.blobref,
+            lambda blob_client, batch: blob_client.put_multi(*batch),
+        )
+        return [blob.blobref for blob in blobs]
+
+    def uploader(self, **kwargs):
+        """
+        Create a :py:class:`camlistore.uploader.Uploader` that uploads
+        via :py:meth:`put_multi`.
+        """
+        from camlistore.uploader import Uploader
+        return Uploader(self, **kwargs)
+
+    def enumerate(self, after=None):
+        """
+        Enumerate the blobs on all of the shards, as described for
+        :py:meth:`camlistore.blobclient.BlobClient.enumerate`.
+
+        The enumerations of the individual shards are merged, so blobs
+        are still produced in blobref order. A blob stored on more than
+        one shard, as happens after :py:meth:`rebalance`, is produced only
+        once.
+        """
+        import heapq
+
+        streams = [
+            _keyed_metas(self.shards[name].enumerate(after=after), i)
+            for (i, name) in enumerate(sorted(self.shards))
+        ]
+        last_blobref = None
+        for (blobref, i, meta) in heapq.merge(*streams):
+            if blobref != last_blobref:
+                yield meta
+                last_blobref = blobref
+
+    def misplaced(self, name):
+        """
+        Enumerate the blobs on the named shard that belong on some other
+        shard, yielding a tuple ``(meta, target_name)`` for each.
+        """
+        for meta in self.shards[name].enumerate():
+            target = self.ring.node_for(meta.blobref)
+            if target != name:
+                yield (meta, target)
+
+    def rebalance(self, batch_size=100):
+        """
+        Copy each blob that is stored on the wrong shard, such as after a
+        call to :py:meth:`add_shard`, to the shard it belongs on.
+
+        The Camlistore blob protocol provides no way to delete blobs, so
+        the original copies are left in place, to be removed by some other
+        means if desired. Blobs already present on the shard they belong
+        on are not fetched again, so calling this repeatedly only copies
+        the blobs still missing. Returns the number of blobs copied.
+        """
+        from multiprocessing.pool import ThreadPool
+
+        def copy_batch(metas):
+            sizes = self.get_size_multi(*[meta.blobref for meta in metas])
+            blobs = [
+                meta.get_data() for meta in metas
+                if sizes.get(meta.blobref) is None
+            ]
+            if blobs:
+                self.put_multi(*blobs)
+            return len(blobs)
+
+        pool = ThreadPool(self.concurrency)
+        try:
+            pending = []
+            for name in sorted(self.shards):
+                batch = []
+                for (meta, target) in self.misplaced(name):
+                    batch.append(meta)
+                    if len(batch) >= batch_size:
+                        pending.append(pool.apply_async(copy_batch, (batch,)))
+                        batch = []
+                if batch:
+                    pending.append(pool.apply_async(copy_batch, (batch,)))
+            return sum(result.get() for result in pending)
+        finally:
+            pool.terminate()
+
+    def _map_shards(self, items, key_func, batch_func):
+        # Groups the items by shard and calls batch_func with each shard's
+        # client and items, in parallel, returning the list of results.
+        batches = {}
+        for item in items:
+            name = self.ring.node_for(key_func(item))
+            batches.setdefault(name, []).append(item)
+
+        if len(batches) <= 1:
+            return [
+                batch_func(self.shards[name], batch)
+                for (name, batch) in batches.iteritems()
+            ]
+
+        pool = self._get_pool()
+        pending = [
+            pool.apply_async(batch_func, (self.shards[name], batch))
+            for (name, batch) in batches.iteritems()
+        ]
+        # get() re-raises any exception from the batch.
+        return [result.get() for result in pending]
+
+    def close(self):
+        """
+        Release the worker threads used for operations on several shards.
+        """
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                from multiprocessing.pool import ThreadPool
+                self._pool = ThreadPool(self.concurrency)
+            return self._pool
+
+
+def connect_shards(base_urls, **kwargs):
+    """
+    Create a :py:class:`ShardedBlobClient` spreading blobs across the blob
+    stores of the Camlistore servers at the given base URLs.
+
+    Each server is discovered as for :py:func:`camlistore.connect`, and
+    its base URL is used as the name of its shard. Keyword arguments are
+    passed on to the :py:class:`ShardedBlobClient` initializer.
+    """
+    from camlistore.connection import connect
+
+    return ShardedBlobClient(
+        {base_url: connect(base_url).blobs for base_url in base_urls},
+        **kwargs
+    )
+
+
+def _keyed_metas(metas, stream_index):
+    # heapq.merge compares whole items, so key each meta by its blobref
+    # and then its stream, so that the metas themselves aren't compared.
+    for meta in metas:
+        yield (meta.blobref, stream_index, meta)
+
+
+def _ring_hash(key):
+    import hashlib
+    import struct
+    return struct.unpack(">Q", hashlib.md5(key).digest()[:8])[0]
@@ -0,0 +1,302 @@
+class QuerySubscription(object):
+    """
+    A live view of the results of a search query, which reports each
+    change in the results as it happens.
+
+    Callers should not instantiate this class directly. Instead, call
+    :py:meth:`camlistore.searchclient.SearchClient.subscribe`.
+
+    Iterating over a subscription blocks, producing a
+    :py:class:`ResultChange` each time blobs are added to or removed from
+    the results, until :py:meth:`close` is called. The first change
+    reports all of the current results as added, unless ``known`` is
+    given as a list of the results already known to the caller -- such as
+    :py:attr:`results` saved from an earlier subscription -- in which case
+    only the differences are reported.
+
+    When the optional ``websocket-client`` package is installed, the
+    subscription is made over the server's websocket interface, so that
+    the server pushes new results as soon as its index changes. Otherwise,
+    or if the server does not support websockets, the query is instead
+    re-run every ``poll_interval`` seconds. Either way, only the changes
+    are reported.
+
+    If the connection to the server is lost, or the server reports an
+    internal error, the subscription reconnects, waiting up to
+    ``max_reconnect_delay`` seconds between attempts, and then reports any
+    changes that happened while it was disconnected. Other errors, such
+    as the server rejecting the query or the client's credentials, end the
+    iteration with :py:class:`camlistore.exceptions.ServerError`.
+
+    If ``describe`` is set, the server is asked to describe the results,
+    and each change includes descriptions of the added blobs.
+    """
+
+    def __init__(
+        self,
+        searcher,
+        expression,
+        describe=False,
+        known=None,
+        poll_interval=5,
+        max_reconnect_delay=60,
+        use_websocket=True,
+    ):
+        import threading
+
+        self.searcher = searcher
+        self.expression = expression
+        self.describe = describe
+        self.poll_interval = poll_interval
+        self.max_reconnect_delay = max_reconnect_delay
+        self.use_websocket = use_websocket
+
+        #: The list of blobrefs matching the query, as of the most recent
+        #: change produced.
+        self.results = list(known or ())
+
+        #: How the subscription is receiving results: ``"websocket"``,
+        #: ``"poll"``, or ``None`` if it has not yet connected.
+        self.mode = None
+
+        self._closed = threading.Event()
+        self._thread = None
+
+    def __iter__(self):
+        from camlistore.exceptions import ServerError
+
+        retry_errors = (IOError,) + _websocket_errors()
+        initial_delay = min(1, self.max_reconnect_delay)
+        delay = initial_delay
+        while not self._closed.is_set():
+            try:
+                for raw_result in self._raw_results():
+                    delay = initial_delay
+                    change = self._apply(raw_result)
+                    if change is not None:
+                        yield change
+            except retry_errors:
+                pass
+            except ServerError as error:
+                # Only the server's own failures are worth retrying.
+                if error.status_code is None or error.status_code < 500:
+                    raise
+
+            self._closed.wait(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def start(self, callback):
+        """
+        Call ``callback`` with each :py:class:`ResultChange` from a
+        background thread, until :py:meth:`close` is called.
+        """
+        import threading
+
+        def run():
+            for change in self:
+                callback(change)
+
+        self._thread = threading.Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """
+        End the subscription.
+
+        Any iteration in progress ends once it next checks for new
+        results, which happens at least once a second.
+        """
+        import threading
+
+        self._closed.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _search_query(self):
+        search_query = {"expression": self.expression}
+        if self.describe:
+            search_query["describe"] = {"depth": 1}
+        return search_query
+
+    def _raw_results(self):
+        # Returns an iterable of raw search results, each of which is the
+        # complete result set at some point in time.
+        if self.mode != "poll" and self.use_websocket:
+            connection = self._connect_websocket()
+            if connection is not None:
+                self.mode = "websocket"
+                return self._websocket_results(connection)
+        self.mode = "poll"
+        return self._polled_results()
+
+    def _polled_results(self):
+        while not self._closed.is_set():
+            yield self.searcher._query_raw(self._search_query())
+            self._closed.wait(self.poll_interval)
+
+    def _websocket_results(self, connection):
+        import json
+
+        try:
+            while not self._closed.is_set():
+                message = connection.recv()
+                if message is None:
+                    # Timed out, so check whether we've been closed.
+                    continue
+                data = json.loads(message)
+                if data.get("tag") == _TAG and "result" in data:
+                    yield data["result"]
+        finally:
+            connection.close()
+
+    def _connect_websocket(self):
+        # Returns a _WebsocketConnection subscribed to the query, or None
+        # if websockets can't be used, so that the query must be polled.
+        import json
+
+        websocket = _websocket_module()
+        if websocket is None:
+            return None
+
+        url = self.searcher._make_url("camli/search/ws")
+        if url.startswith("http"):
+            url = "ws" + url[4:]
+
+        try:
+            connection = websocket.create_connection(
+                url,
+                header=self._websocket_headers(),
+                timeout=_RECV_TIMEOUT,
+            )
+        except websocket.WebSocketBadStatusException:
+            return None
+
+        connection.send(json.dumps({
+            "tag": _TAG,
+            "query": self._search_query(),
+        }))
+        return _WebsocketConnection(connection, websocket)
+
+    def _websocket_headers(self):
+        # The websocket handshake needs the same credentials as the
+        # session's other requests.
+        import base64
+
+        auth = getattr(self.searcher.http_session, "auth", None)
+        if isinstance(auth, tuple):
+            return [
+                "Authorization: Basic %s" % base64.b64encode("%s:%s" % auth),
+            ]
+        return []
+
+    def _apply(self, raw_result):
+        # Updates the results from a raw result set, returning a
+        # ResultChange or None if nothing changed.
+        from camlistore.searchclient import BlobDescription
+
+        blobrefs = [raw["blob"] for raw in raw_result.get("blobs") or ()]
+        previous = set(self.results)
+        current = set(blobrefs)
+        added = [blobref for blobref in blobrefs if blobref not in previous]
+        removed = [
+            blobref for blobref in self.results if blobref not in current
+        ]
+        self.results = blobrefs
+        if not added and not removed:
+            return None
+
+        meta = (raw_result.get("description") or {}).get("meta") or {}
+        descriptions = {
+            blobref: BlobDescription(self.searcher, meta[blobref], meta)
+            for blobref in added
+            if blobref in meta
+        }
+        return ResultChange(added, removed, list(blobrefs), descriptions)
+
+
+class ResultChange(object):
+    """
+    Describes a change in the results of a :py:class:`QuerySubscription`.
+
+    Callers should not instantiate this class directly.
+    """
+
+    def __init__(self, added, removed, results, descriptions):
+        #: A list of the blobrefs that were added to the results.
+        self.added = added
+
+        #: A list of the blobrefs that were removed from the results.
+        self.removed = removed
+
+        #: A list of all of the blobrefs in the results after the change.
+        self.results = results
+
+        #: A :py:class:`dict` mapping the blobrefs of added blobs to their
+        #: :py:class:`camlistore.searchclient.BlobDescription`, if
+        #: descriptions were requested and provided by the server.
+        self.descriptions = descriptions
+
+    def __repr__(self):
+        return "<camlistore.subscription.ResultChange +%i -%i>" % (
+            len(self.added),
+            len(self.removed),
+        )
+
+
+class _WebsocketConnection(object):
+    # Adapts a websocket-client connection so that recv() returns None on
+    # timeout and raises IOError once the server has closed it.
+
+    def __init__(self, connection, websocket):
+        self._connection = connection
+        self._websocket = websocket
+
+    def recv(self):
+        try:
+            message = self._connection.recv()
+        except self._websocket.WebSocketTimeoutException:
+            return None
+        if not message:
+            raise IOError("Websocket closed by server")
+        return message
+
+    def close(self):
+        self._connection.close()
+
+
+def _websocket_module():
+    global _websocket
+    if _websocket is _NOT_LOADED:
+        try:
+            import websocket
+        except ImportError:
+            websocket = None
+        _websocket = websocket
+    return _websocket
+
+
+def _websocket_errors():
+    websocket = _websocket_module()
+    if websocket is None:
+        return ()
+    return (websocket.WebSocketException,)
+
+
+# Each subscription uses its own websocket, so a fixed tag is enough to
+# recognize the results of our query.
+_TAG = "q"
+
+# Seconds to wait for a websocket message before checking whether the
+# subscription has been closed.
+_RECV_TIMEOUT = 1
+
+_NOT_LOADED = object()
+_websocket = _NOT_LOADED
@@ -0,0 +1,289 @@
+class BlobTail(object):
+    """
+    Follows a blob store, producing each blob as it is added.
+
+    Callers should not instantiate this class directly. Instead, call
+    :py:meth:`camlistore.blobclient.BlobClient.tail`.
+
+    Iterating over a tail blocks, yielding a
+    :py:class:`camlistore.blobclient.BlobMeta` for every blob already in
+    the store and then for each new blob as it arrives, until
+    :py:meth:`close` is called. This makes it a suitable source for
+    replicators and indexers that must keep up with a store.
+
+    After the first enumeration of the store, the tail waits for new blobs
+    with a long-polling enumeration request for the blobs after the
+    greatest blobref seen, which the server answers as soon as such a blob
+    is uploaded or after ``max_wait`` seconds, so these blobs are produced
+    straight away. Since enumeration is in blobref order rather than
+    upload order, though, most new blobs sort before the greatest, and
+    can only be found by enumerating the whole store again. The tail does
+    so ``rescan_interval`` seconds after the last enumeration finished,
+    or after as long as the last enumeration took if that is longer, so
+    that a large store is never enumerated continuously. Such blobs are
+    therefore produced up to that long after they are uploaded. Pass
+    ``None`` as ``rescan_interval`` to enumerate the whole store only
+    once, and produce only the new blobs sorting after the greatest.
+    Each round of waiting starts at least ``min_interval`` seconds after
+    the last, which limits the load on a server that does not support
+    long polling.
+
+    Errors from the server end the iteration. To resume, pass the
+    :py:attr:`checkpoint` to a new tail, or create a new tail with a
+    :py:class:`TailCheckpoint` kept on disk to resume after a restart.
+    """
+
+    def __init__(
+        self,
+        blob_client,
+        checkpoint=None,
+        max_wait=30,
+        min_interval=1,
+        rescan_interval=60,
+    ):
+        import threading
+
+        self.blob_client = blob_client
+        self.max_wait = max_wait
+        self.min_interval = min_interval
+        self.rescan_interval = rescan_interval
+
+        #: The :py:class:`TailCheckpoint` recording the blobs produced so
+        #: far. Each blob is recorded once the caller asks for the next,
+        #: so after an interruption the last blob produced is produced
+        #: again.
+        self.checkpoint = checkpoint if checkpoint is not None else (
+            TailCheckpoint(":memory:", check_same_thread=False)
+        )
+
+        self._closed = threading.Event()
+
+    def __iter__(self):
+        import time
+
+        checkpoint = self.checkpoint
+        # Enumerate the whole store first, or finish enumerating it if an
+        # earlier tail was interrupted.
+        rescan_due = 0
+        try:
+            while not self._closed.is_set():
+                started = time.time()
+                if started >= rescan_due:
+                    for meta in self._produce(checkpoint.after, True):
+                        yield meta
+                    if self._closed.is_set():
+                        return
+                    checkpoint.after = None
+                    checkpoint.scans += 1
+                    finished = time.time()
+                    if self.rescan_interval is None:
+                        rescan_due = float("inf")
+                    else:
+                        rescan_due = finished + max(
+                            self.rescan_interval,
+                            finished - started,
+                        )
+                else:
+                    for meta in self._produce(checkpoint.last_blobref):
+                        yield meta
+                checkpoint.commit()
+
+                if self._closed.is_set():
+                    return
+                # Don't wait past when the next rescan is due.
+                self._wait_for_change(
+                    checkpoint.last_blobref,
+                    min(self.max_wait, rescan_due - time.time()),
+                )
+                self._closed.wait(
+                    max(0, started + self.min_interval - time.time()),
+                )
+        finally:
+            checkpoint.commit()
+
+    def close(self):
+        """
+        Stop tailing the store.
+
+        Any iteration in progress ends once its current request completes,
+        which may take up to ``max_wait`` seconds.
+        """
+        self._closed.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _produce(self, after, rescanning=False):
+        # Yields the blobs after the given blobref that haven't yet been
+        # produced, recording each once the caller asks for the next. The
+        # checkpoint is consulted for a batch of blobs at a time.
+        from itertools import islice
+
+        checkpoint = self.checkpoint
+        metas = iter(self.blob_client.enumerate(after=after))
+        while True:
+            batch = list(islice(metas, _BATCH_SIZE))
+            if not batch:
+                return
+            seen = checkpoint.seen(meta.blobref for meta in batch)
+            for meta in batch:
+                if self._closed.is_set():
+                    return
+                if meta.blobref not in seen:
+                    yield meta
+                    checkpoint.add(meta.blobref)
+                if rescanning:
+                    checkpoint.after = meta.blobref
+
+    def _wait_for_change(self, last_blobref, max_wait):
+        # Blocks until a blob sorting after the last one enumerated may
+        # have arrived, or max_wait seconds have passed, by letting the
+        # server wait for one to arrive.
+        import math
+        from urllib import urlencode
+        from camlistore.exceptions import ServerError
+
+        if max_wait <= 0:
+            return
+        max_wait = int(math.ceil(max_wait))
+        params = [("limit", 1), ("maxwaitsec", max_wait)]
+        if last_blobref is not None:
+            params.insert(0, ("after", last_blobref))
+        enum_url = "%s?%s" % (
+            self.blob_client._make_url("camli/enumerate-blobs"),
+            urlencode(params),
+        )
+
+        resp = self.blob_client._request("enumerate", "get", enum_url)
+        if resp.status_code != 200:
+            raise ServerError(
+                "Failed to wait for blobs from %s: got %i %s" % (
+                    enum_url,
+                    resp.status_code,
+                    resp.reason,
+                )
+            )
+
+
+class TailCheckpoint(object):
+    """
+    The progress of a :py:class:`BlobTail`, from which a new tail can
+    resume without producing the same blobs again, kept in a SQLite
+    database at ``path``.
+
+    The checkpoint records every blob produced, so that blobs found by
+    enumerating the store again can be recognized. These records are
+    kept on disk rather than in memory, so a tail of even a very large
+    store uses little memory. Pass ``":memory:"`` as the path for a
+    temporary in-memory checkpoint.
+
+    By default the checkpoint may only be used from the thread that
+    created it. Pass ``check_same_thread=False`` to allow it to be used
+    from other threads, such as by a tail iterated in a background thread.
+    """
+
+    def __init__(self, path, check_same_thread=True):
+        import sqlite3
+
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=check_same_thread)
+        self.db.text_factory = str
+        self.db.executescript(_SCHEMA_SQL)
+        self.db.commit()
+
+        #: The last blobref reached by the enumeration in progress, or
+        #: ``None`` between enumerations.
+        self.after = self._get_meta("after")
+
+        #: The number of complete enumerations of the store.
+        self.scans = int(self._get_meta("scans") or 0)
+
+    @property
+    def last_blobref(self):
+        """
+        The greatest blobref produced, or ``None`` if none have been.
+        """
+        return self.db.execute("SELECT MAX(blobref) FROM seen").fetchone()[0]
+
+    def add(self, blobref):
+        """
+        Record that the given blob has been produced.
+        """
+        self.db.execute(
+            "INSERT OR IGNORE INTO seen (blobref) VALUES (?)", (blobref,),
+        )
+
+    def seen(self, blobrefs):
+        """
+        Return the set of the given blobrefs that have been produced.
+        """
+        blobrefs = list(blobrefs)
+        seen = set()
+        for i in xrange(0, len(blobrefs), _BATCH_SIZE):
+            chunk = blobrefs[i:i + _BATCH_SIZE]
+            seen.update(row[0] for row in self.db.execute(
+                "SELECT blobref FROM seen WHERE blobref IN (%s)" % (
+                    ", ".join("?" * len(chunk))
+                ),
+                chunk,
+            ))
+        return seen
+
+    def commit(self):
+        """
+        Write the progress so far to disk.
+        """
+        self._set_meta("after", self.after)
+        self._set_meta("scans", self.scans)
+        self.db.commit()
+
+    def close(self):
+        """
+        Commit and close the underlying database.
+        """
+        self.commit()
+        self.db.close()
+
+    def __contains__(self, blobref):
+        return self.db.execute(
+            "SELECT 1 FROM seen WHERE blobref = ?", (blobref,),
+        ).fetchone() is not None
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+    def __repr__(self):
+        return "<camlistore.tail.TailCheckpoint %i blobs, %i scans>" % (
+            len(self),
+            self.scans,
+        )
+
+    def _get_meta(self, key):
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def _set_meta(self, key, value):
+        self.db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, value),
+        )
+
+
+# The number of blobs checked against the checkpoint at once, which is
+# kept below SQLite's limit on the number of query parameters.
+_BATCH_SIZE = 500
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS seen (
+    blobref TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
@@ -0,0 +1,78 @@
+def span(name, **attributes):
+    """
+    Return a context manager that records a tracing span with the given
+    name and attributes around the code it wraps.
+
+    Spans are created via an OpenTelemetry-compatible tracer: by default
+    the ``opentelemetry`` package's global tracer provider is used if that
+    package is installed, and otherwise spans are not recorded at all and
+    this function returns a shared no-op context manager. Another tracer
+    can be selected with :py:func:`set_tracer`.
+
+    The names of the given attributes are prefixed with ``camlistore.``.
+    The object returned when entering the context manager has a
+    ``set_attribute(key, value)`` method, for attaching attributes that
+    are only known once the operation is underway; its keys are used
+    verbatim.
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.start_as_current_span(
+        name,
+        attributes=_clean_attributes(attributes),
+    )
+
+
+def get_tracer():
+    """
+    Return the tracer used by :py:func:`span`, or ``None`` if tracing is
+    disabled.
+    """
+    global _tracer
+    if _tracer is _NOT_LOADED:
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            _tracer = None
+        else:
+            _tracer = trace.get_tracer("camlistore")
+    return _tracer
+
+
+def set_tracer(tracer):
+    """
+    Select the tracer to use for all future spans.
+
+    ``tracer`` must have a ``start_as_current_span(name, attributes=...)``
+    method, as OpenTelemetry tracers do. Pass ``None`` to disable tracing
+    even if ``opentelemetry`` is installed.
+    """
+    global _tracer
+    _tracer = tracer
+
+
+def _clean_attributes(attributes):
+    # OpenTelemetry rejects None attribute values, so drop them.
+    return {
+        "camlistore." + key: value
+        for key, value in attributes.iteritems()
+        if value is not None
+    }
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+_NOT_LOADED = object()
+_tracer = _NOT_LOADED
@@ -0,0 +1,159 @@
+def walk(searcher, root_blobref, concurrency=8, batch_size=100):
+    """
+    Walk the filesystem tree rooted at the given directory blobref using
+    the search interface, in a similar manner to :py:func:`os.walk`.
+
+    ``searcher`` is a :py:class:`camlistore.searchclient.SearchClient`.
+    For each directory in the tree this generator yields a tuple
+    ``(path, dirs, files)``, where ``path`` is the directory's path
+    relative to the root (the root itself being ``""``), and ``dirs``
+    and ``files`` are lists of
+    :py:class:`camlistore.searchclient.BlobDescription` objects for the
+    subdirectories and other entries of that directory, ordered by name.
+
+    Up to ``concurrency`` directories are expanded at once, and the
+    descriptions of any entries not already returned alongside their
+    parent directory are requested in batches of up to ``batch_size``.
+    Each directory is yielded as soon as all of its entries have been
+    described, so directories are *not* yielded in any particular order,
+    except that a directory is always yielded before its subdirectories.
+
+    As with :py:func:`os.walk` in top-down mode, the caller may remove
+    items from ``dirs`` before continuing iteration to prevent the walk
+    from descending into those subdirectories.
+
+    A subdirectory whose description does not include its name, as
+    returned by :py:func:`entry_name`, appears in paths under its blobref
+    instead.
+    """
+    import posixpath
+    from collections import deque
+    from multiprocessing.pool import ThreadPool
+    from Queue import Queue
+
+    expander = _DirectoryExpander(searcher, batch_size)
+    results = Queue()
+    pending = deque([("", root_blobref, None)])
+    in_flight = 0
+
+    pool = ThreadPool(concurrency)
+    try:
+        while pending or in_flight:
+            while pending and in_flight < concurrency:
+                (path, blobref, desc) = pending.popleft()
+                pool.apply_async(
+                    expander.expand_into,
+                    (path, blobref, desc, results),
+                )
+                in_flight += 1
+
+            (exc_info, result) = results.get()
+            in_flight -= 1
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+            (path, dirs, files) = result
+            yield result
+
+            for desc in dirs:
+                name = entry_name(desc)
+                if name is None:
+                    name = desc.blobref
+                pending.append((
+                    posixpath.join(path, name),
+                    desc.blobref,
+                    desc,
+                ))
+    finally:
+        pool.terminate()
+
+
+def entry_name(desc):
+    """
+    Return the filename of a file or directory described by a
+    :py:class:`camlistore.searchclient.BlobDescription`, or ``None``
+    if the description does not include a filename.
+    """
+    raw = desc.raw_dict
+    for key in ("dir", "file"):
+        info = raw.get(key)
+        if info is not None and "fileName" in info:
+            return info["fileName"]
+    return None
+
+
+def _entry_sort_key(desc):
+    return (entry_name(desc), desc.blobref)
+
+
+class _DirectoryExpander(object):
+    # Does the work of describing a single directory and its entries
+    # for walk(), in a worker thread. If the directory was already
+    # described along with its parent then that description is passed in
+    # so that it need not be requested again.
+
+    def __init__(self, searcher, batch_size):
+        self.searcher = searcher
+        self.batch_size = batch_size
+
+    def expand_into(self, path, blobref, desc, results):
+        import sys
+        try:
+            result = self.expand(path, blobref, desc)
+        except Exception:
+            results.put((sys.exc_info(), None))
+        else:
+            results.put((None, result))
+
+    def expand(self, path, blobref, desc=None):
+        from camlistore.searchclient import BlobDescription
+
+        searcher = self.searcher
+
+        if desc is None or "dirChildren" not in desc.raw_dict:
+            desc = searcher.describe_blobs([blobref]).get(blobref)
+            if desc is None:
+                from camlistore.exceptions import NotFoundError
+                raise NotFoundError(
+                    "Directory not found: %s" % blobref,
+                )
+
+        child_blobrefs = desc.raw_dict.get("dirChildren") or []
+        related = desc.other_raw_dicts
+        children = {}
+        missing = []
+        for child_blobref in child_blobrefs:
+            if child_blobref in related:
+                children[child_blobref] = BlobDescription(
+                    searcher,
+                    related[child_blobref],
+                    other_raw_dicts=related,
+                )
+            else:
+                missing.append(child_blobref)
+
+        batch_size = self.batch_size
+        for start in xrange(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            children.update(searcher.describe_blobs(batch))
+
+        dirs = []
+        files = []
+        for child_blobref in child_blobrefs:
+            child = children.get(child_blobref)
+            if child is None:
+                # The indexer doesn't know about this entry, so all we
+                # can report is its blobref.
+                child = BlobDescription(
+                    searcher,
+                    {"blobRef": child_blobref},
+                )
+            if child.type == "directory":
+                dirs.append(child)
+            else:
+                files.append(child)
+
+        dirs.sort(key=_entry_sort_key)
+        files.sort(key=_entry_sort_key)
+
+        return (path, dirs, files)
@@ -0,0 +1,204 @@
+class Uploader(object):
+    """
+    Streaming uploader that accepts blobs one at a time and uploads them
+    in batches in the background.
+
+    Callers should not instantiate this class directly, but should instead
+    call :py:meth:`camlistore.blobclient.BlobClient.uploader`.
+
+    Blobs passed to :py:meth:`add` are collected into batches of up to
+    ``max_batch_count`` blobs or ``max_batch_bytes`` bytes, and each batch
+    is uploaded via :py:meth:`camlistore.blobclient.BlobClient.put_multi`
+    -- which first asks the server which blobs it already has, so only
+    new blobs are sent -- with up to ``concurrency`` batches being uploaded
+    at once.
+
+    To keep memory usage bounded, no more than ``max_inflight_bytes``
+    bytes of blob data are held by the uploader at once. Once this budget
+    is exhausted, :py:meth:`add` blocks until some of the in-flight
+    batches have completed. A single blob larger than the budget is still
+    accepted, once all earlier blobs have been uploaded.
+
+    If an upload fails, the exception is raised by the next call to
+    :py:meth:`add`, :py:meth:`flush` or :py:meth:`close`, and no further
+    batches are started.
+
+    :py:meth:`add` may be called from several threads at once.
+
+    An uploader can be used as a context manager, which calls
+    :py:meth:`close` on successful exit:
+
+    .. code-block:: python
+
+        with conn.blobs.uploader() as uploader:
+            for blob in generate_blobs():
+                uploader.add(blob)
+    """
+
+    def __init__(
+        self,
+        blob_client,
+        max_batch_bytes=16 * 1024 * 1024,
+        max_batch_count=1000,
+        concurrency=4,
+        max_inflight_bytes=64 * 1024 * 1024,
+    ):
+        import threading
+        from multiprocessing.pool import ThreadPool
+
+        self.blob_client = blob_client
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_count = max_batch_count
+        self.concurrency = concurrency
+        self.max_inflight_bytes = max_inflight_bytes
+
+        self._pool = ThreadPool(concurrency)
+        self._cond = threading.Condition()
+        # Guards the batch being built, separately from _cond so that
+        # upload threads never wait on adders.
+        self._batch_lock = threading.Lock()
+        self._inflight_bytes = 0
+        self._inflight_batches = 0
+        self._error = None
+        self._closed = False
+
+        self._batch = []
+        self._batch_bytes = 0
+        self._blobrefs = []
+
+    def add(self, blob):
+        """
+        Add a :py:class:`camlistore.Blob` to be uploaded, returning its
+        blobref.
+
+        This may block if the in-flight byte budget is exhausted, and
+        may raise an exception from a previously-failed upload.
+        """
+        if self._closed:
+            raise ValueError("Cannot add blobs to a closed uploader")
+
+        size = blob.size
+        blobref = blob.blobref
+
+        with self._batch_lock:
+            self._reserve(size)
+
+            self._batch.append(blob)
+            self._batch_bytes += size
+            self._blobrefs.append(blobref)
+
+            if (
+                len(self._batch) >= self.max_batch_count or
+                self._batch_bytes >= self.max_batch_bytes
+            ):
+                self._submit_batch()
+
+        return blobref
+
+    def flush(self):
+        """
+        Upload any blobs that have not yet been uploaded and wait for all
+        in-flight uploads to complete.
+
+        Returns a list of the blobrefs of the blobs added since the
+        previous flush, in the order they were added.
+        """
+        with self._batch_lock:
+            self._submit_batch()
+            blobrefs = self._blobrefs
+            self._blobrefs = []
+
+        with self._cond:
+            while self._inflight_batches > 0:
+                self._cond.wait()
+            self._raise_error()
+
+        return blobrefs
+
+    def close(self):
+        """
+        Flush the uploader and release its worker threads, returning the
+        same result as :py:meth:`flush`. No more blobs may be added
+        afterwards.
+        """
+        if self._closed:
+            return []
+        try:
+            return self.flush()
+        finally:
+            self._closed = True
+            self._pool.close()
+            self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't wait for uploads when we're already failing.
+            self._closed = True
+            self._pool.terminate()
+
+    def _raise_error(self):
+        # Must be called with self._cond held.
+        if self._error is not None:
+            exc_info = self._error
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _reserve(self, size):
+        # Block until there's room in the in-flight byte budget for the
+        # given number of bytes, then claim them.
+        with self._cond:
+            while (
+                self._error is None and
+                self._inflight_bytes > 0 and
+                self._inflight_bytes + size > self.max_inflight_bytes
+            ):
+                if not self._inflight_batches:
+                    # Only our unsubmitted batch holds the budget, so
+                    # submit it to make progress.
+                    self._cond.release()
+                    try:
+                        self._submit_batch()
+                    finally:
+                        self._cond.acquire()
+                    continue
+                self._cond.wait()
+            self._raise_error()
+            self._inflight_bytes += size
+
+    def _submit_batch(self):
+        # Must be called with self._batch_lock held.
+        batch = self._batch
+        if not batch:
+            return
+
+        batch_bytes = self._batch_bytes
+        self._batch = []
+        self._batch_bytes = 0
+
+        with self._cond:
+            self._inflight_batches += 1
+
+        self._pool.apply_async(self._upload_batch, (batch, batch_bytes))
+
+    def _upload_batch(self, batch, batch_bytes):
+        import sys
+
+        error = None
+        try:
+            with self._cond:
+                failed = self._error is not None
+            if not failed:
+                self.blob_client.put_multi(*batch)
+        except Exception:
+            error = sys.exc_info()
+
+        with self._cond:
+            if error is not None and self._error is None:
+                self._error = error
+            self._inflight_bytes -= batch_bytes
+            self._inflight_batches -= 1
+            self._cond.notify_all()
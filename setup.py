@@ -1,7 +1,40 @@
 from ez_setup import use_setuptools
 use_setuptools()
 
-from setuptools import setup, find_packages
+from setuptools import setup, find_packages, Command
+
+
+class BenchmarkCommand(Command):
+    description = "run the client benchmark suite"
+    user_options = [
+        ("output=", "o", "write JSON results to the given file"),
+        ("compare=", "c", "compare with JSON results from an earlier run"),
+        ("filter=", "k", "only run benchmarks whose names contain this"),
+        ("quick", "q", "use smaller workloads"),
+    ]
+    boolean_options = ["quick"]
+
+    def initialize_options(self):
+        self.output = None
+        self.compare = None
+        self.filter = None
+        self.quick = False
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        import subprocess
+        import sys
+
+        args = [sys.executable, "benchmarks/suite.py"]
+        for option in ("output", "compare", "filter"):
+            value = getattr(self, option)
+            if value is not None:
+                args.extend(["--" + option, value])
+        if self.quick:
+            args.append("--quick")
+        subprocess.check_call(args)
 
 setup(
     name="camlistore",
@@ -12,6 +45,9 @@ setup(
     author_email="mart@degeneration.co.uk",
 
     test_suite='nose.collector',
+    cmdclass={
+        'benchmark': BenchmarkCommand,
+    },
 
     setup_requires=[
         'nose>=1.0',
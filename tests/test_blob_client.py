@@ -1,8 +1,10 @@
 
 import unittest
+from StringIO import StringIO
 from mock import MagicMock
 
 from camlistore.blobclient import BlobClient, BlobMeta, Blob
+from camlistore.fakeserver import FakeServer
 
 
 class TestBlobClient(unittest.TestCase):
@@ -125,6 +127,48 @@ class TestBlobClient(unittest.TestCase):
             "http://example.com/blerbs/camli/dummy-blobref"
         )
 
+    def test_get_range(self):
+        http_session = MagicMock()
+        http_session.get = MagicMock()
+        response = MagicMock()
+        http_session.get.return_value = response
+
+        response.status_code = 206
+        response.content = 'blob'
+
+        blobs = BlobClient(
+            http_session,
+            'http://example.com/blerbs/',
+        )
+        result = blobs.get_range('dummy-blobref', 6, 4)
+
+        http_session.get.assert_called_with(
+            "http://example.com/blerbs/camli/dummy-blobref",
+            headers={
+                "Range": "bytes=6-9",
+                "Accept-Encoding": "identity",
+            },
+        )
+        self.assertEqual(result, 'blob')
+
+    def test_get_range_unsupported(self):
+        http_session = MagicMock()
+        http_session.get = MagicMock()
+        response = MagicMock()
+        http_session.get.return_value = response
+
+        # Server ignores the Range header and returns the whole blob
+        response.status_code = 200
+        response.content = 'dummy blob'
+
+        blobs = BlobClient(
+            http_session,
+            'http://example.com/blerbs/',
+        )
+        self.assertEqual(blobs.get_range('dummy-blobref', 6, 4), 'blob')
+        self.assertEqual(blobs.get_range('dummy-blobref', 6), 'blob')
+        self.assertEqual(blobs.get_range('dummy-blobref', 20, 4), '')
+
     def test_get_size_success(self):
         http_session = MagicMock()
         http_session.request = MagicMock()
@@ -323,15 +367,24 @@ class TestBlobClient(unittest.TestCase):
             'sha1-1a434c0daa0b17e48abd4b59c632cf13501c7d24',
         )
 
-        http_session.post.assert_called_with(
-            "http://example.com/camli/upload",
-            files={
-                'sha1-1a434c0daa0b17e48abd4b59c632cf13501c7d24': (
-                    'sha1-1a434c0daa0b17e48abd4b59c632cf13501c7d24',
-                    'dummy3',
-                    'application/octet-stream',
-                )
-            }
+        self.assertEqual(http_session.post.call_count, 1)
+        (args, kwargs) = http_session.post.call_args
+        self.assertEqual(args, ("http://example.com/camli/upload",))
+        body = kwargs["data"]
+        self.assertEqual(
+            kwargs["headers"],
+            {"Content-Type": body.content_type},
+        )
+        self.assertEqual(
+            body.read(),
+            "--%s\r\n"
+            "Content-Disposition: form-data; "
+            'name="sha1-1a434c0daa0b17e48abd4b59c632cf13501c7d24"; '
+            'filename="sha1-1a434c0daa0b17e48abd4b59c632cf13501c7d24"\r\n'
+            "Content-Type: application/octet-stream\r\n"
+            "\r\n"
+            "dummy3\r\n"
+            "--%s--\r\n" % (body.boundary, body.boundary),
         )
 
         self.assertEqual(
@@ -427,3 +480,122 @@ class TestBlob(unittest.TestCase):
             TypeError,
             lambda: Blob('hello', hashlib.sha1),
         )
+
+
+class TestBlobClientRanges(unittest.TestCase):
+
+    def setUp(self):
+        import camlistore
+        self.server = FakeServer()
+        self.server.start()
+        self.blobs = camlistore.connect(self.server.url).blobs
+        self.data = "".join("%08i" % i for i in xrange(10000))
+        self.blobref = self.server.add_blob(self.data)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_get_range(self):
+        blobs = self.blobs
+        self.assertEqual(blobs.get_range(self.blobref, 8, 16), self.data[8:24])
+        self.assertEqual(
+            blobs.get_range(self.blobref, 79990),
+            self.data[79990:],
+        )
+        self.assertEqual(blobs.get_range(self.blobref, 79999, 10), "9")
+        self.assertEqual(blobs.get_range(self.blobref, 80000, 10), "")
+
+        from camlistore.exceptions import NotFoundError
+        self.assertRaises(
+            NotFoundError,
+            lambda: blobs.get_range("sha1-missing", 0, 10),
+        )
+
+    def test_download(self):
+        f = StringIO()
+        size = self.blobs.download(self.blobref, f)
+        self.assertEqual(size, len(self.data))
+        self.assertEqual(f.getvalue(), self.data)
+        self.assertEqual(self.server.request_counts["get"], 1)
+
+    def test_download_resume(self):
+        self.server.inject_disconnect(1000, count=2, operation="get")
+
+        f = StringIO()
+        size = self.blobs.download(self.blobref, f, chunk_size=512)
+        self.assertEqual(size, len(self.data))
+        self.assertEqual(f.getvalue(), self.data)
+        self.assertEqual(self.server.request_counts["get"], 3)
+
+    def test_download_too_many_failures(self):
+        from camlistore.exceptions import ServerError
+        self.server.inject_disconnect(1000, count=3, operation="get")
+
+        self.assertRaises(
+            ServerError,
+            lambda: self.blobs.download(
+                self.blobref, StringIO(), max_retries=2,
+            ),
+        )
+
+    def test_download_hash_mismatch(self):
+        from camlistore.exceptions import HashMismatchError
+        blobref = "sha1-%040x" % 1
+        self.server.storage.put(blobref, "corrupt")
+
+        self.assertRaises(
+            HashMismatchError,
+            lambda: self.blobs.download(blobref, StringIO()),
+        )
+
+
+class TestBlobClientBlobrefs(unittest.TestCase):
+
+    def setUp(self):
+        import camlistore
+        self.server = FakeServer()
+        self.server.start()
+        self.blobs = camlistore.connect(self.server.url).blobs
+        self.blobrefs = sorted(
+            self.server.add_blob("blob %i" % i) for i in xrange(5)
+        )
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_validated_enumerate(self):
+        from camlistore.blobref import Blobref
+
+        metas = list(self.blobs.enumerate(validate=True))
+        self.assertEqual(
+            [meta.blobref for meta in metas],
+            [Blobref(blobref) for blobref in self.blobrefs],
+        )
+        self.assertEqual(
+            [str(meta.blobref) for meta in metas],
+            self.blobrefs,
+        )
+        self.assertEqual(metas[0].get_data().blobref, self.blobrefs[0])
+
+        after = list(self.blobs.enumerate(after=metas[2].blobref))
+        self.assertEqual(
+            [meta.blobref for meta in after],
+            self.blobrefs[3:],
+        )
+
+    def test_blobref_arguments(self):
+        from camlistore.blobref import Blobref
+
+        blobref = Blobref(Blob("blob 3").blobref)
+        self.assertEqual(self.blobs.get(blobref).data, "blob 3")
+        self.assertEqual(self.blobs.get_size(blobref), 6)
+        self.assertEqual(self.blobs.get_range(blobref, 5), "3")
+        out = StringIO()
+        self.assertEqual(self.blobs.download(blobref, out), 6)
+        self.assertEqual(out.getvalue(), "blob 3")
+
+        missing = Blobref(Blob("missing").blobref)
+        self.assertEqual(
+            self.blobs.get_size_multi(blobref, missing),
+            {blobref: 6, missing: None},
+        )
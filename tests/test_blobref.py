@@ -0,0 +1,176 @@
+import hashlib
+import json
+import pickle
+import unittest
+
+import camlistore
+from camlistore.blobclient import Blob
+from camlistore.blobref import Blobref, parse_blobrefs
+from camlistore.fakeserver import FakeServer
+from camlistore.localindex import LocalIndex
+
+
+class TestBlobref(unittest.TestCase):
+
+    def test_parse(self):
+        text = Blob("hello").blobref
+        blobref = Blobref(text)
+        self.assertEqual(blobref, text)
+        self.assertEqual(hash(blobref), hash(text))
+        self.assertEqual(str(blobref), text)
+        self.assertIs(type(str(blobref)), str)
+        self.assertEqual("%s" % blobref, text)
+        self.assertEqual("{0}".format(blobref), text)
+        self.assertEqual("x/" + blobref, "x/" + text)
+        self.assertEqual(unicode(blobref), unicode(text))
+        self.assertEqual(repr(blobref), "Blobref(%r)" % text)
+        self.assertEqual(blobref.algorithm, "sha1")
+        self.assertEqual(blobref.digest, hashlib.sha1("hello").digest())
+        self.assertEqual(blobref.hexdigest, text[5:])
+        self.assertIs(Blobref(blobref), blobref)
+        self.assertEqual(Blobref(unicode(text)), blobref)
+
+    def test_other_algorithms(self):
+        for algorithm in ("sha224", "sha256", "sha384", "sha512"):
+            text = Blob("hello", hash_func_name=algorithm).blobref
+            blobref = Blobref(text)
+            self.assertEqual(str(blobref), text)
+            self.assertEqual(blobref.algorithm, algorithm)
+
+    def test_invalid(self):
+        valid_hex = hashlib.sha1("hello").hexdigest()
+        for text in (
+            "",
+            "sha1",
+            "sha1-",
+            "sha1-" + valid_hex[:-1],
+            "sha1-" + valid_hex + "0",
+            "sha1-" + valid_hex.upper(),
+            "sha1-" + "g" * 40,
+            "md5-" + hashlib.md5("hello").hexdigest(),
+            u"sha1-\u00e9",
+        ):
+            self.assertRaises(ValueError, Blobref, text)
+
+    def test_from_digest(self):
+        digest = hashlib.sha256("hello").digest()
+        self.assertEqual(
+            Blobref.from_digest("sha256", digest),
+            Blobref(Blob("hello", hash_func_name="sha256").blobref),
+        )
+        self.assertRaises(ValueError, Blobref.from_digest, "sha1", digest)
+        self.assertRaises(ValueError, Blobref.from_digest, "md5", digest)
+
+    def test_key(self):
+        blobref = Blobref(Blob("hello").blobref)
+        key = blobref.key
+        self.assertIs(type(key), str)
+        self.assertEqual(len(key), 21)
+        self.assertEqual(Blobref.from_key(key), blobref)
+        self.assertIsInstance(Blobref.from_key(key), Blobref)
+        self.assertIn(blobref.key, set([key]))
+        self.assertRaises(ValueError, Blobref.from_key, key[:-1])
+        self.assertRaises(ValueError, Blobref.from_key, "\0" + key[1:])
+
+    def test_order_and_hash(self):
+        texts = [
+            Blob("blob %i" % i, hash_func_name=algorithm).blobref
+            for i in xrange(20)
+            for algorithm in ("sha1", "sha224", "sha256")
+        ]
+        blobrefs = [Blobref(text) for text in texts]
+        self.assertEqual(
+            [str(blobref) for blobref in sorted(blobrefs)],
+            sorted(texts),
+        )
+        self.assertEqual(
+            [Blobref.from_key(key) for key in sorted(
+                blobref.key for blobref in blobrefs
+            )],
+            sorted(texts),
+        )
+        self.assertEqual(len(set(blobrefs + [Blobref(texts[0])])), 60)
+        self.assertIn(Blobref(texts[5]), set(blobrefs))
+
+    def test_pickle(self):
+        blobref = Blobref(Blob("hello").blobref)
+        for protocol in xrange(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(blobref, protocol))
+            self.assertEqual(copy, blobref)
+            self.assertIsInstance(copy, Blobref)
+
+
+class TestParseBlobrefs(unittest.TestCase):
+
+    def test_parse(self):
+        texts = [
+            Blob("blob %i" % i, hash_func_name=algorithm).blobref
+            for i in xrange(50)
+            for algorithm in ("sha1", "sha256")
+        ]
+        self.assertEqual(
+            parse_blobrefs(texts),
+            [Blobref(text) for text in texts],
+        )
+        self.assertEqual(parse_blobrefs([]), [])
+
+    def test_invalid(self):
+        texts = [Blob("blob %i" % i).blobref for i in xrange(5)]
+        for bad in ("sha1-short", "sha1-" + "G" * 40, "bogus-00"):
+            self.assertRaises(ValueError, parse_blobrefs, texts + [bad])
+
+
+class TestBlobrefClients(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.server.start()
+        self.conn = camlistore.connect(self.server.url)
+        self.permanode = self.server.add_blob(json.dumps({
+            "camliVersion": 1,
+            "camliType": "permanode",
+            "random": "1",
+        }))
+        self.server.add_blob(json.dumps({
+            "camliVersion": 1,
+            "camliType": "claim",
+            "permaNode": self.permanode,
+            "claimType": "set-attribute",
+            "claimDate": "2013-01-01T00:00:00Z",
+            "attribute": "title",
+            "value": "Hello",
+        }))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_search_client(self):
+        searcher = self.conn.searcher
+        blobref = Blobref(self.permanode)
+
+        desc = searcher.describe_blob(blobref)
+        self.assertEqual(desc.blobref, self.permanode)
+        self.assertEqual(desc.permanode.get("title"), "Hello")
+        self.assertEqual(
+            searcher.describe_blobs([blobref]).keys(),
+            [self.permanode],
+        )
+
+        claims = searcher.get_claims_for_permanode(blobref)
+        self.assertEqual([claim.value for claim in claims], ["Hello"])
+
+        results = searcher.query("attr:title:Hello")
+        self.assertIn(blobref, [result.blobref for result in results])
+
+    def test_local_index(self):
+        index = LocalIndex(":memory:", blob_client=self.conn.blobs)
+        index.update()
+        blobref = Blobref(self.permanode)
+
+        self.assertEqual(index.describe_blob(blobref).type, "permanode")
+        self.assertEqual(
+            [claim.value for claim in index.get_claims_for_permanode(
+                blobref,
+            )],
+            ["Hello"],
+        )
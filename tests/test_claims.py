@@ -0,0 +1,130 @@
+import unittest
+
+from camlistore.claims import AttributeResolver
+from camlistore.searchclient import ClaimMeta
+
+
+def make_claim(blobref, date, claim_type, attr, value=None, permanode="pn"):
+    raw_dict = {
+        "blobref": blobref,
+        "permanode": permanode,
+        "date": date,
+        "type": claim_type,
+        "attr": attr,
+    }
+    if value is not None:
+        raw_dict["value"] = value
+    return ClaimMeta(raw_dict)
+
+
+class TestAttributeResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.claims = [
+            make_claim(
+                "c1", "2013-01-01T00:00:00Z", "set-attribute", "title", "a",
+            ),
+            make_claim(
+                "c2", "2013-01-02T00:00:00Z", "add-attribute", "tag", "x",
+            ),
+            make_claim(
+                "c3", "2013-01-03T00:00:00Z", "add-attribute", "tag", "y",
+            ),
+            make_claim(
+                "c4", "2013-01-04T00:00:00Z", "set-attribute", "title", "b",
+            ),
+            make_claim(
+                "c5", "2013-01-05T00:00:00Z", "del-attribute", "tag", "x",
+            ),
+            make_claim(
+                "c6", "2013-01-06T00:00:00Z", "del-attribute", "title",
+            ),
+        ]
+
+    def test_latest(self):
+        resolver = AttributeResolver()
+        resolver.add_claims(self.claims)
+        self.assertEqual(
+            resolver.attributes("pn"),
+            {"tag": ["y"]},
+        )
+        self.assertEqual(resolver.attribute("pn", "title"), None)
+        self.assertEqual(resolver.attributes("unknown"), {})
+
+    def test_as_of(self):
+        from datetime import datetime
+
+        # a small checkpoint interval exercises the snapshot logic
+        resolver = AttributeResolver(checkpoint_interval=2)
+        # claims can arrive in any order
+        resolver.add_claims(reversed(self.claims))
+
+        self.assertEqual(
+            resolver.attributes("pn", at=datetime(2012, 12, 31)),
+            {},
+        )
+        self.assertEqual(
+            resolver.attributes("pn", at=datetime(2013, 1, 1)),
+            {"title": ["a"]},
+        )
+        self.assertEqual(
+            resolver.attributes("pn", at=datetime(2013, 1, 3, 12)),
+            {"title": ["a"], "tag": ["x", "y"]},
+        )
+        self.assertEqual(
+            resolver.attributes("pn", at=datetime(2013, 1, 5, 12)),
+            {"title": ["b"], "tag": ["y"]},
+        )
+        self.assertEqual(
+            resolver.attribute("pn", "title", at=datetime(2013, 1, 4)),
+            "b",
+        )
+
+    def test_incremental(self):
+        from datetime import datetime
+
+        resolver = AttributeResolver(checkpoint_interval=2)
+        resolver.add_claims(self.claims[3:])
+        self.assertEqual(
+            resolver.attributes("pn", at=datetime(2013, 1, 4)),
+            {"title": ["b"]},
+        )
+
+        # Adding earlier claims later must invalidate earlier snapshots
+        resolver.add_claims(self.claims)
+        self.assertEqual(
+            resolver.attributes("pn", at=datetime(2013, 1, 4)),
+            {"title": ["b"], "tag": ["x", "y"]},
+        )
+        self.assertEqual(
+            [claim.blobref for claim in resolver.claims("pn")],
+            ["c1", "c2", "c3", "c4", "c5", "c6"],
+        )
+
+    def test_undated(self):
+        from datetime import datetime
+
+        resolver = AttributeResolver()
+        resolver.add_claims(self.claims[:2])
+        resolver.add_claims([
+            make_claim("c0", None, "set-attribute", "title", "undated"),
+        ])
+
+        # Claims with no timestamp sort before all others, so apply at
+        # any time.
+        self.assertEqual(
+            [claim.blobref for claim in resolver.claims("pn")],
+            ["c0", "c1", "c2"],
+        )
+        self.assertEqual(
+            resolver.attributes("pn", at=datetime(2012, 12, 31)),
+            {"title": ["undated"]},
+        )
+        self.assertEqual(resolver.attribute("pn", "title"), "a")
+
+    def test_returned_attrs_are_copies(self):
+        resolver = AttributeResolver(checkpoint_interval=1)
+        resolver.add_claims(self.claims[:1])
+        attrs = resolver.attributes("pn")
+        attrs["title"].append("modified")
+        self.assertEqual(resolver.attributes("pn"), {"title": ["a"]})
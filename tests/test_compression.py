@@ -0,0 +1,160 @@
+import unittest
+import zlib
+from mock import MagicMock
+
+import camlistore
+from camlistore.blobclient import Blob
+from camlistore.compression import (
+    compressed_multipart,
+    decode_response,
+    gzip_compress,
+    wire_size,
+)
+from camlistore.fakeserver import FakeServer
+from camlistore.metrics import MetricsAggregator
+from camlistore.multipart import MultipartBody
+
+
+class TestCompression(unittest.TestCase):
+
+    def test_gzip_compress(self):
+        data = "hello world " * 100
+        compressed = gzip_compress(data)
+        self.assertTrue(len(compressed) < len(data))
+        self.assertEqual(zlib.decompress(compressed, 47), data)
+
+    def test_compressed_multipart(self):
+        data = "compressible " * 1000
+        multipart = MultipartBody([("sha1-dummy", data)])
+        (body, headers) = compressed_multipart(multipart)
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(headers["Content-Type"], multipart.content_type)
+        compressed = "".join(body)
+        self.assertEqual(len(body), len(compressed))
+        multipart.rewind()
+        self.assertEqual(zlib.decompress(compressed, 47), multipart.read())
+
+        # The body can be sent again, such as to retry a request.
+        self.assertEqual("".join(body), compressed)
+
+    def test_compressed_multipart_streamed(self):
+        # Compressed bodies are produced a chunk at a time, like the
+        # multipart bodies they compress, rather than all at once.
+        import os
+        data = os.urandom(100000) + "compressible " * 100000
+        multipart = MultipartBody([("sha1-dummy", data)], chunk_size=4096)
+        (body, headers) = compressed_multipart(multipart)
+        pieces = list(body)
+        self.assertLess(max(len(piece) for piece in pieces), len(body) / 4)
+        self.assertEqual(sum(len(piece) for piece in pieces), len(body))
+        multipart.rewind()
+        self.assertEqual(
+            zlib.decompress("".join(pieces), 47),
+            multipart.read(),
+        )
+
+    def test_compressed_multipart_incompressible(self):
+        import os
+        data = os.urandom(4096)
+        self.assertEqual(
+            compressed_multipart(MultipartBody([("sha1-dummy", data)])),
+            None,
+        )
+
+    def test_wire_size(self):
+        resp = MagicMock()
+        resp.headers = {}
+        self.assertEqual(wire_size(resp, 100), 100)
+
+        resp.headers = {
+            "content-encoding": "gzip",
+            "content-length": "30",
+        }
+        self.assertEqual(wire_size(resp, 100), 30)
+
+    def test_decode_response_identity(self):
+        resp = MagicMock()
+        resp.headers = {}
+        resp.content = "hello"
+        self.assertEqual(decode_response(resp).content, "hello")
+
+
+class TestCompressedTransfers(unittest.TestCase):
+
+    def test_compressed_responses(self):
+        metrics = MetricsAggregator()
+        data = "compressible " * 1000
+        with FakeServer(compress_responses=True) as server:
+            blobref = server.add_blob(data)
+            conn = camlistore.connect(server.url)
+            conn.add_observer(metrics)
+
+            self.assertEqual(conn.blobs.get(blobref).data, data)
+            self.assertEqual(conn.blobs.get_size(blobref), len(data))
+
+        stats = metrics.snapshot()["get"]
+        self.assertEqual(stats["bytes_down"], len(data))
+        self.assertTrue(stats["wire_bytes_down"] < len(data))
+
+    def test_compressed_uploads(self):
+        metrics = MetricsAggregator()
+        data = "compressible " * 1000
+        with FakeServer(accept_compressed_uploads=True) as server:
+            conn = camlistore.connect(server.url, compress_uploads=True)
+            conn.add_observer(metrics)
+
+            blobref = conn.blobs.put(Blob(data))
+
+            self.assertEqual(server.storage.get(blobref), data)
+            self.assertEqual(conn.blobs.compress_uploads, True)
+
+        stats = metrics.snapshot()["upload"]
+        self.assertEqual(stats["requests"], 1)
+        self.assertEqual(stats["bytes_up"], len(data))
+        self.assertTrue(stats["wire_bytes_up"] < len(data))
+
+    def test_compressed_uploads_unsupported(self):
+        data = "compressible " * 1000
+        with FakeServer() as server:
+            conn = camlistore.connect(server.url, compress_uploads=True)
+
+            blobref = conn.blobs.put(Blob(data))
+            self.assertEqual(server.storage.get(blobref), data)
+            self.assertEqual(server.request_counts["upload"], 2)
+            self.assertEqual(conn.blobs.compress_uploads, False)
+
+            # Subsequent uploads don't try compression again.
+            conn.blobs.put(Blob(data + "more"))
+            self.assertEqual(server.request_counts["upload"], 3)
+
+    def test_incompressible_uploads(self):
+        import os
+        data = os.urandom(4096)
+        with FakeServer(accept_compressed_uploads=True) as server:
+            conn = camlistore.connect(server.url, compress_uploads=True)
+
+            # The body read while trying to compress it is sent whole.
+            blobref = conn.blobs.put(Blob(data))
+            self.assertEqual(server.storage.get(blobref), data)
+            self.assertEqual(server.request_counts["upload"], 1)
+
+    def test_compressed_uploads_bad_request(self):
+        from camlistore.exceptions import ServerError
+
+        data = "compressible " * 1000
+        with FakeServer(accept_compressed_uploads=True) as server:
+            conn = camlistore.connect(server.url, compress_uploads=True)
+
+            # A request that fails both compressed and uncompressed is
+            # no reason to stop compressing.
+            server.inject_error(status=400, count=2, operation="upload")
+            self.assertRaises(ServerError, conn.blobs.put, Blob(data))
+            self.assertEqual(server.request_counts["upload"], 2)
+            self.assertEqual(conn.blobs.compress_uploads, True)
+
+            # But one that only succeeds uncompressed is.
+            server.inject_error(status=400, count=1, operation="upload")
+            blobref = conn.blobs.put(Blob(data))
+            self.assertEqual(server.storage.get(blobref), data)
+            self.assertEqual(server.request_counts["upload"], 4)
+            self.assertEqual(conn.blobs.compress_uploads, False)
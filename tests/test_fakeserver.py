@@ -0,0 +1,137 @@
+import json
+import unittest
+
+import camlistore
+from camlistore.blobclient import Blob
+from camlistore.fakeserver import FakeServer, MemoryStorage, DirectoryStorage
+
+
+class TestFakeServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.server.start()
+        self.conn = camlistore.connect(self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_blobs(self):
+        blobs = self.conn.blobs
+        blobref = blobs.put(Blob("hello"))
+
+        self.assertEqual(blobs.get(blobref).data, "hello")
+        self.assertEqual(blobs.get_size(blobref), 5)
+        self.assertEqual(
+            blobs.get_size_multi(blobref, "sha1-missing"),
+            {blobref: 5, "sha1-missing": None},
+        )
+        self.assertEqual(blobs.blob_exists("sha1-missing"), False)
+        self.assertEqual(self.server.request_counts["upload"], 1)
+
+        # Uploading again is a no-op since the server already has it
+        blobs.put(Blob("hello"))
+        self.assertEqual(self.server.request_counts["upload"], 1)
+
+    def test_enumerate(self):
+        blobrefs = sorted(
+            self.server.add_blob("blob %i" % i) for i in xrange(2500)
+        )
+        self.assertEqual(
+            [meta.blobref for meta in self.conn.blobs.enumerate()],
+            blobrefs,
+        )
+        # the default page size means this took three requests
+        self.assertEqual(self.server.request_counts["enumerate"], 3)
+
+    def test_search(self):
+        permanode = self.server.add_blob(json.dumps({
+            "camliVersion": 1,
+            "camliType": "permanode",
+            "random": "x",
+        }))
+        self.server.add_blob(json.dumps({
+            "camliVersion": 1,
+            "camliType": "claim",
+            "permaNode": permanode,
+            "claimType": "set-attribute",
+            "claimDate": "2013-01-01T00:00:00Z",
+            "attribute": "title",
+            "value": "Hello",
+        }))
+
+        searcher = self.conn.searcher
+        self.assertEqual(
+            [result.blobref for result in searcher.query("")],
+            [permanode],
+        )
+        self.assertEqual(
+            [result.blobref for result in searcher.query("attr:title:Hello")],
+            [permanode],
+        )
+        self.assertEqual(searcher.query("attr:title:Other"), [])
+
+        desc = searcher.describe_blob(permanode)
+        self.assertEqual(desc.type, "permanode")
+        self.assertEqual(
+            desc.raw_dict["permanode"]["attr"],
+            {"title": ["Hello"]},
+        )
+
+        claims = searcher.get_claims_for_permanode(permanode)
+        self.assertEqual([claim.value for claim in claims], ["Hello"])
+
+    def test_inject_error(self):
+        from camlistore.exceptions import ServerError
+
+        blobref = self.server.add_blob("hello")
+        self.server.inject_error(status=503, operation="get", count=2)
+
+        self.assertRaises(ServerError, lambda: self.conn.blobs.get(blobref))
+        # other operations are unaffected
+        self.assertEqual(self.conn.blobs.get_size(blobref), 5)
+        self.assertRaises(ServerError, lambda: self.conn.blobs.get(blobref))
+        self.assertEqual(self.conn.blobs.get(blobref).data, "hello")
+
+    def test_error_rate(self):
+        from camlistore.exceptions import ServerError
+
+        self.server.error_rate = 1
+        self.assertRaises(
+            ServerError,
+            lambda: self.conn.blobs.get_size_multi("sha1-foo"),
+        )
+
+
+class TestStorage(unittest.TestCase):
+
+    def check_storage(self, storage):
+        storage.put("sha1-b", "bb")
+        storage.put("sha1-a", "a")
+        storage.put("sha1-c", "ccc")
+
+        self.assertEqual(storage.get("sha1-b"), "bb")
+        self.assertEqual(storage.get("sha1-d"), None)
+        self.assertEqual(storage.get_size("sha1-c"), 3)
+        self.assertEqual(storage.get_size("sha1-d"), None)
+        self.assertEqual(
+            storage.enumerate(),
+            [("sha1-a", 1), ("sha1-b", 2), ("sha1-c", 3)],
+        )
+        self.assertEqual(
+            storage.enumerate(after="sha1-a", limit=1),
+            [("sha1-b", 2)],
+        )
+
+    def test_memory_storage(self):
+        self.check_storage(MemoryStorage())
+
+    def test_directory_storage(self):
+        import shutil
+        import tempfile
+
+        path = tempfile.mkdtemp()
+        try:
+            self.check_storage(DirectoryStorage(path))
+        finally:
+            shutil.rmtree(path)
@@ -0,0 +1,386 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+import camlistore
+from camlistore import filetree
+from camlistore.fakeserver import FakeServer
+from camlistore.filetree import StatCache
+
+
+class TestPutTree(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.server.start()
+        self.blobs = camlistore.connect(self.server.url).blobs
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, "root")
+        os.makedirs(os.path.join(self.root, "sub", "deeper"))
+        os.makedirs(os.path.join(self.root, "empty"))
+        self.write("a.txt", "hello")
+        self.write("sub/b.txt", "b" * 2500)
+        self.write("sub/deeper/c.txt", "")
+        os.symlink("a.txt", os.path.join(self.root, "link"))
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        with open(os.path.join(self.root, name), "wb") as f:
+            f.write(data)
+
+    def get_schema(self, blobref):
+        return json.loads(self.blobs.get(blobref).data)
+
+    def get_entries(self, dir_schema):
+        entries = {}
+        for member in self.get_schema(dir_schema["entries"])["members"]:
+            schema = self.get_schema(member)
+            entries[schema["fileName"]] = schema
+        return entries
+
+    def read_file(self, file_schema):
+        return "".join(
+            self.blobs.get(part["blobRef"]).data
+            for part in file_schema["parts"]
+        )
+
+    def test_put_tree(self):
+        root_ref = self.blobs.put_tree(self.root, chunk_size=1000)
+
+        root = self.get_schema(root_ref)
+        self.assertEqual(root["camliType"], "directory")
+        self.assertEqual(root["fileName"], "root")
+
+        entries = self.get_entries(root)
+        self.assertEqual(
+            sorted(entries),
+            ["a.txt", "empty", "link", "sub"],
+        )
+        self.assertEqual(entries["a.txt"]["camliType"], "file")
+        self.assertEqual(self.read_file(entries["a.txt"]), "hello")
+        self.assertEqual(entries["link"]["camliType"], "symlink")
+        self.assertEqual(entries["link"]["symlinkTarget"], "a.txt")
+        self.assertEqual(self.get_entries(entries["empty"]), {})
+
+        sub = self.get_entries(entries["sub"])
+        self.assertEqual(len(sub["b.txt"]["parts"]), 3)
+        self.assertEqual(self.read_file(sub["b.txt"]), "b" * 2500)
+
+        deeper = self.get_entries(sub["deeper"])
+        self.assertEqual(deeper["c.txt"]["parts"], [])
+
+        # Uploading again produces the same tree without re-uploading
+        uploads = self.server.request_counts["upload"]
+        self.assertEqual(
+            self.blobs.put_tree(self.root, chunk_size=1000),
+            root_ref,
+        )
+        self.assertEqual(self.server.request_counts["upload"], uploads)
+
+    def test_stat_cache(self):
+        cache = StatCache(":memory:")
+        root_ref = self.blobs.put_tree(self.root, stat_cache=cache)
+        self.assertEqual(len(cache), 3)
+
+        with patch.object(
+            filetree, "_put_file", wraps=filetree._put_file,
+        ) as put_file:
+            self.assertEqual(
+                self.blobs.put_tree(self.root, stat_cache=cache),
+                root_ref,
+            )
+            self.assertEqual(put_file.call_count, 0)
+
+            # Changing a file causes only that file to be read again
+            self.write("sub/b.txt", "changed")
+            new_root_ref = self.blobs.put_tree(self.root, stat_cache=cache)
+            self.assertNotEqual(new_root_ref, root_ref)
+            self.assertEqual(put_file.call_count, 1)
+
+        sub = self.get_entries(self.get_entries(
+            self.get_schema(new_root_ref),
+        )["sub"])
+        self.assertEqual(self.read_file(sub["b.txt"]), "changed")
+
+    def test_stat_cache_failed_upload(self):
+        # Files whose blobs didn't reach the server must not be recorded,
+        # or the next upload would skip them.
+        cache = StatCache(":memory:")
+        self.server.inject_error(status=500, count=1000, operation="upload")
+        self.assertRaises(
+            Exception,
+            self.blobs.put_tree,
+            self.root,
+            stat_cache=cache,
+        )
+        self.assertEqual(len(cache), 0)
+
+    def test_missing(self):
+        self.assertRaises(
+            OSError,
+            self.blobs.put_tree,
+            os.path.join(self.tmpdir, "missing"),
+        )
+
+
+class TestGetTree(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.server.start()
+        self.blobs = camlistore.connect(self.server.url).blobs
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmpdir, "source")
+        self.dest = os.path.join(self.tmpdir, "dest")
+        os.makedirs(os.path.join(self.source, "sub", "deeper"))
+        self.files = {
+            "a.txt": "hello",
+            "sub/b.txt": "".join("%05i" % i for i in xrange(1000)),
+            "sub/deeper/c.txt": "",
+        }
+        for (name, data) in self.files.items():
+            with open(os.path.join(self.source, name), "wb") as f:
+                f.write(data)
+        os.chmod(os.path.join(self.source, "a.txt"), 0640)
+        os.utime(os.path.join(self.source, "a.txt"), (1000000, 1000000))
+        os.symlink("a.txt", os.path.join(self.source, "link"))
+
+        self.root_ref = self.blobs.put_tree(self.source, chunk_size=1000)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, name):
+        with open(os.path.join(self.dest, name), "rb") as f:
+            return f.read()
+
+    def test_get_tree(self):
+        self.blobs.get_tree(self.root_ref, self.dest)
+
+        for (name, data) in self.files.items():
+            self.assertEqual(self.read(name), data)
+        self.assertEqual(
+            os.readlink(os.path.join(self.dest, "link")),
+            "a.txt",
+        )
+
+        a_stat = os.stat(os.path.join(self.dest, "a.txt"))
+        self.assertEqual(a_stat.st_mode & 0777, 0640)
+        self.assertEqual(a_stat.st_mtime, 1000000)
+
+    def test_skip_existing(self):
+        self.blobs.get_tree(self.root_ref, self.dest)
+        first_gets = self.server.request_counts["get"]
+
+        # Restoring again only fetches the schema blobs, since all of
+        # the file data is already present.
+        self.blobs.get_tree(self.root_ref, self.dest)
+        second_gets = self.server.request_counts["get"] - first_gets
+        # a.txt has one chunk and sub/b.txt has five
+        self.assertEqual(second_gets, first_gets - 6)
+
+        # Damaging one chunk of a file causes only that chunk to be
+        # fetched again.
+        with open(os.path.join(self.dest, "sub", "b.txt"), "r+b") as f:
+            f.seek(2500)
+            f.write("XXXXX")
+        self.blobs.get_tree(self.root_ref, self.dest)
+        third_gets = (
+            self.server.request_counts["get"] - first_gets - second_gets
+        )
+        self.assertEqual(third_gets, second_gets + 1)
+        self.assertEqual(self.read("sub/b.txt"), self.files["sub/b.txt"])
+
+    def test_overwrite(self):
+        self.blobs.get_tree(self.root_ref, self.dest)
+        with open(os.path.join(self.dest, "a.txt"), "wb") as f:
+            f.write("a longer file that should be truncated")
+
+        self.blobs.get_tree(self.root_ref, self.dest, skip_existing=False)
+        self.assertEqual(self.read("a.txt"), "hello")
+
+    def test_unsafe_name(self):
+        from camlistore.schema import (
+            directory_schema,
+            file_schema,
+            schema_blob,
+            static_set_schema,
+        )
+
+        evil_file = schema_blob(file_schema("../evil", []))
+        entries = schema_blob(static_set_schema([evil_file.blobref]))
+        root = schema_blob(directory_schema("root", entries.blobref))
+        self.blobs.put_multi(evil_file, entries, root)
+
+        self.assertRaises(
+            ValueError,
+            self.blobs.get_tree, root.blobref, self.dest,
+        )
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "evil")))
+
+    def test_symlink_then_directory(self):
+        from camlistore.schema import (
+            directory_schema,
+            file_schema,
+            schema_blob,
+            static_set_schema,
+            symlink_schema,
+        )
+
+        outside = os.path.join(self.tmpdir, "outside")
+        os.mkdir(outside)
+        evil_file = schema_blob(file_schema("evil", []))
+        sub_entries = schema_blob(static_set_schema([evil_file.blobref]))
+        sub = schema_blob(directory_schema("sub", sub_entries.blobref))
+        link = schema_blob(symlink_schema("sub", outside))
+        entries = schema_blob(static_set_schema([
+            link.blobref,
+            sub.blobref,
+        ]))
+        root = schema_blob(directory_schema("root", entries.blobref))
+        self.blobs.put_multi(evil_file, sub_entries, sub, link, entries, root)
+
+        # The directory replaces the link rather than being written
+        # through it.
+        self.blobs.get_tree(root.blobref, self.dest)
+        self.assertEqual(os.listdir(outside), [])
+        self.assertFalse(os.path.islink(os.path.join(self.dest, "sub")))
+        self.assertEqual(os.listdir(os.path.join(self.dest, "sub")), ["evil"])
+
+    def test_existing_symlink(self):
+        outside = os.path.join(self.tmpdir, "outside")
+        os.mkdir(outside)
+        os.mkdir(self.dest)
+        os.symlink(outside, os.path.join(self.dest, "sub"))
+
+        self.blobs.get_tree(self.root_ref, self.dest)
+        self.assertEqual(os.listdir(outside), [])
+        self.assertFalse(os.path.islink(os.path.join(self.dest, "sub")))
+        self.assertEqual(self.read("sub/b.txt"), self.files["sub/b.txt"])
+
+    def test_check_within(self):
+        os.mkdir(self.dest)
+        os.symlink(self.tmpdir, os.path.join(self.dest, "up"))
+        root = os.path.realpath(self.dest)
+        filetree._check_within(root, os.path.join(self.dest, "sub"))
+        self.assertRaises(
+            ValueError,
+            filetree._check_within,
+            root,
+            os.path.join(self.dest, "up", "sub"),
+        )
+
+
+class TestDiffTrees(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.server.start()
+        self.blobs = camlistore.connect(self.server.url).blobs
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, "root")
+        os.makedirs(os.path.join(self.root, "big"))
+        os.makedirs(os.path.join(self.root, "sub", "old-dir"))
+        for i in xrange(50):
+            self.write("big/file%i" % i, "unchanged %i" % i)
+        self.write("sub/changed", "before")
+        self.write("sub/removed", "gone soon")
+        self.write("sub/same", "same")
+        self.write("top", "top")
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        with open(os.path.join(self.root, name), "wb") as f:
+            f.write(data)
+        # Keep modification times stable so that only content matters
+        os.utime(os.path.join(self.root, name), (1000000, 1000000))
+
+    def snapshot(self):
+        for dir_path in ("big", "sub", "sub/new-dir", "sub/old-dir", ""):
+            path = os.path.join(self.root, dir_path)
+            if os.path.isdir(path):
+                os.utime(path, (1000000, 1000000))
+        return self.blobs.put_tree(self.root)
+
+    def test_diff(self):
+        old_ref = self.snapshot()
+
+        self.write("sub/changed", "after")
+        os.remove(os.path.join(self.root, "sub", "removed"))
+        self.write("sub/added", "new")
+        os.rmdir(os.path.join(self.root, "sub", "old-dir"))
+        os.makedirs(os.path.join(self.root, "sub", "new-dir"))
+        new_ref = self.snapshot()
+
+        gets = self.server.request_counts.get("get", 0)
+        changes = list(self.blobs.diff_trees(old_ref, new_ref))
+        self.assertEqual(
+            [(change.kind, change.path) for change in changes],
+            [
+                ("added", "sub/added"),
+                ("modified", "sub/changed"),
+                ("added", "sub/new-dir"),
+                ("removed", "sub/old-dir"),
+                ("removed", "sub/removed"),
+            ],
+        )
+
+        modified = changes[1]
+        self.assertEqual(modified.old["fileName"], "changed")
+        self.assertNotEqual(modified.old_ref, modified.new_ref)
+        self.assertEqual(changes[0].old, None)
+        self.assertEqual(changes[3].new_ref, None)
+
+        # The unchanged "big" directory was never fetched: two roots, two
+        # root static-sets, two "sub" directories and their static-sets,
+        # plus the six "sub" entries that differ.
+        self.assertEqual(self.server.request_counts["get"] - gets, 14)
+
+    def test_directory_attributes(self):
+        old_ref = self.snapshot()
+        os.chmod(os.path.join(self.root, "sub"), 0700)
+        new_ref = self.snapshot()
+
+        gets = self.server.request_counts.get("get", 0)
+        changes = list(self.blobs.diff_trees(old_ref, new_ref))
+        self.assertEqual(
+            [(change.kind, change.path) for change in changes],
+            [("modified", "sub")],
+        )
+        self.assertEqual(changes[0].old["entries"], changes[0].new["entries"])
+
+        # The contents of "sub" are unchanged, so its static-set wasn't
+        # fetched: just the two roots, their static-sets and the two
+        # "sub" directories.
+        self.assertEqual(self.server.request_counts["get"] - gets, 6)
+
+    def test_directory_attributes_and_contents(self):
+        old_ref = self.snapshot()
+        self.write("sub/changed", "after")
+        os.utime(os.path.join(self.root, "sub"), (2000000, 2000000))
+        new_ref = self.blobs.put_tree(self.root)
+
+        changes = list(self.blobs.diff_trees(old_ref, new_ref))
+        self.assertEqual(
+            [(change.kind, change.path) for change in changes],
+            [("modified", "sub"), ("modified", "sub/changed")],
+        )
+
+    def test_identical(self):
+        root_ref = self.snapshot()
+        gets = self.server.request_counts.get("get", 0)
+        self.assertEqual(list(self.blobs.diff_trees(root_ref, root_ref)), [])
+        self.assertEqual(self.server.request_counts.get("get", 0), gets)
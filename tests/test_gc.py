@@ -0,0 +1,163 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import MagicMock
+
+import camlistore
+from camlistore.blobclient import Blob
+from camlistore.fakeserver import FakeServer
+from camlistore.filetree import put_tree
+from camlistore.gc import DigestSet, GarbageCollector
+from camlistore.schema import schema_blob
+
+
+class TestGarbageCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.server.start()
+        self.blobs = camlistore.connect(self.server.url).blobs
+
+        self.tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, "sub"))
+        with open(os.path.join(self.tmpdir, "a.txt"), "wb") as f:
+            f.write("hello")
+        with open(os.path.join(self.tmpdir, "sub", "b.txt"), "wb") as f:
+            f.write("b" * 2500)
+        self.tree_ref = put_tree(self.blobs, self.tmpdir, chunk_size=1000)
+        self.tree_blobrefs = set(
+            blobref for (blobref, size) in self.server.storage.enumerate()
+        )
+
+        self.permanode = schema_blob({
+            "camliType": "permanode",
+            "random": "1",
+        })
+        self.claim = schema_blob({
+            "camliType": "claim",
+            "permaNode": self.permanode.blobref,
+            "claimType": "set-attribute",
+            "claimDate": "2013-01-01T00:00:00Z",
+            "attribute": "camliContent",
+            "value": self.tree_ref,
+        })
+        self.garbage = [
+            Blob("orphaned chunk"),
+            schema_blob({
+                "camliType": "static-set",
+                "members": [Blob("orphaned member").blobref],
+            }),
+        ]
+        self.blobs.put_multi(self.permanode, self.claim, *self.garbage)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_mark_and_sweep(self):
+        collector = GarbageCollector(self.blobs, concurrency=3)
+        marked = collector.mark([self.claim.blobref])
+
+        live = self.tree_blobrefs | {
+            self.permanode.blobref,
+            self.claim.blobref,
+        }
+        self.assertEqual(len(marked), len(live))
+        for blobref in live:
+            self.assertIn(blobref, marked)
+
+        self.assertEqual(
+            sorted(meta.blobref for meta in collector.sweep(marked)),
+            sorted(blob.blobref for blob in self.garbage),
+        )
+
+    def test_chunks_not_fetched(self):
+        self.blobs.get_range = MagicMock(side_effect=self.blobs.get_range)
+        GarbageCollector(self.blobs).mark([self.claim.blobref])
+
+        fetched = set(
+            call[0][0] for call in self.blobs.get_range.call_args_list
+        )
+        self.assertIn(self.tree_ref, fetched)
+        self.assertNotIn(Blob("hello").blobref, fetched)
+        self.assertNotIn(Blob("b" * 1000).blobref, fetched)
+
+    def test_collect(self):
+        deleted = []
+        report = GarbageCollector(self.blobs).collect(
+            [self.claim.blobref, self.permanode.blobref],
+            delete=deleted.append,
+            delete_batch_size=1,
+        )
+
+        self.assertEqual(report.blob_count, len(self.tree_blobrefs) + 4)
+        self.assertEqual(report.garbage_count, 2)
+        self.assertEqual(
+            report.garbage_bytes,
+            sum(blob.size for blob in self.garbage),
+        )
+        self.assertEqual(report.missing, [])
+        self.assertEqual(
+            sorted(deleted),
+            sorted([blob.blobref] for blob in self.garbage),
+        )
+
+    def test_missing(self):
+        dangling = schema_blob({
+            "camliType": "static-set",
+            "members": [Blob("never uploaded").blobref, self.tree_ref],
+        })
+        self.blobs.put(dangling)
+        report = GarbageCollector(self.blobs).collect([dangling.blobref])
+        self.assertEqual(report.missing, [Blob("never uploaded").blobref])
+        self.assertEqual(report.garbage_count, 4)
+
+    def test_error(self):
+        self.server.inject_error(500, count=10)
+        with self.assertRaises(camlistore.exceptions.ServerError):
+            GarbageCollector(self.blobs).mark([self.claim.blobref])
+
+
+class TestDigestSet(unittest.TestCase):
+
+    def test_add(self):
+        blobrefs = [Blob("blob %i" % i).blobref for i in xrange(2000)]
+        digests = DigestSet(capacity=10)
+        for blobref in blobrefs:
+            self.assertTrue(digests.add(blobref))
+        self.assertEqual(len(digests), 2000)
+        for blobref in blobrefs:
+            self.assertFalse(digests.add(blobref))
+            self.assertIn(blobref, digests)
+        self.assertEqual(len(digests), 2000)
+        self.assertNotIn(Blob("another").blobref, digests)
+
+    def test_unusual_blobrefs(self):
+        digests = DigestSet()
+        self.assertTrue(digests.add("sha1-short"))
+        self.assertTrue(digests.add("not a blobref"))
+        self.assertIn("sha1-short", digests)
+        self.assertIn("not a blobref", digests)
+        self.assertNotIn("sha1-other", digests)
+        # A digest of all zeros must not be mistaken for an empty slot.
+        self.assertTrue(digests.add("sha1-" + "0" * 40))
+        self.assertIn("sha1-" + "0" * 40, digests)
+
+    def test_shared_prefix(self):
+        # Blobrefs whose digests share a long prefix are still distinct,
+        # even once the table has grown.
+        digests = DigestSet(capacity=1)
+        blobrefs = ["sha1-" + "ab" * 19 + "%02x" % i for i in xrange(100)]
+        for blobref in blobrefs:
+            self.assertTrue(digests.add(blobref))
+        self.assertEqual(len(digests), 100)
+        for blobref in blobrefs:
+            self.assertIn(blobref, digests)
+        self.assertNotIn("sha1-" + "ab" * 20, digests)
+
+        sha256 = "sha256-" + "ab" * 32
+        self.assertNotIn(sha256, digests)
+        self.assertTrue(digests.add(sha256))
+        self.assertIn(sha256, digests)
+        self.assertEqual(len(digests), 101)
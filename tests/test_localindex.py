@@ -0,0 +1,201 @@
+import json
+import unittest
+from mock import MagicMock
+
+from camlistore.blobclient import Blob, BlobMeta
+from camlistore.localindex import LocalIndex
+
+
+def schema_blob(**kwargs):
+    kwargs["camliVersion"] = 1
+    return Blob(json.dumps(kwargs))
+
+
+def make_store(blobs):
+    # A fake blob client serving the given blobs
+    by_ref = {blob.blobref: blob for blob in blobs}
+    blob_client = MagicMock()
+    blob_client.get = MagicMock(side_effect=lambda ref: by_ref[ref])
+    blob_client.get_range = MagicMock(
+        side_effect=lambda ref, offset, length: (
+            by_ref[ref].data[offset:offset + length]
+        ),
+    )
+
+    def enumerate(after=None):
+        for blobref in sorted(by_ref):
+            if after is None or blobref > after:
+                yield BlobMeta(blobref, size=by_ref[blobref].size)
+
+    blob_client.enumerate = MagicMock(side_effect=enumerate)
+    return blob_client
+
+
+class TestLocalIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.chunk = Blob("hello")
+        self.file = schema_blob(
+            camliType="file",
+            fileName="hello.txt",
+            parts=[{"blobRef": self.chunk.blobref, "size": 5}],
+        )
+        self.members = schema_blob(
+            camliType="static-set",
+            members=[self.file.blobref],
+        )
+        self.dir = schema_blob(
+            camliType="directory",
+            fileName="docs",
+            entries=self.members.blobref,
+        )
+        self.permanode = schema_blob(camliType="permanode", random="1")
+        self.claims = [
+            schema_blob(
+                camliType="claim",
+                permaNode=self.permanode.blobref,
+                claimType="set-attribute",
+                claimDate="2013-01-01T00:00:00Z",
+                attribute="title",
+                value="First",
+            ),
+            schema_blob(
+                camliType="claim",
+                permaNode=self.permanode.blobref,
+                claimType="set-attribute",
+                claimDate="2013-01-02T00:00:00Z",
+                attribute="title",
+                value="Second",
+            ),
+        ]
+        self.all_blobs = [
+            self.chunk, self.file, self.members, self.dir, self.permanode,
+        ] + self.claims
+        self.blob_client = make_store(self.all_blobs)
+        self.index = LocalIndex(":memory:", self.blob_client)
+
+    def test_update(self):
+        self.assertEqual(self.index.update(batch_size=3), 7)
+        self.assertEqual(
+            self.index.last_blobref,
+            max(blob.blobref for blob in self.all_blobs),
+        )
+
+        # A second update resumes after the last blobref, so finds nothing
+        self.assertEqual(self.index.update(), 0)
+        self.blob_client.enumerate.assert_called_with(
+            after=self.index.last_blobref,
+        )
+
+    def test_chunks_not_fetched(self):
+        self.index.update()
+
+        # Every blob's first few bytes were fetched, but only the schema
+        # blobs were fetched in full.
+        self.assertEqual(
+            self.blob_client.get_range.call_count,
+            len(self.all_blobs),
+        )
+        fetched = set(
+            call[0][0] for call in self.blob_client.get.call_args_list
+        )
+        self.assertEqual(
+            fetched,
+            set(blob.blobref for blob in self.all_blobs[1:]),
+        )
+
+    def test_describe_directory(self):
+        self.index.update()
+
+        desc = self.index.describe_blob(self.dir.blobref)
+        self.assertEqual(desc.type, "directory")
+        self.assertEqual(desc.raw_dict["dir"]["fileName"], "docs")
+        self.assertEqual(desc.raw_dict["dirChildren"], [self.file.blobref])
+
+        child = desc.describe_another(self.file.blobref)
+        self.assertEqual(child.type, "file")
+        self.assertEqual(
+            child.raw_dict["file"],
+            {"fileName": "hello.txt", "size": 5},
+        )
+
+        from camlistore.exceptions import NotFoundError
+        self.assertRaises(
+            NotFoundError,
+            lambda: self.index.describe_blob("sha1-missing"),
+        )
+
+    def test_references(self):
+        self.index.update()
+        self.assertEqual(
+            self.index.references(self.file.blobref),
+            [self.chunk.blobref],
+        )
+        self.assertEqual(
+            self.index.referrers(self.file.blobref),
+            [self.members.blobref],
+        )
+        self.assertEqual(
+            self.index.referrers(self.permanode.blobref),
+            sorted(claim.blobref for claim in self.claims),
+        )
+        self.assertEqual(self.index.references(self.chunk.blobref), [])
+        self.assertEqual(self.index.referrers(self.dir.blobref), [])
+
+        # Re-recording a blob replaces its references.
+        with self.index.db:
+            self.index.add_blob(self.file.blobref, self.file.size, {
+                "camliType": "file",
+                "parts": [{"blobRef": "sha1-other", "size": 5}],
+            })
+        self.assertEqual(self.index.referrers(self.chunk.blobref), [])
+        self.assertEqual(
+            self.index.references(self.file.blobref),
+            ["sha1-other"],
+        )
+
+    def test_blobrefs_of_type(self):
+        self.index.update()
+        self.assertEqual(list(self.index.blobrefs_of_type("file")), [
+            self.file.blobref,
+        ])
+        self.assertEqual(
+            list(self.index.blobrefs_of_type("permanode", "claim")),
+            sorted(
+                [self.permanode.blobref] +
+                [claim.blobref for claim in self.claims]
+            ),
+        )
+
+    def test_permanodes(self):
+        from datetime import datetime
+
+        self.index.update()
+        permanode = self.permanode.blobref
+
+        claims = self.index.get_claims_for_permanode(permanode)
+        self.assertEqual(
+            [claim.value for claim in claims],
+            ["First", "Second"],
+        )
+        self.assertEqual(
+            self.index.permanode_attributes(permanode),
+            {"title": ["Second"]},
+        )
+        self.assertEqual(
+            self.index.permanode_attributes(
+                permanode,
+                at=datetime(2013, 1, 1, 12),
+            ),
+            {"title": ["First"]},
+        )
+        self.assertEqual(
+            self.index.describe_blob(permanode).raw_dict["permanode"],
+            {"attr": {"title": ["Second"]}},
+        )
+        self.assertEqual(
+            self.index.find_permanodes("title", "Second"),
+            [permanode],
+        )
+        self.assertEqual(self.index.find_permanodes("title", "First"), [])
+        self.assertEqual(self.index.find_permanodes("title"), [permanode])
@@ -0,0 +1,142 @@
+import unittest
+from mock import MagicMock
+
+import camlistore
+from camlistore.blobclient import Blob
+from camlistore.fakeserver import FakeServer
+from camlistore.metrics import (
+    LatencyHistogram,
+    MetricsAggregator,
+    RequestEvent,
+    observed_request,
+)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        self.assertEqual(histogram.percentile(50), None)
+        self.assertEqual(histogram.mean, None)
+
+        for i in xrange(90):
+            histogram.record(0.002)
+        for i in xrange(10):
+            histogram.record(0.3)
+
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.percentile(50), 0.0025)
+        self.assertEqual(histogram.percentile(90), 0.0025)
+        self.assertEqual(histogram.percentile(99), 0.3)
+        self.assertAlmostEqual(histogram.mean, 0.0318)
+
+
+class TestMetricsAggregator(unittest.TestCase):
+
+    def test_aggregate(self):
+        aggregator = MetricsAggregator()
+        aggregator(RequestEvent(
+            "get", "blob", blob_count=1, bytes_down=10, latency=0.01,
+            status=200,
+        ))
+        aggregator(RequestEvent(
+            "get", "blob", blob_count=1, latency=0.02, status=404,
+        ))
+        aggregator(RequestEvent(
+            "describe", "search", blob_count=2, cache_hit=True,
+        ))
+
+        snapshot = aggregator.snapshot()
+        self.assertEqual(snapshot["get"]["requests"], 2)
+        self.assertEqual(snapshot["get"]["errors"], 1)
+        self.assertEqual(snapshot["get"]["blobs"], 2)
+        self.assertEqual(snapshot["get"]["bytes_down"], 10)
+        self.assertEqual(snapshot["get"]["statuses"], {200: 1, 404: 1})
+        self.assertEqual(snapshot["get"]["latency"]["count"], 2)
+        self.assertEqual(snapshot["describe"]["requests"], 0)
+        self.assertEqual(snapshot["describe"]["cache_hits"], 1)
+
+        aggregator.reset()
+        self.assertEqual(aggregator.snapshot(), {})
+
+
+class TestObservedRequest(unittest.TestCase):
+
+    def test_no_observers(self):
+        http_session = MagicMock()
+        observed_request(
+            http_session, [], "get", "blob", "get", "http://example.com/",
+        )
+        http_session.get.assert_called_with("http://example.com/")
+
+    def test_observers(self):
+        http_session = MagicMock()
+        response = MagicMock()
+        response.status_code = 200
+        response.content = "hello"
+        http_session.request.return_value = response
+
+        events = []
+
+        def broken_observer(event):
+            raise Exception("this must not break the request")
+
+        resp = observed_request(
+            http_session,
+            [broken_observer, events.append],
+            "get_size", "blob", "head", "http://example.com/",
+            blob_count=1,
+        )
+        self.assertEqual(resp, response)
+        http_session.request.assert_called_with(
+            "HEAD", "http://example.com/",
+        )
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0].operation, "get_size")
+        self.assertEqual(events[0].status, 200)
+        self.assertEqual(events[0].bytes_down, 0)
+
+    def test_error(self):
+        http_session = MagicMock()
+        http_session.get.side_effect = IOError("dummy")
+        events = []
+
+        self.assertRaises(
+            IOError,
+            lambda: observed_request(
+                http_session, [events.append],
+                "get", "blob", "get", "http://example.com/",
+            ),
+        )
+        self.assertEqual(events[0].status, None)
+        self.assertEqual(type(events[0].error), IOError)
+
+
+class TestConnectionObservers(unittest.TestCase):
+
+    def test_connection(self):
+        from camlistore.searchclient import DescribeCache
+
+        aggregator = MetricsAggregator()
+        with FakeServer() as server:
+            conn = camlistore.connect(server.url)
+            conn.add_observer(aggregator)
+            conn.searcher.describe_cache = DescribeCache()
+
+            blobref = conn.blobs.put(Blob("hello"))
+            conn.blobs.get(blobref)
+            conn.searcher.describe_blob(blobref)
+            conn.searcher.describe_blob(blobref)
+
+            conn.remove_observer(aggregator)
+            conn.blobs.get(blobref)
+
+        snapshot = aggregator.snapshot()
+        self.assertEqual(snapshot["stat"]["requests"], 1)
+        self.assertEqual(snapshot["upload"]["requests"], 1)
+        self.assertEqual(snapshot["upload"]["bytes_up"], 5)
+        self.assertEqual(snapshot["get"]["requests"], 1)
+        self.assertEqual(snapshot["get"]["bytes_down"], 5)
+        self.assertEqual(snapshot["describe"]["requests"], 1)
+        self.assertEqual(snapshot["describe"]["cache_misses"], 1)
+        self.assertEqual(snapshot["describe"]["cache_hits"], 1)
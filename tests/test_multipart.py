@@ -0,0 +1,108 @@
+import cgi
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import camlistore
+from camlistore.blobclient import Blob
+from camlistore.fakeserver import FakeServer
+from camlistore.multipart import MultipartBody
+
+
+class TestMultipartBody(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def parse(self, body):
+        data = body.read()
+        self.assertEqual(len(data), len(body))
+        form = cgi.FieldStorage(
+            fp=StringIO(data),
+            environ={
+                "REQUEST_METHOD": "POST",
+                "CONTENT_TYPE": body.content_type,
+                "CONTENT_LENGTH": str(len(data)),
+            },
+        )
+        return [(field.name, field.value) for field in form.list]
+
+    def test_sources(self):
+        path = os.path.join(self.tmpdir, "file")
+        with open(path, "wb") as f:
+            f.write("skipped file data")
+
+        with open(path, "rb") as f:
+            f.seek(8)
+            body = MultipartBody(
+                [
+                    ("string", "string data"),
+                    ("bytearray", bytearray("bytearray data")),
+                    ("buffer", buffer("buffer data")),
+                    ("memoryview", memoryview("memoryview data")),
+                    ("file", f),
+                    ("stringio", StringIO("stringio data")),
+                    ("empty", ""),
+                ],
+                chunk_size=3,
+            )
+            self.assertEqual(body.data_size, 73)
+            self.assertEqual(self.parse(body), [
+                ("string", "string data"),
+                ("bytearray", "bytearray data"),
+                ("buffer", "buffer data"),
+                ("memoryview", "memoryview data"),
+                ("file", "file data"),
+                ("stringio", "stringio data"),
+                ("empty", ""),
+            ])
+
+            # A rewound body produces the same data again.
+            body.rewind()
+            self.assertEqual(self.parse(body)[4], ("file", "file data"))
+
+    def test_special_file(self):
+        # The size of a file that isn't a regular file isn't taken from
+        # its file descriptor, whose size is meaningless.
+        (read_fd, write_fd) = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        data = StringIO("special file data")
+        data.fileno = lambda: read_fd
+
+        body = MultipartBody([("special", data)])
+        self.assertEqual(body.data_size, 17)
+        self.assertEqual(self.parse(body), [("special", "special file data")])
+
+    def test_small_reads(self):
+        body = MultipartBody([("a", "x" * 1000), ("b", "y" * 10)])
+        whole = body.read()
+        body.rewind()
+        pieces = []
+        while True:
+            piece = body.read(7)
+            if not piece:
+                break
+            self.assertTrue(len(piece) <= 7)
+            pieces.append(piece)
+        self.assertEqual("".join(pieces), whole)
+        self.assertEqual("".join(iter(body)), whole)
+
+    def test_truncated_file(self):
+        f = StringIO("short")
+        body = MultipartBody([("file", f)])
+        f.truncate(2)
+        self.assertRaises(IOError, body.read)
+
+    def test_upload(self):
+        blobs = [Blob("blob %i" % i * 1000) for i in xrange(5)]
+        with FakeServer() as server:
+            conn = camlistore.connect(server.url)
+            conn.blobs.put_multi(*(blobs + blobs[:1]))
+            for blob in blobs:
+                self.assertEqual(server.storage.get(blob.blobref), blob.data)
@@ -0,0 +1,133 @@
+import time
+import unittest
+from mock import MagicMock
+
+from camlistore.blobclient import Blob
+from camlistore.exceptions import NotFoundError, ServerError
+from camlistore.fakeserver import FakeServer
+from camlistore.replicas import ReplicaSet, connect_replicas
+
+
+class TestReplicatedConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = [FakeServer(), FakeServer()]
+        for server in self.servers:
+            server.start()
+        self.blobref = None
+        for server in self.servers:
+            self.blobref = server.add_blob("hello")
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def connect(self, **kwargs):
+        conn = connect_replicas(
+            [server.url for server in self.servers],
+            **kwargs
+        )
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_spreads_reads(self):
+        conn = self.connect(hedge_percentile=None)
+        for i in xrange(20):
+            self.assertEqual(conn.blobs.get(self.blobref).data, "hello")
+
+        for server in self.servers:
+            self.assertTrue(server.request_counts.get("get", 0) > 0)
+
+    def test_failover(self):
+        conn = self.connect(hedge_percentile=None)
+        self.servers[0].inject_error(count=100, operation="head")
+
+        for i in xrange(5):
+            self.assertEqual(conn.blobs.get_size(self.blobref), 5)
+
+        # The first server failed repeatedly, so it has been ejected
+        self.assertEqual(
+            conn.blobs.replicas.healthy_clients(),
+            [conn.connections[1].blobs],
+        )
+
+    def test_all_fail(self):
+        conn = self.connect(hedge_percentile=None)
+        for server in self.servers:
+            server.inject_error(operation="get")
+        self.assertRaises(ServerError, conn.blobs.get, self.blobref)
+
+    def test_not_found(self):
+        conn = self.connect(hedge_percentile=None)
+        # Only one replica has this blob
+        blobref = self.servers[1].add_blob("only on one")
+        for i in xrange(4):
+            self.assertEqual(conn.blobs.get(blobref).data, "only on one")
+
+        self.assertRaises(NotFoundError, conn.blobs.get, "sha1-missing")
+        self.assertEqual(conn.blobs.blob_exists("sha1-missing"), False)
+
+    def test_hedging(self):
+        self.servers[0].latency = 1.0
+        conn = self.connect(initial_hedge_delay=0.05, slow_factor=None)
+
+        start = time.time()
+        self.assertEqual(conn.blobs.get(self.blobref).data, "hello")
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(self.servers[1].request_counts["get"], 1)
+
+    def test_writes(self):
+        conn = self.connect()
+        blobref = conn.blobs.put(Blob("primary"))
+        self.assertEqual(self.servers[0].storage.get(blobref), "primary")
+        self.assertEqual(self.servers[1].storage.get(blobref), None)
+
+        conn = self.connect(write_to_all=True)
+        blobref = conn.blobs.put(Blob("everywhere"))
+        for server in self.servers:
+            self.assertEqual(server.storage.get(blobref), "everywhere")
+
+    def test_search(self):
+        conn = self.connect()
+        desc = conn.searcher.describe_blob(self.blobref)
+        self.assertEqual(desc.blobref, self.blobref)
+
+
+class TestReplicaSet(unittest.TestCase):
+
+    def test_slow_ejection(self):
+        now = [0.0]
+        replicas = ReplicaSet(
+            [MagicMock(), MagicMock()],
+            slow_factor=5,
+            clock=lambda: now[0],
+        )
+        (fast, slow) = replicas._endpoints
+
+        for i in xrange(5):
+            fast.inflight += 1
+            replicas._record("get", fast, 0.01, True)
+            slow.inflight += 1
+            replicas._record("get", slow, 0.2, True)
+
+        self.assertEqual(replicas.healthy_clients(), [fast.client])
+
+        # Ejected replicas return once the ejection time has passed
+        now[0] += replicas.ejection_time
+        self.assertEqual(
+            replicas.healthy_clients(),
+            [fast.client, slow.client],
+        )
+
+    def test_hedge_delay(self):
+        replicas = ReplicaSet([MagicMock()], initial_hedge_delay=0.1)
+        self.assertEqual(replicas._hedge_delay("get"), 0.1)
+
+        endpoint = replicas._endpoints[0]
+        for i in xrange(100):
+            endpoint.inflight += 1
+            replicas._record("get", endpoint, 0.004, True)
+        self.assertEqual(replicas._hedge_delay("get"), 0.004)
+
+        replicas.hedge_percentile = None
+        self.assertEqual(replicas._hedge_delay("get"), None)
@@ -0,0 +1,71 @@
+import unittest
+
+from camlistore.schema import parse_schema, schema_references, file_size
+
+
+class TestSchema(unittest.TestCase):
+
+    def test_parse_schema(self):
+        self.assertEqual(
+            parse_schema('{"camliVersion": 1, "camliType": "permanode"}'),
+            {"camliVersion": 1, "camliType": "permanode"},
+        )
+        self.assertEqual(parse_schema('not json'), None)
+        self.assertEqual(parse_schema('{"other": 1}'), None)
+        self.assertEqual(parse_schema('{"camliVersion": 1'), None)
+        self.assertEqual(parse_schema('[1, 2]'), None)
+
+    def test_references(self):
+        self.assertEqual(
+            schema_references({
+                "camliType": "file",
+                "parts": [
+                    {"blobRef": "sha1-a", "size": 3},
+                    {"bytesRef": "sha1-b", "size": 5},
+                ],
+            }),
+            ["sha1-a", "sha1-b"],
+        )
+        self.assertEqual(
+            schema_references({
+                "camliType": "directory",
+                "entries": "sha1-set",
+            }),
+            ["sha1-set"],
+        )
+        self.assertEqual(
+            schema_references({
+                "camliType": "static-set",
+                "members": ["sha1-a", "sha1-b"],
+            }),
+            ["sha1-a", "sha1-b"],
+        )
+        self.assertEqual(
+            schema_references({
+                "camliType": "claim",
+                "camliSigner": "sha1-key",
+                "permaNode": "sha1-pn",
+                "claimType": "set-attribute",
+                "attribute": "camliContent",
+                "value": "sha1-content",
+            }),
+            ["sha1-key", "sha1-pn", "sha1-content"],
+        )
+        self.assertEqual(
+            schema_references({
+                "camliType": "claim",
+                "permaNode": "sha1-pn",
+                "attribute": "title",
+                "value": "not a ref",
+            }),
+            ["sha1-pn"],
+        )
+
+    def test_file_size(self):
+        self.assertEqual(
+            file_size({
+                "camliType": "file",
+                "parts": [{"size": 3}, {"size": 5}],
+            }),
+            8,
+        )
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import MagicMock
+
+import camlistore
+from camlistore.blobclient import BlobMeta
+from camlistore.exceptions import NotFoundError
+from camlistore.fakeserver import FakeServer
+from camlistore.scrub import Scrubber, _TokenBucket
+
+
+class TestScrubber(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.server.start()
+        self.blobs = camlistore.connect(self.server.url).blobs
+        self.blobrefs = sorted(
+            self.server.add_blob("blob %i" % i) for i in xrange(50)
+        )
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_clean(self):
+        report = Scrubber(self.blobs).scrub()
+        self.assertTrue(report.ok)
+        self.assertEqual(report.blob_count, 50)
+        self.assertEqual(
+            report.byte_count,
+            sum(len("blob %i" % i) for i in xrange(50)),
+        )
+        self.assertEqual(report.last_blobref, self.blobrefs[-1])
+
+    def test_corrupt(self):
+        corrupt_ref = self.blobrefs[10]
+        self.server.storage.put(corrupt_ref, "not the right data")
+
+        found = []
+        report = Scrubber(self.blobs).scrub(on_problem=found.append)
+
+        self.assertFalse(report.ok)
+        self.assertEqual(report.blob_count, 50)
+        self.assertEqual(found, report.problems)
+        self.assertEqual(
+            [(p.blobref, p.kind) for p in report.problems],
+            [(corrupt_ref, "corrupt")],
+        )
+
+    def test_after(self):
+        report = Scrubber(self.blobs).scrub(after=self.blobrefs[39])
+        self.assertEqual(report.blob_count, 10)
+        self.assertEqual(report.last_blobref, self.blobrefs[-1])
+
+    def test_checkpoint(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            checkpoint_path = os.path.join(tmpdir, "checkpoint")
+            with open(checkpoint_path, "w") as f:
+                f.write(self.blobrefs[29] + "\n")
+
+            report = Scrubber(self.blobs).scrub(
+                checkpoint_path=checkpoint_path,
+                checkpoint_interval=5,
+            )
+            self.assertEqual(report.blob_count, 20)
+            # The checkpoint is discarded once the scrub is complete
+            self.assertFalse(os.path.exists(checkpoint_path))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_size_and_missing(self):
+        blob_client = MagicMock()
+        blob_client.enumerate.return_value = [
+            BlobMeta("sha1-a", size=5),
+            BlobMeta("sha1-b", size=5),
+            BlobMeta("sha1-c", size=3),
+        ]
+
+        def download(blobref, f):
+            if blobref == "sha1-b":
+                raise NotFoundError("Blob not found: sha1-b")
+            f.write("hello")
+            return 5
+
+        blob_client.download = MagicMock(side_effect=download)
+
+        report = Scrubber(blob_client, concurrency=1).scrub()
+        self.assertEqual(
+            [(p.blobref, p.kind) for p in report.problems],
+            [("sha1-b", "missing"), ("sha1-c", "size")],
+        )
+        self.assertEqual(
+            [p.blobref for p in report.problems_of_kind("size")],
+            ["sha1-c"],
+        )
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_consume(self):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        bucket = _TokenBucket(100, clock=lambda: now[0], sleep=sleep)
+
+        # The first second's worth is available immediately
+        bucket.consume(100)
+        self.assertEqual(sleeps, [])
+
+        bucket.consume(50)
+        self.assertEqual(sleeps, [0.5])
+
+        # Idle time refills the bucket, but only up to its capacity
+        now[0] += 10
+        bucket.consume(100)
+        self.assertEqual(sleeps, [0.5])
@@ -1,4 +1,5 @@
 
+import json
 import unittest
 from mock import MagicMock
 
@@ -7,6 +8,9 @@ from camlistore.searchclient import (
     ClaimMeta,
     SearchResult,
     BlobDescription,
+    DescribeCache,
+    parse_claims,
+    parse_time,
 )
 
 
@@ -112,6 +116,142 @@ class TestSearchClient(unittest.TestCase):
             }
         )
 
+    def test_describe_blob_at(self):
+        from datetime import datetime
+
+        http_session = MagicMock()
+        http_session.get = MagicMock()
+
+        response = MagicMock()
+        http_session.get.return_value = response
+
+        response.status_code = 200
+        response.content = """
+        {
+            "meta": {
+                "dummy1": {
+                    "blobRef": "dummy1"
+                }
+            }
+        }
+        """
+
+        searcher = SearchClient(
+            http_session=http_session,
+            base_url="http://example.com/s/",
+        )
+
+        searcher.describe_blob(
+            "dummy1",
+            at=datetime(2013, 2, 13, 12, 32, 34, 123000),
+        )
+
+        http_session.get.assert_called_with(
+            'http://example.com/s/camli/search/describe',
+            params={
+                'blobref': 'dummy1',
+                'at': '2013-02-13T12:32:34.123000Z',
+            }
+        )
+
+    def test_describe_blob_cached(self):
+        http_session = MagicMock()
+        http_session.get = MagicMock()
+
+        response = MagicMock()
+        http_session.get.return_value = response
+
+        response.status_code = 200
+        response.content = """
+        {
+            "meta": {
+                "dummy1": {
+                    "blobRef": "dummy1"
+                },
+                "dummy2": {
+                    "blobRef": "dummy2"
+                }
+            }
+        }
+        """
+
+        searcher = SearchClient(
+            http_session=http_session,
+            base_url="http://example.com/s/",
+            describe_cache=DescribeCache(),
+        )
+
+        searcher.describe_blob("dummy1")
+        self.assertEqual(http_session.get.call_count, 1)
+
+        # Both the requested blob and the related blob are now cached.
+        result = searcher.describe_blob("dummy1")
+        self.assertEqual(result.blobref, "dummy1")
+        result = searcher.describe_blob("dummy2")
+        self.assertEqual(result.blobref, "dummy2")
+        self.assertEqual(http_session.get.call_count, 1)
+
+        # Another description of the related blob also comes from the cache
+        other = result.describe_another("dummy1")
+        self.assertEqual(other.blobref, "dummy1")
+        self.assertEqual(http_session.get.call_count, 1)
+
+        # Asking for fresh data bypasses the cache
+        searcher.describe_blob("dummy1", max_age=0)
+        self.assertEqual(http_session.get.call_count, 2)
+
+    def test_describe_blobs(self):
+        http_session = MagicMock()
+        http_session.post = MagicMock()
+
+        response = MagicMock()
+        http_session.post.return_value = response
+
+        response.status_code = 200
+        response.content = """
+        {
+            "meta": {
+                "dummy2": {
+                    "blobRef": "dummy2"
+                },
+                "dummy3": {
+                    "blobRef": "dummy3"
+                }
+            }
+        }
+        """
+
+        cache = DescribeCache()
+        cache.add({"dummy1": {"blobRef": "dummy1"}})
+
+        searcher = SearchClient(
+            http_session=http_session,
+            base_url="http://example.com/s/",
+            describe_cache=cache,
+        )
+
+        result = searcher.describe_blobs(
+            ["dummy1", "dummy2", "missing"],
+            depth=2,
+        )
+
+        # dummy1 was already cached, so it isn't requested
+        (args, kwargs) = http_session.post.call_args
+        self.assertEqual(
+            args,
+            ('http://example.com/s/camli/search/describe',),
+        )
+        self.assertEqual(
+            json.loads(kwargs["data"]),
+            {"depth": 2, "blobrefs": ["dummy2", "missing"]},
+        )
+        self.assertEqual(
+            sorted(result.keys()),
+            ["dummy1", "dummy2"],
+        )
+        self.assertEqual(result["dummy2"].blobref, "dummy2")
+        self.assertEqual(cache.get("dummy3"), {"blobRef": "dummy3"})
+
     def test_get_claims_for_permanode(self):
         http_session = MagicMock()
         http_session.get = MagicMock()
@@ -215,6 +355,107 @@ class TestClaimMeta(unittest.TestCase):
         )
 
 
+class TestParseTime(unittest.TestCase):
+
+    def test_rfc3339(self):
+        from dateutil.tz import tzutc, tzoffset
+        from datetime import datetime
+
+        self.assertEqual(
+            parse_time("2013-02-13T12:32:34Z"),
+            datetime(2013, 2, 13, 12, 32, 34, tzinfo=tzutc()),
+        )
+        self.assertEqual(
+            parse_time("2013-02-13T12:32:34.123456789Z"),
+            datetime(2013, 2, 13, 12, 32, 34, 123456, tzinfo=tzutc()),
+        )
+        self.assertEqual(
+            parse_time("2013-02-13T12:32:34.5-08:00"),
+            datetime(
+                2013, 2, 13, 12, 32, 34, 500000,
+                tzinfo=tzoffset(None, -8 * 3600),
+            ),
+        )
+
+    def test_fallback(self):
+        from dateutil.tz import tzutc
+        from datetime import datetime
+
+        self.assertEqual(
+            parse_time("13 Feb 2013 12:32:34 UTC"),
+            datetime(2013, 2, 13, 12, 32, 34, tzinfo=tzutc()),
+        )
+
+    def test_parse_claims(self):
+        claims = parse_claims([
+            {"blobref": "c3", "date": "2013-02-13T12:00:00Z"},
+            {"blobref": "c1", "date": "2013-02-11T12:00:00Z"},
+            {"blobref": "c2", "date": "2013-02-13T12:00:00Z"},
+            {"blobref": "c0"},
+        ])
+        self.assertEqual(
+            [claim.blobref for claim in claims],
+            ["c0", "c1", "c2", "c3"],
+        )
+
+    def test_time_memoized(self):
+        claim = ClaimMeta({"date": "2013-02-13T12:32:34Z"})
+        self.assertTrue(claim.time is claim.time)
+
+
+class TestDescribeCache(unittest.TestCase):
+
+    def test_max_age(self):
+        now = [100]
+        cache = DescribeCache(max_age=10, clock=lambda: now[0])
+        cache.add({"dummy1": {"blobRef": "dummy1"}})
+
+        self.assertEqual(cache.get("dummy1"), {"blobRef": "dummy1"})
+        self.assertEqual(cache.get("dummy2"), None)
+        # Asking for fresh data bypasses the cache, even when the clock
+        # hasn't moved on.
+        self.assertEqual(cache.get("dummy1", max_age=0), None)
+        self.assertEqual(cache.get("dummy1"), {"blobRef": "dummy1"})
+
+        now[0] = 105
+        self.assertEqual(cache.get("dummy1", max_age=2), None)
+        self.assertEqual(cache.get("dummy1"), {"blobRef": "dummy1"})
+
+        now[0] = 111
+        self.assertEqual(
+            cache.get("dummy1", max_age=20),
+            {"blobRef": "dummy1"},
+        )
+        self.assertEqual(cache.get("dummy1"), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_max_entries(self):
+        cache = DescribeCache(max_entries=2)
+        cache.add({"dummy1": {}})
+        cache.add({"dummy2": {}})
+        cache.get("dummy1")  # dummy2 is now least-recently-used
+        cache.add({"dummy3": {}})
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("dummy1"), {})
+        self.assertEqual(cache.get("dummy2"), None)
+        self.assertEqual(cache.get("dummy3"), {})
+
+    def test_options(self):
+        cache = DescribeCache()
+        cache.add({"dummy1": {"current": True}})
+        cache.add({"dummy1": {"current": False}}, options=(("at", "x"),))
+
+        self.assertEqual(cache.get("dummy1"), {"current": True})
+        self.assertEqual(
+            cache.get("dummy1", options=(("at", "x"),)),
+            {"current": False},
+        )
+
+        cache.invalidate("dummy1")
+        self.assertEqual(len(cache), 0)
+
+
 class TestBlobDescription(unittest.TestCase):
 
     def test_describe_another(self):
@@ -246,3 +487,75 @@ class TestBlobDescription(unittest.TestCase):
         searcher.describe_blob.assert_called_with(
             "other",
         )
+
+    def test_permanode_view(self):
+        descr = BlobDescription(MagicMock(), {
+            "blobRef": "sha1-perm",
+            "camliType": "permanode",
+            "permanode": {
+                "attr": {
+                    u"title": [u"Holiday"],
+                    u"tag": [u"beach", u"sun"],
+                    u"camliContent": [u"sha1-content"],
+                    u"empty": [],
+                },
+            },
+        })
+
+        view = descr.permanode
+        self.assertIs(descr.permanode, view)
+        self.assertEqual(view.get("title"), u"Holiday")
+        self.assertEqual(view.get("tag"), u"beach")
+        self.assertEqual(view.get_all("tag"), [u"beach", u"sun"])
+        self.assertEqual(view.get("missing", "default"), "default")
+        self.assertEqual(view.get_all("missing"), [])
+        self.assertEqual(view.content_blobref, u"sha1-content")
+        self.assertIn("title", view)
+        self.assertNotIn("empty", view)
+        self.assertIsNone(descr.file)
+        self.assertIsNone(descr.directory)
+
+        # Names are interned, so are shared between descriptions.
+        other = BlobDescription(MagicMock(), {
+            "permanode": {"attr": {u"title": [u"Other"]}},
+        })
+        self.assertIs(
+            [name for name in view.attrs if name == "title"][0],
+            list(other.permanode.attrs)[0],
+        )
+
+    def test_file_view(self):
+        descr = BlobDescription(MagicMock(), {
+            "blobRef": "sha1-file",
+            "camliType": "file",
+            "file": {
+                "fileName": "photo.jpg",
+                "size": 1234,
+                "mimeType": "image/jpeg",
+                "wholeRef": "sha1-whole",
+            },
+        })
+
+        view = descr.file
+        self.assertIs(descr.file, view)
+        self.assertEqual(view.file_name, "photo.jpg")
+        self.assertEqual(view.size, 1234)
+        self.assertEqual(view.mime_type, "image/jpeg")
+        self.assertEqual(view.whole_ref, "sha1-whole")
+        self.assertIsNone(descr.permanode)
+        self.assertRaises(AttributeError, setattr, view, "other", 1)
+        self.assertRaises(AttributeError, setattr, descr, "other", 1)
+
+    def test_directory_view(self):
+        descr = BlobDescription(MagicMock(), {
+            "blobRef": "sha1-dir",
+            "camliType": "directory",
+            "dir": {"fileName": "docs"},
+            "dirChildren": ["sha1-a", "sha1-b"],
+        })
+
+        view = descr.directory
+        self.assertIs(descr.directory, view)
+        self.assertEqual(view.file_name, "docs")
+        self.assertEqual(view.children, ["sha1-a", "sha1-b"])
+        self.assertIsNone(descr.file)
@@ -0,0 +1,126 @@
+import unittest
+
+from camlistore.blobclient import Blob
+from camlistore.fakeserver import FakeServer
+from camlistore.sharding import HashRing, connect_shards
+
+
+class TestHashRing(unittest.TestCase):
+
+    def test_distribution(self):
+        ring = HashRing(["a", "b", "c"])
+        keys = ["sha1-%040x" % i for i in xrange(3000)]
+        counts = {}
+        for key in keys:
+            node = ring.node_for(key)
+            counts[node] = counts.get(node, 0) + 1
+
+        self.assertEqual(sorted(counts), ["a", "b", "c"])
+        for count in counts.values():
+            self.assertTrue(700 < count < 1300, counts)
+
+    def test_minimal_movement(self):
+        ring = HashRing(["a", "b", "c"])
+        keys = ["sha1-%040x" % i for i in xrange(3000)]
+        before = {key: ring.node_for(key) for key in keys}
+
+        ring.add_node("d")
+        moved = [key for key in keys if ring.node_for(key) != before[key]]
+
+        # Only keys claimed by the new node move, about a quarter of them
+        self.assertTrue(all(ring.node_for(key) == "d" for key in moved))
+        self.assertTrue(500 < len(moved) < 1000, len(moved))
+
+        ring.remove_node("d")
+        self.assertEqual({key: ring.node_for(key) for key in keys}, before)
+
+    def test_duplicate_node(self):
+        ring = HashRing(["a"])
+        self.assertRaises(ValueError, ring.add_node, "a")
+
+    def test_empty(self):
+        self.assertRaises(ValueError, HashRing().node_for, "sha1-dummy")
+
+
+class TestShardedBlobClient(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = [FakeServer() for i in xrange(4)]
+        for server in self.servers:
+            server.start()
+        self.urls = [server.url for server in self.servers]
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def test_placement(self):
+        blobs = connect_shards(self.urls[:3])
+        data = [Blob("blob %i" % i) for i in xrange(60)]
+
+        blobrefs = blobs.put_multi(*data)
+        self.assertEqual(blobrefs, [blob.blobref for blob in data])
+
+        for blob in data:
+            shard = blobs.shard_for(blob.blobref)
+            server = self.servers[self.urls.index(shard)]
+            self.assertEqual(server.storage.get(blob.blobref), blob.data)
+            self.assertEqual(blobs.get(blob.blobref).data, blob.data)
+
+        for server in self.servers[:3]:
+            self.assertEqual(server.request_counts["upload"], 1)
+
+        # The same worker threads are used for every operation on several
+        # shards, until the client is closed.
+        pool = blobs._pool
+        self.assertNotEqual(pool, None)
+        sizes = blobs.get_size_multi("sha1-missing", *blobrefs)
+        self.assertEqual(sizes["sha1-missing"], None)
+        self.assertEqual(sizes[data[5].blobref], len(data[5].data))
+        self.assertTrue(blobs._pool is pool)
+        blobs.close()
+        self.assertEqual(blobs._pool, None)
+
+        self.assertEqual(
+            [meta.blobref for meta in blobs.enumerate()],
+            sorted(blobrefs),
+        )
+        self.assertEqual(
+            [meta.blobref for meta in blobs.enumerate(after=blobrefs[0])],
+            sorted(ref for ref in blobrefs if ref > blobrefs[0]),
+        )
+
+    def test_rebalance(self):
+        import camlistore
+
+        blobs = connect_shards(self.urls[:3])
+        self.addCleanup(blobs.close)
+        data = [Blob("blob %i" % i) for i in xrange(60)]
+        blobs.put_multi(*data)
+
+        blobs.add_shard(self.urls[3], camlistore.connect(self.urls[3]).blobs)
+        moved = [
+            blob for blob in data
+            if blobs.shard_for(blob.blobref) == self.urls[3]
+        ]
+        self.assertTrue(moved)
+
+        self.assertEqual(blobs.rebalance(batch_size=5), len(moved))
+        for blob in data:
+            self.assertEqual(blobs.get(blob.blobref).data, blob.data)
+
+        # Copies left on the old shards aren't enumerated twice
+        self.assertEqual(len(list(blobs.enumerate())), len(data))
+
+        # Blobs already copied aren't fetched or copied again
+        gets = sum(
+            server.request_counts.get("get", 0) for server in self.servers
+        )
+        self.assertEqual(blobs.rebalance(batch_size=5), 0)
+        self.assertEqual(
+            sum(
+                server.request_counts.get("get", 0)
+                for server in self.servers
+            ),
+            gets,
+        )
@@ -0,0 +1,278 @@
+import json
+import Queue
+import unittest
+from mock import patch
+
+import camlistore
+from camlistore.fakeserver import FakeServer
+from camlistore.subscription import QuerySubscription, ResultChange
+
+
+class TestQuerySubscription(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.server.start()
+        self.searcher = camlistore.connect(self.server.url).searcher
+        self.blob_count = 0
+        self.permanodes = [self.add_permanode("Hello") for i in range(2)]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def add_permanode(self, title):
+        permanode = self.server.add_blob(json.dumps({
+            "camliVersion": 1,
+            "camliType": "permanode",
+            "random": "%i" % self.next_count(),
+        }))
+        self.set_title(permanode, title)
+        return permanode
+
+    def set_title(self, permanode, title):
+        self.server.add_blob(json.dumps({
+            "camliVersion": 1,
+            "camliType": "claim",
+            "permaNode": permanode,
+            "claimType": "set-attribute",
+            "claimDate": "2013-01-01T00:00:%02iZ" % self.next_count(),
+            "attribute": "title",
+            "value": title,
+        }))
+
+    def next_count(self):
+        self.blob_count += 1
+        return self.blob_count
+
+    def subscribe(self, **kwargs):
+        changes = Queue.Queue()
+        kwargs.setdefault("poll_interval", 0.01)
+        kwargs.setdefault("max_reconnect_delay", 0.01)
+        subscription = self.searcher.subscribe(
+            "attr:title:Hello",
+            callback=changes.put,
+            **kwargs
+        )
+        self.addCleanup(subscription.close)
+        return (subscription, changes)
+
+    def test_poll(self):
+        (subscription, changes) = self.subscribe(use_websocket=False)
+
+        change = changes.get(timeout=5)
+        self.assertEqual(type(change), ResultChange)
+        self.assertEqual(sorted(change.added), sorted(self.permanodes))
+        self.assertEqual(change.removed, [])
+        self.assertEqual(change.descriptions, {})
+        self.assertEqual(subscription.mode, "poll")
+
+        new_permanode = self.add_permanode("Hello")
+        change = changes.get(timeout=5)
+        self.assertEqual(change.added, [new_permanode])
+        self.assertEqual(change.removed, [])
+
+        self.set_title(self.permanodes[0], "Goodbye")
+        change = changes.get(timeout=5)
+        self.assertEqual(change.added, [])
+        self.assertEqual(change.removed, [self.permanodes[0]])
+        self.assertEqual(
+            sorted(change.results),
+            sorted([self.permanodes[1], new_permanode]),
+        )
+        self.assertEqual(sorted(subscription.results), sorted(change.results))
+
+        subscription.close()
+        self.assertFalse(subscription._thread.is_alive())
+
+    def test_describe(self):
+        (subscription, changes) = self.subscribe(
+            use_websocket=False,
+            describe=True,
+        )
+
+        change = changes.get(timeout=5)
+        self.assertEqual(
+            sorted(change.descriptions),
+            sorted(self.permanodes),
+        )
+        desc = change.descriptions[self.permanodes[0]]
+        self.assertEqual(desc.type, "permanode")
+        self.assertEqual(desc.permanode.get("title"), "Hello")
+
+    def test_known(self):
+        (subscription, changes) = self.subscribe(
+            use_websocket=False,
+            known=self.permanodes,
+        )
+
+        new_permanode = self.add_permanode("Hello")
+        change = changes.get(timeout=5)
+        self.assertEqual(change.added, [new_permanode])
+
+    def test_iterate(self):
+        subscription = QuerySubscription(
+            self.searcher,
+            "attr:title:Hello",
+            poll_interval=0.01,
+            use_websocket=False,
+        )
+        with subscription:
+            for change in subscription:
+                self.assertEqual(
+                    sorted(change.added),
+                    sorted(self.permanodes),
+                )
+                break
+
+    def test_reconnect_poll(self):
+        self.server.inject_error(status=500, count=3, operation="query")
+        (subscription, changes) = self.subscribe(use_websocket=False)
+
+        change = changes.get(timeout=5)
+        self.assertEqual(sorted(change.added), sorted(self.permanodes))
+        self.assertGreaterEqual(self.server.request_counts["query"], 4)
+
+    def test_reject(self):
+        # Errors that aren't the server's own failure aren't retried.
+        from camlistore.exceptions import ServerError
+
+        self.server.inject_error(status=401, count=1, operation="query")
+        subscription = QuerySubscription(
+            self.searcher,
+            "attr:title:Hello",
+            poll_interval=0.01,
+            max_reconnect_delay=0.01,
+            use_websocket=False,
+        )
+        with self.assertRaises(ServerError) as cm:
+            next(iter(subscription))
+        self.assertEqual(cm.exception.status_code, 401)
+        self.assertEqual(self.server.request_counts["query"], 1)
+
+    def test_websocket(self):
+        websocket = FakeWebsocketModule()
+        self.searcher.http_session.auth = ("user", "secret")
+
+        with patch(
+            "camlistore.subscription._websocket_module",
+            return_value=websocket,
+        ):
+            (subscription, changes) = self.subscribe()
+
+            connection = websocket.connections.get(timeout=5)
+            self.assertEqual(
+                connection.url,
+                "ws" + self.server.url[4:] + "my-search/camli/search/ws",
+            )
+            self.assertEqual(
+                connection.header,
+                ["Authorization: Basic dXNlcjpzZWNyZXQ="],
+            )
+            self.assertEqual(
+                json.loads(connection.sent.get(timeout=5)),
+                {"tag": "q", "query": {"expression": "attr:title:Hello"}},
+            )
+
+            connection.push([self.permanodes[0]])
+            change = changes.get(timeout=5)
+            self.assertEqual(change.added, [self.permanodes[0]])
+            self.assertEqual(subscription.mode, "websocket")
+
+            # Messages for other tags, and result sets that don't change
+            # anything, are not reported.
+            connection.messages.put(json.dumps({"tag": "other"}))
+            connection.push([self.permanodes[0]])
+            connection.push(self.permanodes)
+            change = changes.get(timeout=5)
+            self.assertEqual(change.added, [self.permanodes[1]])
+
+            # After the server closes the connection, the new connection's
+            # result set is compared with the results from before.
+            connection.messages.put("")
+            reconnection = websocket.connections.get(timeout=5)
+            self.assertTrue(connection.closed)
+            reconnection.push([self.permanodes[1]])
+            change = changes.get(timeout=5)
+            self.assertEqual(change.added, [])
+            self.assertEqual(change.removed, [self.permanodes[0]])
+
+            # Once the server stops supporting websockets, the
+            # subscription falls back to polling.
+            websocket.available = False
+            reconnection.messages.put(
+                websocket.WebSocketException("Connection reset"),
+            )
+            change = changes.get(timeout=5)
+            self.assertEqual(change.added, [self.permanodes[0]])
+            self.assertEqual(subscription.mode, "poll")
+            self.assertTrue(reconnection.closed)
+
+    def test_websocket_unavailable(self):
+        with patch(
+            "camlistore.subscription._websocket_module",
+            return_value=None,
+        ):
+            (subscription, changes) = self.subscribe()
+            change = changes.get(timeout=5)
+
+        self.assertEqual(sorted(change.added), sorted(self.permanodes))
+        self.assertEqual(subscription.mode, "poll")
+
+
+class FakeWebsocketModule(object):
+    # Stands in for the websocket-client module, serving connections whose
+    # messages are pushed by the test.
+
+    class WebSocketException(Exception):
+        pass
+
+    class WebSocketBadStatusException(WebSocketException):
+        pass
+
+    class WebSocketTimeoutException(WebSocketException):
+        pass
+
+    def __init__(self):
+        self.connections = Queue.Queue()
+        self.available = True
+
+    def create_connection(self, url, header=None, timeout=None):
+        if not self.available:
+            raise self.WebSocketBadStatusException("Handshake status 404")
+        connection = FakeWebsocket(self, url, header)
+        self.connections.put(connection)
+        return connection
+
+
+class FakeWebsocket(object):
+
+    def __init__(self, module, url, header):
+        self.module = module
+        self.url = url
+        self.header = header
+        self.sent = Queue.Queue()
+        self.messages = Queue.Queue()
+        self.closed = False
+
+    def push(self, blobrefs):
+        self.messages.put(json.dumps({
+            "tag": "q",
+            "result": {
+                "blobs": [{"blob": blobref} for blobref in blobrefs],
+            },
+        }))
+
+    def send(self, message):
+        self.sent.put(message)
+
+    def recv(self):
+        try:
+            message = self.messages.get(timeout=0.01)
+        except Queue.Empty:
+            raise self.module.WebSocketTimeoutException("Timed out")
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    def close(self):
+        self.closed = True
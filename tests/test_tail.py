@@ -0,0 +1,240 @@
+import os
+import Queue
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import camlistore
+from camlistore.blobclient import Blob
+from camlistore.fakeserver import FakeServer
+from camlistore.tail import BlobTail, TailCheckpoint
+
+
+class TestBlobTail(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.server.start()
+        self.blobs = camlistore.connect(self.server.url).blobs
+        self.blobrefs = [
+            self.server.add_blob("blob %i" % i) for i in range(10)
+        ]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def start_tail(self, **kwargs):
+        kwargs.setdefault("max_wait", 1)
+        kwargs.setdefault("min_interval", 0.01)
+        kwargs.setdefault("rescan_interval", 30)
+        tail = self.blobs.tail(**kwargs)
+        produced = Queue.Queue()
+
+        def run():
+            for meta in tail:
+                produced.put(meta)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+        def stop():
+            tail.close()
+            # Wake any long-polling request, so the tail sees it's closed.
+            self.server.add_blob("wake up")
+            thread.join()
+        self.addCleanup(stop)
+        return (tail, produced)
+
+    def take(self, produced, count):
+        return [produced.get(timeout=5) for i in range(count)]
+
+    def test_tail(self):
+        (tail, produced) = self.start_tail(rescan_interval=0.5)
+        self.assertEqual(type(tail), BlobTail)
+
+        metas = self.take(produced, len(self.blobrefs))
+        self.assertEqual(
+            [meta.blobref for meta in metas],
+            sorted(self.blobrefs),
+        )
+        self.assertEqual([meta.size for meta in metas], [6] * 10)
+
+        new_blobref = self.blobs.put(Blob("new blob"))
+        self.assertEqual(self.take(produced, 1)[0].blobref, new_blobref)
+        self.assertTrue(produced.empty())
+
+    def find_blob(self, before):
+        # Returns a new blob sorting before or after all existing blobs.
+        last_blobref = max(self.blobrefs)
+        i = 0
+        while (Blob("new %i" % i).blobref < last_blobref) != before:
+            i += 1
+        return Blob("new %i" % i)
+
+    def wait_for_long_poll(self):
+        # Waits until the tail has settled into a long-polling request.
+        count = None
+        while self.server.request_counts.get("enumerate", 0) != count:
+            count = self.server.request_counts.get("enumerate", 0)
+            threading.Event().wait(0.2)
+        return count
+
+    def test_blob_sorting_after_last(self):
+        late = self.find_blob(before=False)
+        (tail, produced) = self.start_tail(max_wait=30)
+        self.take(produced, len(self.blobrefs))
+        self.wait_for_long_poll()
+
+        # The blob is returned by the long-polling request, so it is
+        # produced without enumerating the whole store again.
+        self.blobs.put(late)
+        self.assertEqual(produced.get(timeout=2).blobref, late.blobref)
+        self.assertEqual(tail.checkpoint.scans, 1)
+
+    def test_blob_sorting_before_last(self):
+        early = self.find_blob(before=True)
+        (tail, produced) = self.start_tail(max_wait=30, rescan_interval=1)
+        self.take(produced, len(self.blobrefs))
+        self.wait_for_long_poll()
+        scans = tail.checkpoint.scans
+
+        # The new blob isn't returned by the long-polling request, which
+        # asks only for blobs after the last, so it is found by the next
+        # enumeration of the whole store.
+        self.blobs.put(early)
+        self.assertEqual(produced.get(timeout=3).blobref, early.blobref)
+        self.assertGreater(tail.checkpoint.scans, scans)
+
+    def test_rescan_interval(self):
+        early = self.find_blob(before=True)
+        late = self.find_blob(before=False)
+        (tail, produced) = self.start_tail(max_wait=30)
+        self.take(produced, len(self.blobrefs))
+        count = self.wait_for_long_poll()
+
+        # Rescans are put off until the interval has passed, but blobs
+        # sorting after the last are still produced straight away.
+        self.blobs.put(early)
+        self.blobs.put(late)
+        self.assertEqual(produced.get(timeout=2).blobref, late.blobref)
+        self.wait_for_long_poll()
+        self.assertTrue(produced.empty())
+        self.assertEqual(tail.checkpoint.scans, 1)
+        self.assertLessEqual(
+            self.server.request_counts["enumerate"],
+            count + 4,
+        )
+
+    def test_rescan_backoff(self):
+        scans = []
+        enumerate_blobs = self.blobs.enumerate
+
+        def slow_enumerate(after=None):
+            if after is None:
+                # A full enumeration of the store, which takes longer than
+                # the rescan interval.
+                started = time.time()
+                time.sleep(0.3)
+                for meta in enumerate_blobs(after=after):
+                    yield meta
+                scans.append((started, time.time()))
+            else:
+                for meta in enumerate_blobs(after=after):
+                    yield meta
+
+        self.blobs.enumerate = slow_enumerate
+        self.start_tail(rescan_interval=0.1)
+        deadline = time.time() + 5
+        while len(scans) < 3 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertGreaterEqual(len(scans), 3)
+
+        # Each rescan waits at least as long as the last one took.
+        for (previous, scan) in zip(scans, scans[1:]):
+            self.assertGreaterEqual(
+                scan[0] - previous[1],
+                (previous[1] - previous[0]) * 0.9,
+            )
+
+    def test_no_rescan(self):
+        early = self.find_blob(before=True)
+        late = self.find_blob(before=False)
+        (tail, produced) = self.start_tail(rescan_interval=None)
+        self.take(produced, len(self.blobrefs))
+        self.wait_for_long_poll()
+
+        self.blobs.put(early)
+        self.blobs.put(late)
+        self.assertEqual(produced.get(timeout=2).blobref, late.blobref)
+        self.assertRaises(Queue.Empty, produced.get, timeout=2)
+        self.assertEqual(tail.checkpoint.scans, 1)
+
+    def test_no_busy_polling(self):
+        (tail, produced) = self.start_tail(max_wait=30)
+        self.take(produced, len(self.blobrefs))
+
+        # Once idle, the tail waits in a single long-polling request.
+        self.assertEqual(self.wait_for_long_poll(), 2)
+
+    def test_resume(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "tail.db")
+
+        checkpoint = TailCheckpoint(path)
+        tail = self.blobs.tail(checkpoint=checkpoint)
+        produced = []
+        for meta in tail:
+            produced.append(meta.blobref)
+            if len(produced) == 4:
+                break
+        checkpoint.close()
+
+        # The last blob produced is recorded only once the next is asked
+        # for, so it is produced again.
+        checkpoint = TailCheckpoint(path)
+        self.assertEqual(len(checkpoint), 3)
+        self.assertEqual(checkpoint.after, produced[2])
+
+        new_blobref = self.server.add_blob("new blob")
+        expected = set(self.blobrefs + [new_blobref]) - set(produced[:3])
+        tail = self.blobs.tail(
+            checkpoint=checkpoint,
+            max_wait=1,
+            min_interval=0.01,
+            rescan_interval=0.5,
+        )
+        resumed = []
+        for meta in tail:
+            resumed.append(meta.blobref)
+            if len(resumed) == len(expected):
+                break
+
+        # The interrupted enumeration is finished first, and then any
+        # blobs sorting before where it resumed are found by the next.
+        self.assertEqual(set(resumed), expected)
+        self.assertEqual(len(set(resumed)), len(resumed))
+
+    def test_checkpoint(self):
+        checkpoint = TailCheckpoint(":memory:", check_same_thread=False)
+        self.assertEqual(len(checkpoint), 0)
+        self.assertEqual(checkpoint.after, None)
+        self.assertEqual(checkpoint.scans, 0)
+        self.assertEqual(checkpoint.last_blobref, None)
+
+        (tail, produced) = self.start_tail(checkpoint=checkpoint)
+        self.take(produced, len(self.blobrefs))
+        self.assertTrue(tail.checkpoint is checkpoint)
+        self.wait_for_long_poll()
+        self.assertEqual(len(checkpoint), len(self.blobrefs))
+        self.assertEqual(checkpoint.last_blobref, max(self.blobrefs))
+        self.assertIn(self.blobrefs[0], checkpoint)
+        self.assertNotIn(Blob("missing").blobref, checkpoint)
+        self.assertEqual(
+            checkpoint.seen([Blob("missing").blobref] + self.blobrefs),
+            set(self.blobrefs),
+        )
+        self.assertEqual(checkpoint.scans, 1)
@@ -0,0 +1,103 @@
+import unittest
+
+import camlistore
+from camlistore import tracing
+from camlistore.blobclient import Blob
+from camlistore.fakeserver import FakeServer
+
+
+class FakeSpan(object):
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = dict(attributes)
+        self.parent = None
+
+    def __enter__(self):
+        stack = self.tracer.stack
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.stack.pop()
+        self.tracer.finished.append(self)
+        return False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class FakeTracer(object):
+
+    def __init__(self):
+        self.stack = []
+        self.finished = []
+
+    def start_as_current_span(self, name, attributes=None):
+        return FakeSpan(self, name, attributes or {})
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        # Read directly rather than with get_tracer, so that a tracer that
+        # hasn't been loaded yet is restored as such.
+        self.old_tracer = tracing._tracer
+        self.tracer = FakeTracer()
+        tracing.set_tracer(self.tracer)
+
+    def tearDown(self):
+        tracing.set_tracer(self.old_tracer)
+
+    def test_null_span(self):
+        tracing.set_tracer(None)
+        with tracing.span("dummy", foo=1) as span:
+            span.set_attribute("bar", 2)
+
+    def test_put_multi(self):
+        with FakeServer() as server:
+            conn = camlistore.connect(server.url)
+            conn.blobs.put_multi(Blob("hello"), Blob("world"))
+
+        spans = [
+            (
+                span.name,
+                span.parent,
+                span.attributes.get("camlistore.operation"),
+            )
+            for span in self.tracer.finished
+        ]
+        self.assertEqual(
+            spans,
+            [
+                ("camlistore.request", "camlistore.put_multi", "stat"),
+                ("camlistore.request", "camlistore.put_multi", "upload"),
+                ("camlistore.put_multi", None, None),
+            ],
+        )
+        put_span = self.tracer.finished[-1]
+        self.assertEqual(put_span.attributes["camlistore.blob_count"], 2)
+        self.assertEqual(put_span.attributes["camlistore.bytes"], 10)
+        self.assertEqual(put_span.attributes["camlistore.upload_count"], 2)
+        self.assertEqual(
+            self.tracer.finished[1].attributes["http.status_code"],
+            200,
+        )
+
+    def test_describe_another(self):
+        from camlistore.searchclient import BlobDescription
+        from mock import MagicMock
+
+        descr = BlobDescription(
+            MagicMock(),
+            {},
+            other_raw_dicts={"baz": {"blobRef": "baz"}},
+        )
+        descr.describe_another("baz")
+
+        span = self.tracer.finished[-1]
+        self.assertEqual(span.name, "camlistore.describe_another")
+        self.assertEqual(span.attributes["camlistore.blobref"], "baz")
+        self.assertEqual(span.attributes["camlistore.related_hit"], True)
@@ -0,0 +1,160 @@
+import json
+import unittest
+from mock import MagicMock, patch
+
+from camlistore.searchclient import SearchClient
+
+
+# A small tree:
+#   root/
+#     a.txt
+#     sub/
+#       b.txt
+#       empty/
+TREE = {
+    "root": {
+        "blobRef": "root",
+        "camliType": "directory",
+        "dir": {"fileName": "root"},
+        "dirChildren": ["sub", "a"],
+    },
+    "a": {
+        "blobRef": "a",
+        "camliType": "file",
+        "file": {"fileName": "a.txt"},
+    },
+    "sub": {
+        "blobRef": "sub",
+        "camliType": "directory",
+        "dir": {"fileName": "sub"},
+        "dirChildren": ["b", "empty"],
+    },
+    "b": {
+        "blobRef": "b",
+        "camliType": "file",
+        "file": {"fileName": "b.txt"},
+    },
+    "empty": {
+        "blobRef": "empty",
+        "camliType": "directory",
+        "dir": {"fileName": "empty"},
+    },
+}
+
+
+def make_searcher(related=()):
+    # Fake describe endpoint that returns the requested blobs plus
+    # the given related blobs.
+    http_session = MagicMock()
+    requests = []
+
+    def post(url, data):
+        blobrefs = json.loads(data)["blobrefs"]
+        requests.append(blobrefs)
+        meta = {}
+        for blobref in list(blobrefs) + list(related):
+            meta[blobref] = TREE[blobref]
+        response = MagicMock()
+        response.status_code = 200
+        response.content = json.dumps({"meta": meta})
+        return response
+
+    http_session.post = MagicMock(side_effect=post)
+
+    searcher = SearchClient(
+        http_session=http_session,
+        base_url="http://example.com/s/",
+    )
+    return (searcher, requests)
+
+
+def summarize(results):
+    return sorted(
+        (
+            path,
+            [desc.blobref for desc in dirs],
+            [desc.blobref for desc in files],
+        )
+        for (path, dirs, files) in results
+    )
+
+
+class TestWalk(unittest.TestCase):
+
+    def test_walk(self):
+        (searcher, requests) = make_searcher()
+
+        results = list(searcher.walk("root", concurrency=2))
+
+        self.assertEqual(
+            summarize(results),
+            [
+                ("", ["sub"], ["a"]),
+                ("sub", ["empty"], ["b"]),
+                ("sub/empty", [], []),
+            ],
+        )
+        # The root's children are described together in one batch.
+        self.assertTrue(["sub", "a"] in requests)
+
+    def test_walk_reuses_related(self):
+        (searcher, requests) = make_searcher(related=("sub", "a"))
+
+        results = list(searcher.walk("root"))
+
+        self.assertEqual(len(results), 3)
+        # "sub" came back with the root, including its children, so it
+        # was never described on its own.
+        self.assertEqual(
+            sorted(requests),
+            [["b", "empty"], ["empty"], ["root"]],
+        )
+
+    def test_walk_prune(self):
+        (searcher, requests) = make_searcher()
+
+        paths = []
+        for (path, dirs, files) in searcher.walk("root"):
+            paths.append(path)
+            del dirs[:]
+
+        self.assertEqual(paths, [""])
+
+    def test_walk_nameless(self):
+        # A directory described without its name is walked under its
+        # blobref.
+        nameless = {
+            "blobRef": "nameless",
+            "camliType": "directory",
+        }
+        sub = dict(TREE["sub"], dirChildren=["b", "nameless"])
+        with patch.dict(TREE, {"nameless": nameless, "sub": sub}):
+            (searcher, requests) = make_searcher()
+            results = list(searcher.walk("root"))
+
+        self.assertEqual(
+            summarize(results),
+            [
+                ("", ["sub"], ["a"]),
+                ("sub", ["nameless"], ["b"]),
+                ("sub/nameless", [], []),
+            ],
+        )
+
+    def test_walk_not_found(self):
+        from camlistore.exceptions import NotFoundError
+
+        http_session = MagicMock()
+        response = MagicMock()
+        response.status_code = 200
+        response.content = '{"meta": {}}'
+        http_session.post.return_value = response
+
+        searcher = SearchClient(
+            http_session=http_session,
+            base_url="http://example.com/s/",
+        )
+        self.assertRaises(
+            NotFoundError,
+            lambda: list(searcher.walk("missing")),
+        )
@@ -0,0 +1,108 @@
+import threading
+import unittest
+from mock import MagicMock
+
+import camlistore
+from camlistore.blobclient import Blob
+from camlistore.fakeserver import FakeServer
+from camlistore.uploader import Uploader
+
+
+class TestUploader(unittest.TestCase):
+
+    def test_batches(self):
+        blob_client = MagicMock()
+        uploader = Uploader(
+            blob_client,
+            max_batch_count=2,
+            max_batch_bytes=1000,
+            concurrency=1,
+        )
+
+        blobs = [Blob("blob %i" % i) for i in xrange(5)]
+        for blob in blobs:
+            self.assertEqual(uploader.add(blob), blob.blobref)
+
+        blobrefs = uploader.close()
+
+        self.assertEqual(blobrefs, [blob.blobref for blob in blobs])
+        self.assertEqual(
+            [call[0] for call in blob_client.put_multi.call_args_list],
+            [tuple(blobs[0:2]), tuple(blobs[2:4]), tuple(blobs[4:5])],
+        )
+
+    def test_batch_bytes(self):
+        blob_client = MagicMock()
+        uploader = Uploader(blob_client, max_batch_bytes=10, concurrency=1)
+
+        uploader.add(Blob("x" * 6))
+        uploader.add(Blob("y" * 6))
+        uploader.add(Blob("z" * 6))
+        uploader.close()
+
+        self.assertEqual(
+            [len(call[0]) for call in blob_client.put_multi.call_args_list],
+            [2, 1],
+        )
+
+    def test_backpressure(self):
+        release = threading.Event()
+        started = threading.Event()
+        blob_client = MagicMock()
+
+        def put_multi(*blobs):
+            started.set()
+            release.wait()
+
+        blob_client.put_multi = MagicMock(side_effect=put_multi)
+        uploader = Uploader(
+            blob_client,
+            max_batch_count=1,
+            max_inflight_bytes=10,
+        )
+        uploader.add(Blob("x" * 8))
+        started.wait()
+
+        # The second blob doesn't fit in the budget until the first
+        # upload completes.
+        added = threading.Event()
+
+        def add_second():
+            uploader.add(Blob("y" * 8))
+            added.set()
+
+        thread = threading.Thread(target=add_second)
+        thread.start()
+        self.assertFalse(added.wait(0.1))
+
+        release.set()
+        self.assertTrue(added.wait(5))
+        thread.join()
+        uploader.close()
+        self.assertEqual(blob_client.put_multi.call_count, 2)
+
+    def test_error(self):
+        from camlistore.exceptions import ServerError
+
+        blob_client = MagicMock()
+        blob_client.put_multi.side_effect = ServerError("dummy")
+        uploader = Uploader(blob_client, max_batch_count=1)
+
+        uploader.add(Blob("hello"))
+        self.assertRaises(ServerError, uploader.flush)
+
+    def test_fake_server(self):
+        with FakeServer() as server:
+            conn = camlistore.connect(server.url)
+            conn.blobs.put(Blob("blob 0"))
+
+            with conn.blobs.uploader(max_batch_count=10) as uploader:
+                for i in xrange(25):
+                    uploader.add(Blob("blob %i" % i))
+
+            self.assertEqual(
+                len(list(conn.blobs.enumerate())),
+                25,
+            )
+            # one upload for the initial put, and three batches
+            self.assertEqual(server.request_counts["upload"], 4)